@@ -3,11 +3,15 @@ import requests
 from google.oauth2 import service_account
 from google.auth.transport import requests as google_requests
 import config
+import json_modules
+import metrics_modules
 
 
 # --- Auth ---
 def get_identity_token():
     """Get identity token from the GCP service account string."""
+    if config.AGENT_ENGINE_FAKE:
+        return "fake-token"
     if not config.GCP_SERVICE_ACCOUNT_STRING:
         raise ValueError("GCP_SERVICE_ACCOUNT environment variable not set.")
     service_info = json.loads(config.GCP_SERVICE_ACCOUNT_STRING)
@@ -21,6 +25,7 @@ def get_identity_token():
 
 
 # --- Session Management ---
+@metrics_modules.counted("agent_engine")
 def list_sessions(user_id: str):
     url = f"{config.ENDPOINT}:query"
     headers = {
@@ -31,11 +36,12 @@ def list_sessions(user_id: str):
         "class_method": "list_sessions",
         "input": {"user_id": user_id},
     }
-    resp = requests.post(url, headers=headers, data=json.dumps(body))
+    resp = requests.post(url, headers=headers, data=json_modules.dumps(body))
     resp.raise_for_status()
-    return resp.json().get("output", {}).get("sessions", [])
+    return json_modules.loads(resp.content).get("output", {}).get("sessions", [])
 
 
+@metrics_modules.counted("agent_engine")
 def create_session(user_id: str) -> str:
     url = f"{config.ENDPOINT}:query"
     headers = {
@@ -46,9 +52,9 @@ def create_session(user_id: str) -> str:
         "class_method": "create_session",
         "input": {"user_id": user_id},
     }
-    resp = requests.post(url, headers=headers, data=json.dumps(body))
+    resp = requests.post(url, headers=headers, data=json_modules.dumps(body))
     resp.raise_for_status()
-    data = resp.json()
+    data = json_modules.loads(resp.content)
     return data.get("output", {}).get("id") or data.get("sessionId")
 
 
@@ -59,6 +65,7 @@ def get_or_create_session(user_id: str) -> str:
     return create_session(user_id)
 
 
+@metrics_modules.counted("agent_engine")
 def get_session(user_id: str, session_id: str) -> dict:
     url = f"{config.ENDPOINT}:query"
     headers = {
@@ -69,12 +76,13 @@ def get_session(user_id: str, session_id: str) -> dict:
         "class_method": "get_session",
         "input": {"user_id": user_id, "session_id": session_id},
     }
-    resp = requests.post(url, headers=headers, data=json.dumps(body))
+    resp = requests.post(url, headers=headers, data=json_modules.dumps(body))
     resp.raise_for_status()
-    data = resp.json()
+    data = json_modules.loads(resp.content)
     return data
 
 
+@metrics_modules.counted("agent_engine")
 def delete_session(user_id: str, session_id: str) -> dict:
     url = f"{config.ENDPOINT}:query"
     headers = {
@@ -85,11 +93,72 @@ def delete_session(user_id: str, session_id: str) -> dict:
         "class_method": "delete_session",
         "input": {"user_id": user_id, "session_id": session_id},
     }
-    resp = requests.post(url, headers=headers, data=json.dumps(body))
+    resp = requests.post(url, headers=headers, data=json_modules.dumps(body))
     resp.raise_for_status()
-    data = resp.json()
+    data = json_modules.loads(resp.content)
     return data
 
 
-def list_messages(session):
-    pass
+def session_to_messages(session_data: dict) -> list[dict]:
+    """
+    Converts the events of a get_session response into transcript messages,
+    oldest first, in the same format the Streamlit app keeps in session state.
+    """
+    messages = []
+    events = session_data.get("output", session_data).get("events", []) or []
+    for event in events:
+        author = event.get("author", "")
+        content = event.get("content") or {}
+        if author == "answer_validator_agent" or not content.get("parts"):
+            continue
+        role = "user" if content.get("role") == "user" else "assistant"
+        for part in content["parts"]:
+            if part.get("text") and part.get("thought"):
+                messages.append(
+                    {
+                        "role": "thought",
+                        "type": "thought",
+                        "label": "Thought",
+                        "content": f"{author}'s thought: {part['text']}",
+                    }
+                )
+            elif part.get("text"):
+                messages.append(
+                    {
+                        "role": role,
+                        "type": "response",
+                        "label": "Response",
+                        "content": (
+                            part["text"] if role == "user" else f"{author}: {part['text']}"
+                        ),
+                    }
+                )
+            elif part.get("function_call"):
+                fc = part["function_call"]
+                messages.append(
+                    {
+                        "role": "thought",
+                        "type": "tool_call",
+                        "label": fc.get("name"),
+                        "content": fc.get("args"),
+                    }
+                )
+            elif part.get("function_response"):
+                fr = part["function_response"]
+                messages.append(
+                    {
+                        "role": "thought",
+                        "type": "tool_response",
+                        "label": fr.get("name"),
+                        "content": fr.get("response"),
+                    }
+                )
+    return messages
+
+
+def list_messages(user_id: str, session_id: str) -> list[dict]:
+    """
+    Returns the whole session transcript, oldest first. get_session has no paging,
+    so callers that show it page by page only page the rendering.
+    """
+    return session_to_messages(get_session(user_id, session_id))
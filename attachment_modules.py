@@ -0,0 +1,393 @@
+"""Attachment validation, buffering and preprocessing shared by the bots and engine_modules."""
+import codecs
+import collections
+import csv
+import functools
+import io
+import logging
+import config
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional ('attachments' extra): images are sent as is
+    Image = None
+    ImageOps = None
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pypdf is optional ('attachments' extra): PDFs are sent as files
+    PdfReader = None
+
+logger = logging.getLogger(__name__)
+
+# --- Necessary variables ---
+MAX_FILE_SIZE_BYTES = 20 * 1024 * 1024
+MIME_TYPE_MAPPING = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+    "pdf": "application/pdf",
+    "txt": "text/plain",
+    "csv": "text/plain",
+    # Aliases: Slack filetypes and MIME subtypes that name the same formats
+    "text": "text/plain",
+    "plain": "text/plain",
+    "x-csv": "text/plain",
+    "comma-separated-values": "text/plain",
+    "pjpeg": "image/jpeg",
+}
+SUPPORTED_MIME_TYPES = set([x for x in MIME_TYPE_MAPPING.values()])
+# Declared types that say nothing about the content: the bytes decide
+GENERIC_FILE_TYPES = {"", "octet-stream", "binary", "unknown", "x-unknown", "file"}
+# How much of a file is inspected to recognise its format
+SNIFF_BYTES = 512
+MAGIC_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"%PDF-", "application/pdf"),
+]
+# Byte order marks of UTF-16/32 text, which is full of NUL bytes
+TEXT_BOMS = (codecs.BOM_UTF32_LE, codecs.BOM_UTF32_BE, codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)
+IMAGE_FORMAT_MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+}
+# image.info entries dropped when an image is re-encoded
+METADATA_KEYS = ("icc_profile", "exif", "xmp", "comment")
+
+
+class AttachmentRejectedError(ValueError):
+    """Raised when an attachment is refused before or during its download."""
+
+
+# --- Validation ---
+def is_offload_enabled() -> bool:
+    """Large attachments go to GOOGLE_CLOUD_BUCKET as URI references when enabled."""
+    return bool(config.ATTACHMENT_OFFLOAD_THRESHOLD_BYTES and config.GOOGLE_CLOUD_BUCKET)
+
+
+def get_max_file_size() -> int:
+    """Largest attachment the agent can receive, inline or offloaded."""
+    if is_offload_enabled():
+        return max(MAX_FILE_SIZE_BYTES, config.MAX_OFFLOADED_FILE_SIZE_BYTES)
+    return MAX_FILE_SIZE_BYTES
+
+
+def should_offload(file_size: int) -> bool:
+    """Files above the threshold, and any file too big to inline, are offloaded."""
+    return is_offload_enabled() and file_size > min(
+        config.ATTACHMENT_OFFLOAD_THRESHOLD_BYTES, MAX_FILE_SIZE_BYTES
+    )
+
+
+def resolve_mime_type(provided_file_type: str | None) -> str | None:
+    """Maps a Slack filetype or a full MIME type to one of the supported MIME types."""
+    if provided_file_type and "/" in provided_file_type:
+        provided_file_type = provided_file_type.split("/")[-1]
+    if not provided_file_type:
+        return None
+    return MIME_TYPE_MAPPING.get(provided_file_type.lower(), None)
+
+
+def is_generic_file_type(provided_file_type: str | None) -> bool:
+    return (provided_file_type or "").split("/")[-1].lower() in GENERIC_FILE_TYPES
+
+
+def get_declared_mime_type(file_name: str | None, provided_file_type: str | None) -> str | None:
+    """Supported MIME type claimed by the metadata: the declared type, else the file extension."""
+    if not is_generic_file_type(provided_file_type):
+        return resolve_mime_type(provided_file_type)
+    if file_name and "." in file_name:
+        return resolve_mime_type(file_name.rsplit(".", 1)[-1])
+    return None
+
+
+def sniff_mime_type(head: bytes) -> str | None:
+    """Recognises a supported format from the first bytes of a file."""
+    for signature, mime_type in MAGIC_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith(TEXT_BOMS):
+        return "text/plain"
+    if head and b"\x00" not in head:
+        try:
+            # Not final: the sample may end in the middle of a character
+            codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+            return "text/plain"
+        except UnicodeDecodeError:
+            return None
+    return None
+
+
+def classify_file(
+    file_name: str | None, provided_file_type: str | None, head: bytes
+) -> str | None:
+    """
+    Resolves the MIME type to send a file as, from its first bytes and metadata.
+    A recognised binary signature wins over the declared type. UTF-8 (or BOM
+    marked UTF-16/32) text is accepted unless something else was declared.
+    Other bytes without NULs, e.g. a cp1252 CSV exported by Excel, and empty
+    files are accepted as text only when declared as text. Returns None if the
+    file can't be sent.
+    """
+    head = bytes(head[:SNIFF_BYTES])
+    sniffed = sniff_mime_type(head)
+    if sniffed and sniffed != "text/plain":
+        return sniffed
+    declared = get_declared_mime_type(file_name, provided_file_type)
+    if sniffed == "text/plain" and declared in (None, "text/plain"):
+        return sniffed
+    if declared == "text/plain" and b"\x00" not in head:
+        return declared
+    return None
+
+
+def get_rejection_reason(
+    file_size: int | None,
+    provided_file_type: str | None,
+    max_size: int | None = None,
+    file_name: str | None = None,
+) -> str | None:
+    """
+    Returns a human-readable reason why a file can't be sent to the agent, or None if it can.
+    Only metadata is used, so this can run before any bytes are downloaded. Files
+    with a generic type (e.g. application/octet-stream) pass, and are classified
+    from their content once the first bytes arrive.
+    """
+    max_size = max_size or get_max_file_size()
+    if file_size is not None and file_size > max_size:
+        return f"Size ({file_size / (1024*1024):.2f} MB) exceeds {max_size / (1024*1024):.0f} MB limit."
+    if is_generic_file_type(provided_file_type):
+        return None
+    actual_mime_type = get_declared_mime_type(file_name, provided_file_type)
+    if actual_mime_type not in SUPPORTED_MIME_TYPES:
+        return f"Unsupported MIME type '{provided_file_type}' (resolved to '{actual_mime_type}')."
+    return None
+
+
+# --- Preprocessing ---
+@functools.cache
+def warn_missing_library(package: str, setting: str) -> None:
+    """Warns once that a feature enabled in config is off because its library is missing."""
+    logger.warning(
+        f"{setting} is set, but {package} is not installed: the feature is off. "
+        f"Install the 'attachments' extra (pip install '.[attachments]')."
+    )
+
+
+def should_downscale_image(file_size: int, mime_type: str | None) -> bool:
+    if Image is None:
+        if config.IMAGE_MAX_SIDE_PX:
+            warn_missing_library("Pillow", "IMAGE_MAX_SIDE_PX")
+        return False
+    return bool(
+        config.IMAGE_MAX_SIDE_PX
+        and mime_type in IMAGE_FORMAT_MIME_TYPES.values()
+        and file_size >= config.IMAGE_MIN_BYTES
+    )
+
+
+def get_image_settings_key() -> str:
+    """Identifies the current image settings, so cached results follow config changes."""
+    return f"img{config.IMAGE_MAX_SIDE_PX}{config.IMAGE_FORMAT.lower()}{config.IMAGE_QUALITY}"
+
+
+def downscale_image(file_content: bytes, mime_type: str) -> tuple[bytes, str] | None:
+    """
+    Caps the longest side at IMAGE_MAX_SIDE_PX and re-encodes to IMAGE_FORMAT.
+    Metadata (EXIF, ICC, comments) is dropped. Returns None if the result would
+    not be smaller, so the original should be sent.
+    """
+    with Image.open(io.BytesIO(file_content)) as image:
+        target_format = config.IMAGE_FORMAT or image.format
+        # Apply the EXIF rotation before the EXIF data is dropped
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((config.IMAGE_MAX_SIDE_PX, config.IMAGE_MAX_SIDE_PX))
+        if target_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        # PNG and WebP encoders write back metadata found in image.info
+        for key in METADATA_KEYS:
+            image.info.pop(key, None)
+        output = io.BytesIO()
+        image.save(
+            output, format=target_format, quality=config.IMAGE_QUALITY, optimize=True
+        )
+    if output.tell() >= len(file_content):
+        return None
+    return output.getvalue(), IMAGE_FORMAT_MIME_TYPES.get(target_format, mime_type)
+
+
+def get_document_kind(
+    file_name: str, provided_file_type: str | None, file_size: int
+) -> str | None:
+    """Returns "pdf" or "csv" for documents that should be sent as extracted text."""
+    if (
+        not config.DOCUMENT_EXTRACTION_ENABLED
+        or file_size < config.DOCUMENT_EXTRACTION_MIN_BYTES
+    ):
+        return None
+    file_type = (provided_file_type or "").split("/")[-1].lower()
+    extension = file_name.rsplit(".", 1)[-1].lower() if "." in file_name else ""
+    if file_type == "pdf" or extension == "pdf":
+        if PdfReader is None:
+            warn_missing_library("pypdf", "DOCUMENT_EXTRACTION_ENABLED")
+            return None
+        return "pdf"
+    if file_type == "csv" or extension == "csv":
+        return "csv"
+    return None
+
+
+def extract_pdf_text(file_content: bytes) -> str | None:
+    """Extracts the text layer of a PDF. Returns None for scanned PDFs with no text."""
+    reader = PdfReader(io.BytesIO(file_content))
+    pages = []
+    total_chars = 0
+    for page_number, page in enumerate(reader.pages, start=1):
+        page_text = page.extract_text() or ""
+        pages.append(f"--- Page {page_number} ---\n{page_text}")
+        total_chars += len(page_text)
+        if total_chars >= config.PDF_MAX_TEXT_CHARS:
+            pages.append(
+                f"[Text truncated after page {page_number} of {len(reader.pages)}.]"
+            )
+            break
+    if not total_chars:
+        return None
+    return "\n".join(pages)[: config.PDF_MAX_TEXT_CHARS]
+
+
+def decode_text(file_content: bytes) -> str:
+    """Decodes text as BOM-marked UTF-16/32 or UTF-8, falling back to cp1252."""
+    data = bytes(file_content)
+    for bom, encoding in (
+        (codecs.BOM_UTF32_LE, "utf-32"),
+        (codecs.BOM_UTF32_BE, "utf-32"),
+        (codecs.BOM_UTF16_LE, "utf-16"),
+        (codecs.BOM_UTF16_BE, "utf-16"),
+    ):
+        if data.startswith(bom):
+            return data.decode(encoding, errors="replace")
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return data.decode("cp1252", errors="replace")
+
+
+def summarize_csv(file_content: bytes) -> str:
+    """Describes a CSV by its columns, row count and a head/tail sample."""
+    sample_rows = config.CSV_SAMPLE_ROWS
+    text = decode_text(file_content)
+    # csv.reader, not splitlines: quoted fields may contain newlines
+    reader = csv.reader(io.StringIO(text))
+    header = next(reader, [])
+    head: list[list[str]] = []
+    tail: collections.deque[list[str]] = collections.deque(maxlen=sample_rows)
+    row_count = 0
+    for row in reader:
+        if not row:
+            continue
+        row_count += 1
+        if len(head) < sample_rows:
+            head.append(row)
+        else:
+            tail.append(row)
+
+    columns = []
+    for i, name in enumerate(header):
+        values = [row[i] for row in [*head, *tail] if i < len(row) and row[i] != ""]
+        columns.append(f"{name} ({_guess_column_type(values)})")
+
+    summary = [
+        f"Rows: {row_count}, columns: {len(header)}",
+        f"Columns: {', '.join(columns)}",
+        f"First {len(head)} rows:",
+        _format_csv_rows([header, *head]),
+    ]
+    if tail:
+        summary += [f"Last {len(tail)} rows:", _format_csv_rows([header, *tail])]
+    return "\n".join(summary)
+
+
+def _format_csv_rows(rows: list[list[str]]) -> str:
+    output = io.StringIO()
+    csv.writer(output, lineterminator="\n").writerows(rows)
+    return output.getvalue().rstrip("\n")
+
+
+def _guess_column_type(values: list[str]) -> str:
+    for type_name, cast in [("int", int), ("float", float)]:
+        try:
+            for value in values:
+                cast(value)
+            return type_name if values else "empty"
+        except ValueError:
+            continue
+    return "text"
+
+
+# --- Buffering ---
+class PreallocatedBuffer:
+    """
+    Collects a streamed download into a single bytearray sized up front from the
+    reported file size, so the payload is never held twice in memory.
+    Once the first SNIFF_BYTES have arrived the content is classified, and an
+    unsupported file raises AttachmentRejectedError before the rest downloads.
+    """
+
+    def __init__(
+        self,
+        expected_size: int | None,
+        max_size: int | None = None,
+        file_name: str | None = None,
+        provided_file_type: str | None = None,
+    ):
+        self._buffer = bytearray(expected_size or 0)
+        self._view = memoryview(self._buffer)
+        self._written = 0
+        self._max_size = max_size or get_max_file_size()
+        self._file_name = file_name
+        self._provided_file_type = provided_file_type
+        self.mime_type: str | None = None
+
+    def write(self, chunk: bytes) -> None:
+        end = self._written + len(chunk)
+        if end > self._max_size:
+            raise AttachmentRejectedError(
+                f"Download exceeds {self._max_size / (1024*1024):.0f} MB limit."
+            )
+        if end > len(self._buffer):
+            # The reported size was wrong or missing: grow in place.
+            self._view.release()
+            del self._buffer[self._written :]
+            self._buffer += chunk
+            self._view = memoryview(self._buffer)
+        else:
+            self._view[self._written : end] = chunk
+        self._written = end
+        if self.mime_type is None and self._written >= SNIFF_BYTES:
+            self._classify()
+
+    def _classify(self) -> None:
+        self.mime_type = classify_file(
+            self._file_name,
+            self._provided_file_type,
+            self._view[: min(self._written, SNIFF_BYTES)],
+        )
+        if self.mime_type is None:
+            raise AttachmentRejectedError(
+                f"Content of '{self._file_name}' doesn't match a supported type "
+                f"(declared '{self._provided_file_type}')."
+            )
+
+    def getvalue(self) -> bytearray:
+        """Returns the downloaded data. The buffer itself is handed over, not copied."""
+        if self.mime_type is None:
+            self._classify()
+        self._view.release()
+        del self._buffer[self._written :]
+        return self._buffer
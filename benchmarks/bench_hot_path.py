@@ -0,0 +1,298 @@
+"""
+Microbenchmarks of the code that runs on every message: building the query body
+(engine_modules.prepare_message_dict) and the session event parts
+(engine_modules.build_event_parts, used by update_session), parsing the agent
+stream (StreamDemux.feed), decoding streamed lines (query_streamlit.read_events)
+and chunking the final answer for Slack and Telegram (stream_events.split_text).
+
+For each case: time per call (best of --repeat rounds of --number calls), calls/s,
+MB/s over the input, and from one call under tracemalloc, the peak memory it
+reached and the blocks it allocated that are still held by its result. Results
+are appended to benchmarks/results/hot_path.jsonl with the git revision, and each
+run is compared with the last stored one.
+
+Run from the repository root:
+    python benchmarks/bench_hot_path.py [--only split_text] [--repeat 5] [--number 20]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import queue
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+# engine_modules must not reach Google Cloud, and caches go to a scratch directory
+_run_dir = tempfile.mkdtemp(prefix="agent_interface_bench_")
+os.environ.update(
+    {
+        "AGENT_ENGINE_FAKE": "true",
+        "ATTACHMENT_CACHE_DIR": os.path.join(_run_dir, "attachments"),
+        "ARTIFACT_CACHE_DIR": os.path.join(_run_dir, "artifacts"),
+        "METRICS_PORT": "0",
+        "TRACE_EXPORTER": "",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    }
+)
+
+import engine_modules  # noqa: E402
+import json_modules  # noqa: E402
+import stream_events  # noqa: E402
+from load_test import git_revision  # noqa: E402
+from streamlit_app import query_streamlit  # noqa: E402
+
+RESULTS_FILE = os.path.join(ROOT, "benchmarks", "results", "hot_path.jsonl")
+FILE_SIZES_KB = [64, 1024, 8 * 1024]
+FILE_COUNTS = [1, 4]
+STREAM_EVENTS = 2000
+ANSWER_CHARS = [4_000, 40_000, 400_000]
+CHAT_LIMITS = {"slack": 3900, "telegram": 4096}
+# A PNG signature, so classify_file accepts the content as an image
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+
+
+# --- Inputs ---
+def make_file_list(size: int, count: int) -> list[dict]:
+    """Attachments as the bots hand them over, each with distinct content."""
+    return [
+        {
+            "name": f"chart_{i}.png",
+            "mime_type": "image/png",
+            "content": PNG_HEADER + os.urandom(size - len(PNG_HEADER)),
+            "size": size,
+        }
+        for i in range(count)
+    ]
+
+
+def make_stream_events(count: int) -> list[dict]:
+    """
+    One invocation's events: mostly text deltas, with the thoughts, tool calls and
+    responses, artifact deltas and usage metadata that come in between.
+    """
+    events = []
+    for i in range(count):
+        actions = {"state_delta": {}, "artifact_delta": {}}
+        if i % 100 == 0:
+            part = {"function_call": {"name": "run_query", "id": f"call-{i}", "args": {"sql": "SELECT 1"}}}
+        elif i % 100 == 1:
+            part = {
+                "function_response": {
+                    "name": "run_query",
+                    "id": f"call-{i - 1}",
+                    "response": {"rows": [{"id": n, "value": n * 1.5} for n in range(200)]},
+                }
+            }
+            actions["artifact_delta"] = {f"result_{i}.csv": 0}
+        elif i % 20 == 2:
+            part = {"text": "Considering which table holds the numbers. ", "thought": True}
+        else:
+            part = {"text": f"token {i} of the answer, with some more words. "}
+        event = {
+            "author": "main_agent",
+            "invocation_id": "e-1234",
+            "content": {"role": "model", "parts": [part]},
+            "actions": actions,
+        }
+        if i == count - 1:
+            event["usage_metadata"] = {
+                "prompt_token_count": 1200,
+                "candidates_token_count": 800,
+                "total_token_count": 2000,
+            }
+        events.append(event)
+    return events
+
+
+class AllChannelsSink(stream_events.StreamSink):
+    """A sink that wants every kind of event, like a bot with thoughts and tools shown."""
+
+    wants_thoughts = True
+    wants_tools = True
+    wants_artifacts = True
+    wants_usage = True
+    wants_validator = True
+
+
+class LinesResponse:
+    """Stands in for the streamed requests.Response that read_events iterates."""
+
+    def __init__(self, lines: list[bytes]):
+        self.lines = lines
+
+    def iter_lines(self):
+        return iter(self.lines)
+
+    def close(self):
+        pass
+
+
+# --- Cases ---
+def cases() -> list[tuple[str, object, int]]:
+    """(name, zero-argument callable, input bytes) for every benchmark."""
+    cases = []
+    for size_kb in FILE_SIZES_KB:
+        for count in FILE_COUNTS:
+            files = make_file_list(size_kb * 1024, count)
+            total = size_kb * 1024 * count
+            label = f"{count}x{size_kb}KB"
+            cases.append(
+                (
+                    f"prepare_message_dict {label}",
+                    lambda files=files: engine_modules.prepare_message_dict("Summarize these.", files),
+                    total,
+                )
+            )
+            cases.append(
+                (
+                    f"build_event_parts inline {label}",
+                    lambda files=files: engine_modules.build_event_parts("Summarize these.", files),
+                    total,
+                )
+            )
+            cases.append(
+                (
+                    f"build_event_parts artifacts {label}",
+                    lambda files=files: engine_modules.build_event_parts(
+                        "Summarize these.", files, as_artifacts=True
+                    ),
+                    total,
+                )
+            )
+
+    events = make_stream_events(STREAM_EVENTS)
+    lines = [json_modules.dumps(event) for event in events]
+    stream_bytes = sum(len(line) for line in lines)
+
+    def feed(*sinks):
+        demux = stream_events.StreamDemux(*sinks)
+        for event in events:
+            demux.feed(event)
+        return demux.text
+
+    cases.append(
+        (f"StreamDemux.feed text only {STREAM_EVENTS} events", lambda: feed(stream_events.StreamSink()), stream_bytes)
+    )
+    cases.append(
+        (f"StreamDemux.feed all kinds {STREAM_EVENTS} events", lambda: feed(AllChannelsSink()), stream_bytes)
+    )
+
+    def decode():
+        decoded: queue.Queue = queue.Queue()
+        query_streamlit.read_events(LinesResponse(lines), decoded, threading.Event())
+        return decoded
+
+    cases.append((f"read_events {STREAM_EVENTS} lines", decode, stream_bytes))
+
+    for chars in ANSWER_CHARS:
+        answer = ("The quarterly numbers are up. Выручка выросла. " * (chars // 48 + 1))[:chars]
+        for bot, limit in CHAT_LIMITS.items():
+            cases.append(
+                (
+                    f"split_text {bot} {chars} chars",
+                    lambda answer=answer, limit=limit: stream_events.split_text(answer, limit),
+                    len(answer.encode("utf-8")),
+                )
+            )
+    return cases
+
+
+# --- Measurement ---
+def measure(func, number: int, repeat: int) -> dict:
+    func()  # warm-up: imports, caches and first-call costs
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+
+    # Timed separately: tracemalloc slows allocation-heavy code several times over
+    tracemalloc.start()
+    try:
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        before = tracemalloc.take_snapshot().filter_traces(ignore)
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot().filter_traces(ignore)
+    finally:
+        tracemalloc.stop()
+    kept = [stat for stat in after.compare_to(before, "filename") if stat.count_diff > 0]
+    del result
+    return {
+        "seconds": best,
+        "peak_bytes": max(0, peak - baseline),
+        "kept_blocks": sum(stat.count_diff for stat in kept),
+        "kept_bytes": sum(stat.size_diff for stat in kept),
+    }
+
+
+# --- Results ---
+def load_previous() -> dict:
+    if not os.path.exists(RESULTS_FILE):
+        return {}
+    previous = {}
+    with open(RESULTS_FILE, encoding="utf-8") as f:
+        for line in f:
+            previous = json.loads(line)["results"]
+    return previous
+
+
+def print_result(name: str, result: dict, input_bytes: int, old: dict | None):
+    def delta(value, old_value):
+        if not old_value:
+            return ""
+        change = (value - old_value) / old_value * 100
+        return f" ({change:+.0f}%{' !' if change >= 10 else ''})"
+
+    seconds = result["seconds"]
+    print(
+        f"{name:<44} {seconds * 1e6:11.1f} us{delta(seconds, (old or {}).get('seconds')):<9}"
+        f" {1 / seconds:10.1f} calls/s {input_bytes / (1024 * 1024) / seconds:9.1f} MB/s"
+        f"   peak {result['peak_bytes'] / 1024:9.1f} KB"
+        f"{delta(result['peak_bytes'], (old or {}).get('peak_bytes')):<9}"
+        f" kept {result['kept_blocks']:6d} blocks / {result['kept_bytes'] / 1024:9.1f} KB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--only", default="", help="run only cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=20, help="calls per timed round")
+    parser.add_argument("--no-save", action="store_true", help="don't append to the results file")
+    args = parser.parse_args()
+    print(f"json_modules backend: {json_modules.BACKEND}\n")
+
+    previous = load_previous()
+    results = {}
+    for name, func, input_bytes in cases():
+        if args.only not in name:
+            continue
+        results[name] = measure(func, args.number, args.repeat)
+        print_result(name, results[name], input_bytes, previous.get(name))
+
+    if results and not args.no_save:
+        os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+        record = {
+            "ts": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "json_backend": json_modules.BACKEND,
+            "results": {**previous, **results},
+        }
+        with open(RESULTS_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Compares json_modules with the stdlib calls it replaced, on payloads shaped like ours:
+query bodies carrying base64 attachments, and lines of the agent event stream.
+
+Run from the repository root:
+    python benchmarks/bench_json.py [--repeat 5]
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json_modules
+
+ATTACHMENT_SIZES_MB = [1, 10, 25]
+STREAM_EVENTS = 2000
+
+
+def make_query_body(attachment_bytes: int) -> dict:
+    """A streamQuery body as built by prepare_message_dict, with one inline file."""
+    data = base64.b64encode(os.urandom(attachment_bytes)).decode("utf-8")
+    return {
+        "class_method": "async_stream_query",
+        "input": {
+            "user_id": "U0123456",
+            "session_id": "1234567890",
+            "message": {
+                "role": "user",
+                "parts": [
+                    {"text": "Please summarize the attached report. Отчёт во вложении."},
+                    {"inline_data": {"mime_type": "image/png", "data": data}},
+                ],
+            },
+        },
+    }
+
+
+def make_stream_lines(count: int) -> list[bytes]:
+    """Streamed events: mostly short text deltas, with an occasional large tool response."""
+    lines = []
+    for i in range(count):
+        if i % 50 == 0:
+            part = {
+                "function_response": {
+                    "name": "run_query",
+                    "id": f"call-{i}",
+                    "response": {"rows": [{"id": n, "value": n * 1.5} for n in range(500)]},
+                }
+            }
+        else:
+            part = {"text": f"token {i} of the answer, with some more words. "}
+        event = {
+            "author": "main_agent",
+            "content": {"role": "model", "parts": [part]},
+            "actions": {"state_delta": {}, "artifact_delta": {}},
+            "usage_metadata": {"prompt_token_count": 1200, "total_token_count": 1250},
+        }
+        lines.append(json.dumps(event).encode("utf-8"))
+    return lines
+
+
+def best_of(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def report(label: str, baseline: float, candidate: float, size_bytes: int):
+    mb = size_bytes / (1024 * 1024)
+    print(
+        f"{label:<34} stdlib {baseline * 1000:9.2f} ms ({mb / baseline:8.1f} MB/s)   "
+        f"json_modules {candidate * 1000:9.2f} ms ({mb / candidate:8.1f} MB/s)   "
+        f"x{baseline / candidate:.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    print(f"json_modules backend: {json_modules.BACKEND}\n")
+
+    for size_mb in ATTACHMENT_SIZES_MB:
+        body = make_query_body(size_mb * 1024 * 1024)
+        encoded = json_modules.dumps(body)
+        # Before: requests received a str, which it then encoded to bytes itself
+        baseline = best_of(lambda: json.dumps(body).encode("utf-8"), args.repeat)
+        candidate = best_of(lambda: json_modules.dumps(body), args.repeat)
+        report(f"dumps query body ({size_mb} MB file)", baseline, candidate, len(encoded))
+
+        baseline = best_of(lambda: json.loads(encoded.decode("utf-8")), args.repeat)
+        candidate = best_of(lambda: json_modules.loads(encoded), args.repeat)
+        report(f"loads query body ({size_mb} MB file)", baseline, candidate, len(encoded))
+
+    lines = make_stream_lines(STREAM_EVENTS)
+    total = sum(len(line) for line in lines)
+    baseline = best_of(lambda: [json.loads(line) for line in lines], args.repeat)
+    candidate = best_of(lambda: [json_modules.loads(line) for line in lines], args.repeat)
+    report(f"loads {STREAM_EVENTS} stream events", baseline, candidate, total)
+
+
+if __name__ == "__main__":
+    main()
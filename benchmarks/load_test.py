@@ -0,0 +1,674 @@
+"""
+End-to-end load test of the Slack, Telegram and Streamlit message paths.
+
+Synthetic Slack events and Telegram updates go through the real handlers
+(handle_app_mention / handle_message_events, message_handler, query_agent),
+which talk to local stand-ins: a fake Slack Web API and Telegram Bot API served
+from this process, and the fake Agent Engine of fake_engine_modules. Each
+front-end runs in its own subprocess, so its peak RSS is its own.
+
+Reported per front-end: messages/sec, p50/p95/p99 time to first reply (the
+first answer message the bot posts, not the "Thinking..." placeholder), p50/p95/p99
+handler time, errors and peak RSS. Results are appended to
+benchmarks/results/load_test.jsonl with the git revision, and each run is
+compared with the last stored run of the same scenario.
+
+Run from the repository root:
+    python benchmarks/load_test.py [--frontend all|slack|telegram|streamlit]
+        [--messages 200] [--concurrency 20] [--mix dm=4,mention=3,context=2,attachment=1]
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+import platform
+import queue
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+FRONTENDS = ["slack", "telegram", "streamlit"]
+KINDS = ["dm", "mention", "context", "attachment"]
+RESULTS_FILE = os.path.join(ROOT, "benchmarks", "results", "load_test.jsonl")
+SLACK_TOKEN = "xoxb-load-test"
+TELEGRAM_TOKEN = "123456:load-test"
+BOT_USER_ID = "UBOTLOAD"
+BOT_USERNAME = "load_test_bot"
+
+
+# --- Measurements ---
+class ReplyTracker:
+    """Times each conversation from the injected message to the bot's first answer in it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self._pending: dict[str, float] = {}
+        self.first_reply: list[float] = []
+        self.missing_replies = 0
+
+    def start(self, key: str) -> None:
+        with self._lock:
+            self._pending[key] = time.perf_counter()
+
+    def reply(self, key: str) -> None:
+        with self._lock:
+            start = self._pending.pop(key, None)
+            if start is not None:
+                self.first_reply.append(time.perf_counter() - start)
+
+    def finish(self, key: str) -> None:
+        with self._lock:
+            if self._pending.pop(key, None) is not None:
+                self.missing_replies += 1
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q / 100 * (len(ordered) - 1)))]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def plan_messages(count: int, mix: dict[str, float]) -> list[str]:
+    """Spreads the message kinds evenly through the run, in the given proportions."""
+    total = sum(mix.values())
+    kinds, credit = [], dict.fromkeys(mix, 0.0)
+    for _ in range(count):
+        for kind in mix:
+            credit[kind] += mix[kind] / total
+        kind = max(credit, key=credit.get)
+        credit[kind] -= 1
+        kinds.append(kind)
+    return kinds
+
+
+_file_cache: dict[int, bytes] = {}
+
+
+def file_content(size: int) -> bytes:
+    if size not in _file_cache:
+        line = b"load test attachment line, plain text so it passes classification\n"
+        _file_cache[size] = (line * (size // len(line) + 1))[:size]
+    return _file_cache[size]
+
+
+# --- Stand-ins ---
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    tracker: ReplyTracker
+
+    def read_params(self) -> dict:
+        url = urllib.parse.urlsplit(self.path)
+        params = {k: v[0] for k, v in urllib.parse.parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        content_type = self.headers.get("Content-Type", "")
+        if body and "json" in content_type:
+            params.update(json.loads(body))
+        elif body and "form-urlencoded" in content_type:
+            params.update(
+                {k: v[0] for k, v in urllib.parse.parse_qs(body.decode("utf-8")).items()}
+            )
+        return params
+
+    def send_body(self, data: bytes, content_type: str = "application/json"):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SlackStandIn(_StandInHandler):
+    """The Slack Web API methods the bot calls, plus private file downloads."""
+
+    _ts_counter = 0
+    _ts_lock = threading.Lock()
+
+    def do_GET(self):
+        if self.path.startswith("/files/"):
+            # /files/<size>/<name>
+            self.send_body(file_content(int(self.path.split("/")[2])), "text/plain")
+            return
+        self.handle_api()
+
+    def do_POST(self):
+        self.handle_api()
+
+    def handle_api(self):
+        method = urllib.parse.urlsplit(self.path).path.rsplit("/", 1)[-1]
+        params = self.read_params()
+        result: dict = {"ok": True}
+        if method == "auth.test":
+            result.update(user_id=BOT_USER_ID, bot_id="BLOAD", team_id="TLOAD", user="loadbot")
+        elif method == "chat.postMessage":
+            with SlackStandIn._ts_lock:
+                SlackStandIn._ts_counter += 1
+                ts = f"{int(time.time())}.{SlackStandIn._ts_counter:06d}"
+            text = params.get("text") or ""
+            if not text.startswith("🧠"):
+                self.tracker.reply(params["channel"])
+            result.update(channel=params["channel"], ts=ts, message={"text": text, "ts": ts})
+        elif method == "chat.getPermalink":
+            result["permalink"] = f"https://example.slack.com/archives/{params.get('channel')}"
+        elif method == "conversations.info":
+            result["channel"] = {"id": params["channel"], "name": params["channel"].lower()}
+        elif method == "users.info":
+            user = params.get("user", "")
+            result["user"] = {
+                "id": user,
+                "profile": {"email": f"{user.lower()}@example.com", "display_name": user},
+            }
+        self.send_body(json.dumps(result).encode("utf-8"))
+
+
+class TelegramStandIn(_StandInHandler):
+    """The Bot API methods the bot calls, plus file downloads."""
+
+    _message_counter = 0
+    _message_lock = threading.Lock()
+
+    def do_GET(self):
+        if self.path.startswith("/file/"):
+            # /file/bot<token>/documents/<size>_<name>
+            size = int(self.path.rsplit("/", 1)[-1].split("_", 1)[0])
+            self.send_body(file_content(size), "text/plain")
+            return
+        self.handle_api()
+
+    def do_POST(self):
+        self.handle_api()
+
+    def handle_api(self):
+        method = urllib.parse.urlsplit(self.path).path.rsplit("/", 1)[-1]
+        params = self.read_params()
+        if method == "getMe":
+            result = {
+                "id": 1,
+                "is_bot": True,
+                "first_name": "Load Test",
+                "username": BOT_USERNAME,
+            }
+        elif method == "getFile":
+            size = int(params["file_id"].split("-")[1])
+            result = {
+                "file_id": params["file_id"],
+                "file_unique_id": params["file_id"],
+                "file_size": size,
+                "file_path": f"documents/{size}_notes.txt",
+            }
+        elif method in ("sendMessage", "sendPhoto", "sendDocument"):
+            chat_id = int(params["chat_id"])
+            with TelegramStandIn._message_lock:
+                TelegramStandIn._message_counter += 1
+                message_id = TelegramStandIn._message_counter
+            self.tracker.reply(str(chat_id))
+            result = {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+                "text": params.get("text", ""),
+            }
+        else:  # sendChatAction and anything else
+            result = True
+        self.send_body(json.dumps({"ok": True, "result": result}).encode("utf-8"))
+
+
+def start_stand_in(handler_class, tracker: ReplyTracker) -> str:
+    handler = type(handler_class.__name__, (handler_class,), {"tracker": tracker})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def free_port() -> int:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BaseHTTPRequestHandler)
+    port = server.server_port
+    server.server_close()
+    return port
+
+
+def configure_environment(args, tracker: ReplyTracker) -> dict:
+    """Points the bots at the stand-ins. Must run before config is imported."""
+    urls = {
+        "slack": start_stand_in(SlackStandIn, tracker),
+        "telegram": start_stand_in(TelegramStandIn, tracker),
+    }
+    run_dir = tempfile.mkdtemp(prefix="agent_interface_load_")
+    os.environ.update(
+        {
+            "AGENT_ENGINE_FAKE": "true",
+            "FAKE_ENGINE_PORT": str(free_port()),
+            "FAKE_ENGINE_FIRST_TOKEN_DELAY_MS": str(args.first_token_ms),
+            "FAKE_ENGINE_TOKENS_PER_SECOND": str(args.tokens_per_second),
+            "FAKE_ENGINE_ANSWER_TOKENS": str(args.answer_tokens),
+            "FAKE_ENGINE_TOOL_CALLS": str(args.tool_calls),
+            "SLACK_API_URL": f"{urls['slack']}/api/",
+            "SLACK_BOT_TOKEN": SLACK_TOKEN,
+            "TELEGRAM_BOT_TOKEN": TELEGRAM_TOKEN,
+            "USAGE_DB_PATH": os.path.join(run_dir, "usage.sqlite3"),
+            "ATTACHMENT_CACHE_DIR": os.path.join(run_dir, "attachments"),
+            "ARTIFACT_CACHE_DIR": os.path.join(run_dir, "artifacts"),
+            "METRICS_PORT": "0",
+            "TRACE_EXPORTER": "",
+            "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+        }
+    )
+    return urls
+
+
+# --- Front-end drivers ---
+def slack_body(kind: str, slot: int, seq: int, urls: dict, attachment_kb: int) -> dict:
+    channel = f"D{slot:05d}" if kind in ("dm", "attachment") else f"C{slot:05d}"
+    event = {
+        "type": "app_mention" if kind == "mention" else "message",
+        "channel": channel,
+        "user": f"U{slot:05d}",
+        "text": f"Load test message {seq}: please summarize the quarterly numbers.",
+        "ts": f"{int(time.time())}.{seq:06d}",
+    }
+    if kind == "mention":
+        event["text"] = f"<@{BOT_USER_ID}> {event['text']}"
+    else:
+        event["channel_type"] = "im" if channel.startswith("D") else "channel"
+    if kind == "attachment":
+        size = attachment_kb * 1024
+        event["subtype"] = "file_share"
+        event["files"] = [
+            {
+                "name": "notes.txt",
+                "filetype": "text",
+                "size": size,
+                "url_private_download": f"{urls['slack']}/files/{size}/notes.txt",
+            }
+        ]
+    return {"event": event}
+
+
+def run_slack(args, phases: list[list[str]], tracker: ReplyTracker, urls: dict) -> list:
+    from slack_bolt.context.say import Say
+
+    from slack_app import bot
+
+    bot_logger = logging.getLogger("slack_app.bot")
+    slots: queue.Queue = queue.Queue()
+    for slot in range(args.concurrency):
+        slots.put(slot)
+
+    def handle(seq_kind):
+        seq, kind = seq_kind
+        slot = slots.get()  # one message at a time per conversation
+        try:
+            body = slack_body(kind, slot, seq, urls, args.attachment_kb)
+            channel = body["event"]["channel"]
+            say = Say(client=bot.app.client, channel=channel)
+            replies = kind != "context"
+            if replies:
+                tracker.start(channel)
+            start = time.perf_counter()
+            if kind == "mention":
+                bot.handle_app_mention(body=body, say=say, ack=lambda *a, **k: None)
+            else:
+                bot.handle_message_events(body=body, say=say, logger=bot_logger)
+            elapsed = time.perf_counter() - start
+            if replies:
+                tracker.finish(channel)
+            return elapsed
+        finally:
+            slots.put(slot)
+
+    # Bolt runs listeners on a thread pool too, each with its own asyncio.run()
+    with concurrent.futures.ThreadPoolExecutor(args.concurrency) as executor:
+        return [
+            timed(tracker, lambda: list(executor.map(handle, enumerate(kinds))))
+            for kinds in phases
+        ]
+
+
+def telegram_update(kind: str, slot: int, seq: int, attachment_kb: int) -> dict:
+    private = kind in ("dm", "attachment")
+    chat = (
+        {"id": slot + 1, "type": "private", "first_name": f"User {slot}"}
+        if private
+        else {"id": -(100000 + slot), "type": "supergroup", "title": f"Group {slot}"}
+    )
+    message = {
+        "message_id": seq + 1,
+        "date": int(time.time()),
+        "chat": chat,
+        "from": {"id": slot + 1, "is_bot": False, "first_name": f"User {slot}"},
+    }
+    text = f"Load test message {seq}: please summarize the quarterly numbers."
+    if kind == "mention":
+        text = f"@{BOT_USERNAME} {text}"
+    if kind == "attachment":
+        size = attachment_kb * 1024
+        message["caption"] = text
+        message["document"] = {
+            "file_id": f"doc-{size}-{seq}",
+            "file_unique_id": f"doc-{seq}",
+            "file_name": "notes.txt",
+            "mime_type": "text/plain",
+            "file_size": size,
+        }
+    else:
+        message["text"] = text
+    return {"update_id": seq + 1, "message": message}
+
+
+def run_telegram(args, phases: list[list[str]], tracker: ReplyTracker, urls: dict) -> list:
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder, CallbackContext
+
+    from telegram_app import bot
+
+    async def main():
+        application = (
+            ApplicationBuilder()
+            .token(TELEGRAM_TOKEN)
+            .base_url(f"{urls['telegram']}/bot")
+            .base_file_url(f"{urls['telegram']}/file/bot")
+            .request(bot.InstrumentedRequest(connection_pool_size=256))
+            .build()
+        )
+        await application.initialize()
+        slots: asyncio.Queue = asyncio.Queue()
+        for slot in range(args.concurrency):
+            slots.put_nowait(slot)
+
+        async def handle(seq: int, kind: str) -> float:
+            slot = await slots.get()
+            try:
+                update = Update.de_json(
+                    telegram_update(kind, slot, seq, args.attachment_kb), application.bot
+                )
+                context = CallbackContext.from_update(update, application)
+                chat_id = str(update.effective_chat.id)
+                replies = kind != "context"
+                if replies:
+                    tracker.start(chat_id)
+                start = time.perf_counter()
+                await bot.message_handler(update, context)
+                elapsed = time.perf_counter() - start
+                if replies:
+                    tracker.finish(chat_id)
+                return elapsed
+            finally:
+                slots.put_nowait(slot)
+
+        # All phases share one loop: the bot's httpx client is bound to it
+        results = []
+        try:
+            for kinds in phases:
+                tracker.reset()
+                start = time.perf_counter()
+                handler_times = await asyncio.gather(
+                    *[handle(seq, kind) for seq, kind in enumerate(kinds)]
+                )
+                results.append((handler_times, time.perf_counter() - start, peak_rss_mb()))
+        finally:
+            await application.shutdown()
+        return results
+
+    return asyncio.run(main())
+
+
+def run_streamlit(args, phases: list[list[str]], tracker: ReplyTracker, urls: dict) -> list:
+    from streamlit.runtime.state import SafeSessionState, SessionState
+    from streamlit.runtime.state import session_state_proxy
+
+    import fake_engine_modules
+    from streamlit_app import query_streamlit
+
+    # Outside `streamlit run` all threads share one mock session state; give each
+    # worker its own, as each browser session has
+    local = threading.local()
+
+    def thread_session_state():
+        if not hasattr(local, "state"):
+            local.state = SafeSessionState(SessionState(), lambda: None)
+        return local.state
+
+    session_state_proxy.get_session_state = thread_session_state
+    # Every st.* call outside `streamlit run` warns about the missing script context.
+    # Streamlit resets its loggers' levels when it loads its config, so disable this one.
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").disabled = True
+    fake_engine_modules.start_fake_server()
+
+    slots: queue.Queue = queue.Queue()
+    for slot in range(args.concurrency):
+        slots.put(slot)
+
+    def handle(seq: int) -> float:
+        slot = slots.get()
+        try:
+            # What main.py sets up for a new browser session
+            if "messages" not in query_streamlit.st.session_state:
+                query_streamlit.st.session_state.messages = []
+            user_id = f"streamlit-{slot}@example.com"
+            tracker.start(user_id)
+            start = time.perf_counter()
+            for _ in query_streamlit.query_agent(
+                user_id, f"Load test message {seq}: please summarize the quarterly numbers."
+            ):
+                tracker.reply(user_id)
+            elapsed = time.perf_counter() - start
+            tracker.finish(user_id)
+            return elapsed
+        finally:
+            slots.put(slot)
+
+    with concurrent.futures.ThreadPoolExecutor(args.concurrency) as executor:
+        return [
+            timed(tracker, lambda: list(executor.map(handle, range(len(kinds)))))
+            for kinds in phases
+        ]
+
+
+def timed(tracker: ReplyTracker, run) -> tuple[list[float], float, float]:
+    """Runs one phase: (handler times, wall time, peak RSS before it started)."""
+    tracker.reset()
+    rss = peak_rss_mb()
+    start = time.perf_counter()
+    handler_times = run()
+    return handler_times, time.perf_counter() - start, rss
+
+
+DRIVERS = {"slack": run_slack, "telegram": run_telegram, "streamlit": run_streamlit}
+
+
+def run_frontend(args) -> dict:
+    """Child process: drives one front-end and returns its results."""
+    tracker = ReplyTracker()
+    urls = configure_environment(args, tracker)
+    mix = dict(args.mix)
+    if args.frontend == "streamlit":
+        mix = {"dm": 1.0}  # the web chat has a single kind of message
+    kinds = plan_messages(args.messages, mix)
+
+    # Warm-up phase: imports, connection pools and first sessions aren't measured
+    warmup = kinds[: args.concurrency]
+    _, (handler_times, wall, startup_rss) = DRIVERS[args.frontend](
+        args, [warmup, kinds], tracker, urls
+    )
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 1)
+
+    return {
+        "messages": len(kinds),
+        "kinds": {kind: kinds.count(kind) for kind in mix},
+        "wall_seconds": round(wall, 3),
+        "messages_per_second": round(len(kinds) / wall, 2),
+        "first_reply_ms": {
+            f"p{q}": ms(percentile(tracker.first_reply, q)) for q in (50, 95, 99)
+        },
+        "handler_ms": {f"p{q}": ms(percentile(handler_times, q)) for q in (50, 95, 99)},
+        "missing_replies": tracker.missing_replies,
+        "startup_rss_mb": round(startup_rss, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+# --- Results ---
+def git_revision() -> str:
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=ROOT, capture_output=True, text=True,
+        ).stdout.strip()
+        return f"{revision}-dirty" if dirty else revision
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def scenario_of(args, frontend: str) -> dict:
+    return {
+        "frontend": frontend,
+        "messages": args.messages,
+        "concurrency": args.concurrency,
+        "mix": args.mix_text,
+        "attachment_kb": args.attachment_kb,
+        "first_token_ms": args.first_token_ms,
+        "tokens_per_second": args.tokens_per_second,
+        "answer_tokens": args.answer_tokens,
+        "tool_calls": args.tool_calls,
+    }
+
+
+def load_previous(scenario: dict) -> dict | None:
+    if not os.path.exists(RESULTS_FILE):
+        return None
+    previous = None
+    with open(RESULTS_FILE, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["scenario"] == scenario:
+                previous = record
+    return previous
+
+
+def print_result(frontend: str, result: dict, previous: dict | None):
+    def delta(value, old, higher_is_better=False):
+        if value is None or not old:
+            return ""
+        change = (value - old) / old * 100
+        worse = change < 0 if higher_is_better else change > 0
+        return f" ({change:+.0f}%{' !' if worse and abs(change) >= 10 else ''})"
+
+    old = previous["results"] if previous else {}
+    print(f"\n{frontend}: {result['messages']} messages {result['kinds']}")
+    print(
+        f"  throughput      {result['messages_per_second']:8.2f} msgs/s"
+        + delta(result["messages_per_second"], old.get("messages_per_second"), True)
+    )
+    for label, key in (("first reply", "first_reply_ms"), ("handler", "handler_ms")):
+        cells = []
+        for q in ("p50", "p95", "p99"):
+            value = result[key][q]
+            cells.append(
+                f"{q} {value if value is not None else '-':>8} ms"
+                + delta(value, old.get(key, {}).get(q))
+            )
+        print(f"  {label:<15} " + "   ".join(cells))
+    print(
+        f"  peak RSS        {result['peak_rss_mb']:8.1f} MB (after warm-up "
+        f"{result['startup_rss_mb']:.1f} MB)"
+        + delta(result["peak_rss_mb"], old.get("peak_rss_mb"))
+    )
+    if result["missing_replies"]:
+        print(f"  missing replies {result['missing_replies']}")
+    if previous:
+        print(f"  compared with {previous['revision']} from {previous['ts']}")
+
+
+def parse_mix(text: str) -> list[tuple[str, float]]:
+    mix = []
+    for item in text.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"Unknown message kind {kind!r}, expected {KINDS}")
+        mix.append((kind, float(weight or 1)))
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--frontend", choices=FRONTENDS + ["all"], default="all")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument(
+        "--mix",
+        default="dm=4,mention=3,context=2,attachment=1",
+        help=f"Relative weights of the message kinds {KINDS} (Slack and Telegram)",
+    )
+    parser.add_argument("--attachment-kb", type=int, default=256)
+    parser.add_argument("--first-token-ms", type=float, default=100)
+    parser.add_argument("--tokens-per-second", type=float, default=500)
+    parser.add_argument("--answer-tokens", type=int, default=200)
+    parser.add_argument("--tool-calls", type=int, default=0)
+    parser.add_argument("--no-save", action="store_true", help="Don't store the results")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.mix_text = args.mix
+    args.mix = parse_mix(args.mix)
+
+    if args.child:
+        print(json.dumps(run_frontend(args)))
+        return
+
+    frontends = FRONTENDS if args.frontend == "all" else [args.frontend]
+    for frontend in frontends:
+        # The last --frontend wins
+        command = [sys.executable, os.path.abspath(__file__), *sys.argv[1:]]
+        command += ["--child", "--frontend", frontend]
+        child = subprocess.run(command, cwd=ROOT, stdout=subprocess.PIPE, text=True)
+        if child.returncode != 0:
+            print(f"\n{frontend}: failed with exit code {child.returncode}")
+            continue
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        scenario = scenario_of(args, frontend)
+        print_result(frontend, result, load_previous(scenario))
+        if not args.no_save:
+            os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+            record = {
+                "ts": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+                "revision": git_revision(),
+                "python": platform.python_version(),
+                "scenario": scenario,
+                "results": result,
+            }
+            with open(RESULTS_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
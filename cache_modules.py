@@ -0,0 +1,82 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+def content_digest(data: bytes) -> str:
+    """SHA-256 of a file's bytes, used as its content address."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class DiskLRUCache:
+    """
+    Size-bounded cache on local disk. Each entry is a file named "<key>.<kind>",
+    so one key (e.g. a content digest) can hold several derived forms: an upload
+    URI, a downscaled image, extracted text. The least recently used entries are
+    evicted once the total size exceeds `max_bytes`.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+
+        # Pick up entries from previous runs, oldest access first
+        existing = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                existing.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(existing):
+            self._entries[name] = size
+            self._total_bytes += size
+        self._evict()
+
+    def get(self, key: str, kind: str) -> bytes | None:
+        name = f"{key}.{kind}"
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+            size = self._entries[name]
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            if len(data) != size:
+                # Truncated or rewritten behind the cache's back
+                os.remove(path)
+                raise OSError(f"size mismatch in {name}")
+            os.utime(path)  # keeps LRU order across restarts
+        except OSError:
+            with self._lock:
+                self._total_bytes -= self._entries.pop(name, 0)
+            return None
+        return data
+
+    def put(self, key: str, kind: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        name = f"{key}.{kind}"
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._total_bytes += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._total_bytes > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
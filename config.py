@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -10,6 +11,8 @@ load_dotenv(dotenv_path=dotenv_path, override=True)
 SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN", "")
 SLACK_SIGNING_SECRET = os.getenv("SLACK_SIGNING_SECRET", "")
 SLACK_APP_TOKEN = os.getenv("SLACK_APP_TOKEN", "")
+# Base URL of the Slack Web API, e.g. a local stand-in for load tests. Empty for Slack's own.
+SLACK_API_URL = os.getenv("SLACK_API_URL", "")
 
 # --- Telegram ---
 # TELEGRAM_BOT_TOKEN is required to run the Telegram bot.
@@ -22,12 +25,139 @@ TELEGRAM_USE_WEBHOOK = os.getenv("TELEGRAM_USE_WEBHOOK", "false").lower() in [
 ]
 TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "")
 TELEGRAM_WEBHOOK_PORT = int(os.getenv("TELEGRAM_WEBHOOK_PORT", "8443"))
+# Seconds to wait for the remaining items of an album before querying the agent.
+TELEGRAM_MEDIA_GROUP_WINDOW = float(os.getenv("TELEGRAM_MEDIA_GROUP_WINDOW", "1.0"))
 
 # --- Google Cloud ---
 GOOGLE_CLOUD_PROJECT = os.getenv("GOOGLE_CLOUD_PROJECT", "")
 GOOGLE_CLOUD_LOCATION = os.getenv("GOOGLE_CLOUD_LOCATION", "")
 GCP_SERVICE_ACCOUNT_STRING = os.getenv("GCP_SERVICE_ACCOUNT", "")
 GOOGLE_CLOUD_BUCKET = os.getenv("GOOGLE_CLOUD_BUCKET", "")
+# Set to a local GCS emulator (e.g. fake-gcs-server at http://localhost:4443) for testing.
+STORAGE_EMULATOR_HOST = os.getenv("STORAGE_EMULATOR_HOST", "")
+
+# --- Attachments ---
+# Attachments larger than this are uploaded to GOOGLE_CLOUD_BUCKET and sent to the
+# agent as file_data URIs instead of inline base64. 0 disables offloading.
+ATTACHMENT_OFFLOAD_THRESHOLD_BYTES = int(
+    os.getenv("ATTACHMENT_OFFLOAD_THRESHOLD_BYTES", "0")
+)
+# Size ceiling for offloaded attachments (inline ones stay capped at 20 MB).
+# Telegram bots can't download files over 20 MB, so this only raises Slack's limit.
+MAX_OFFLOADED_FILE_SIZE_BYTES = int(
+    os.getenv("MAX_OFFLOADED_FILE_SIZE_BYTES", str(500 * 1024 * 1024))
+)
+# Offloaded attachments are deleted from the bucket by a lifecycle rule this many
+# days after upload. Older sessions then lose access to them. 0 keeps them forever.
+ATTACHMENT_RETENTION_DAYS = int(os.getenv("ATTACHMENT_RETENTION_DAYS", "30"))
+# Local content-addressed cache of upload URIs and preprocessed attachments.
+# 0 disables the cache.
+ATTACHMENT_CACHE_DIR = os.getenv(
+    "ATTACHMENT_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "agent_interface", "attachments"),
+)
+ATTACHMENT_CACHE_MAX_BYTES = int(
+    os.getenv("ATTACHMENT_CACHE_MAX_BYTES", str(512 * 1024 * 1024))
+)
+# Local cache of artifacts produced by the agent. 0 disables the cache.
+ARTIFACT_CACHE_DIR = os.getenv(
+    "ARTIFACT_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "agent_interface", "artifacts"),
+)
+ARTIFACT_CACHE_MAX_BYTES = int(
+    os.getenv("ARTIFACT_CACHE_MAX_BYTES", str(256 * 1024 * 1024))
+)
+
+# --- Image preprocessing (requires Pillow) ---
+# Longest side, in pixels, of images sent to the agent. 0 disables downscaling.
+IMAGE_MAX_SIDE_PX = int(os.getenv("IMAGE_MAX_SIDE_PX", "0"))
+# Re-encode format ("JPEG", "WEBP", "PNG"); empty keeps the original format.
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+# Images smaller than this are sent unchanged.
+IMAGE_MIN_BYTES = int(os.getenv("IMAGE_MIN_BYTES", str(256 * 1024)))
+
+# --- Document preprocessing ---
+# Send extracted PDF text (requires pypdf) and CSV samples instead of the raw files.
+DOCUMENT_EXTRACTION_ENABLED = os.getenv(
+    "DOCUMENT_EXTRACTION_ENABLED", "false"
+).lower() in ["1", "true", "yes"]
+# Documents smaller than this are sent unchanged.
+DOCUMENT_EXTRACTION_MIN_BYTES = int(
+    os.getenv("DOCUMENT_EXTRACTION_MIN_BYTES", str(512 * 1024))
+)
+PDF_MAX_TEXT_CHARS = int(os.getenv("PDF_MAX_TEXT_CHARS", "200000"))
+# Number of rows kept from the start and from the end of a large CSV.
+CSV_SAMPLE_ROWS = int(os.getenv("CSV_SAMPLE_ROWS", "20"))
+
+# --- Executors ---
+# Attachment work on payloads below this size runs inline on the event loop.
+EXECUTOR_INLINE_MAX_BYTES = int(os.getenv("EXECUTOR_INLINE_MAX_BYTES", str(256 * 1024)))
+EXECUTOR_THREADS = int(os.getenv("EXECUTOR_THREADS", "4"))
+
+# --- Logging ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" (one object per line, with request ids) or "text"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Records waiting for the writer thread; beyond this they are dropped, not buffered
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Longer messages are truncated, so attachment or event bodies never reach the logs whole
+LOG_MAX_MESSAGE_CHARS = int(os.getenv("LOG_MAX_MESSAGE_CHARS", "1000"))
+# The same warning (same code line) is logged at most once per this many seconds
+LOG_RATE_LIMIT_SECONDS = float(os.getenv("LOG_RATE_LIMIT_SECONDS", "60"))
+
+# --- Tracing ---
+# Where request spans go: "jsonl" (TRACE_FILE), "otlp" (OTLP/HTTP JSON collector)
+# or empty to disable tracing.
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "").lower()
+TRACE_FILE = os.getenv(
+    "TRACE_FILE", os.path.join(tempfile.gettempdir(), "agent_interface", "traces.jsonl")
+)
+TRACE_OTLP_ENDPOINT = os.getenv(
+    "TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces"
+)
+# Fraction of requests traced, from 0.0 to 1.0.
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "agent-interface")
+# Finished spans waiting for the exporter thread; beyond this they are dropped,
+# so a stalled collector can't grow memory without bound
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "10000"))
+
+# --- Metrics ---
+# Port of the Prometheus /metrics endpoint; 0 disables it. Each front-end runs in
+# its own process, so give each one its own port.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# --- Admin ---
+# Slack/Telegram user ids allowed to run /profile and to see usage of all channels
+# with /usage. Everyone else only sees usage of the channel the command was sent in.
+ADMIN_IDS = [x.strip() for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()]
+
+# --- Usage accounting ---
+# SQLite file where token usage of each agent invocation is recorded. Empty disables it.
+USAGE_DB_PATH = os.getenv(
+    "USAGE_DB_PATH", os.path.join(tempfile.gettempdir(), "agent_interface", "usage.sqlite3")
+)
+# Prices in USD per million tokens, for cost estimates. Thought tokens are billed as output.
+USAGE_PROMPT_PRICE_PER_MTOK = float(os.getenv("USAGE_PROMPT_PRICE_PER_MTOK", "0"))
+USAGE_OUTPUT_PRICE_PER_MTOK = float(os.getenv("USAGE_OUTPUT_PRICE_PER_MTOK", "0"))
+
+# --- Profiling ---
+# Enables the /profile admin command and the SIGUSR1 trigger, which sample all
+# thread stacks and write a collapsed-stack file (flamegraph.pl, speedscope).
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in [
+    "1",
+    "true",
+    "yes",
+]
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR", os.path.join(tempfile.gettempdir(), "agent_interface", "profiles")
+)
+PROFILE_SECONDS = float(os.getenv("PROFILE_SECONDS", "30"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+# Logs the event loop's stack when a callback blocks it longer than this. 0 disables it.
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "0"))
 
 # --- Agent Engine ---
 AGENT_ENGINE_ID = os.getenv("AGENT_ENGINE_ID", "")
@@ -38,3 +168,32 @@ ENDPOINT = (
     if AGENT_ENGINE_ID
     else None
 )
+
+# --- Fake Agent Engine ---
+# Offline mode for local runs and load tests: engine_modules uses the in-process
+# stand-ins of fake_engine_modules and api_modules calls the fake server
+# (python fake_engine_modules.py), without credentials or network.
+AGENT_ENGINE_FAKE = os.getenv("AGENT_ENGINE_FAKE", "false").lower() in [
+    "1",
+    "true",
+    "yes",
+]
+FAKE_ENGINE_PORT = int(os.getenv("FAKE_ENGINE_PORT", "8089"))
+if AGENT_ENGINE_FAKE:
+    ENDPOINT = f"http://127.0.0.1:{FAKE_ENGINE_PORT}/v1/reasoningEngines/fake"
+# Streamed answer: its length, the delay before its first token and the token rate (0 = no delay)
+FAKE_ENGINE_ANSWER_TOKENS = int(os.getenv("FAKE_ENGINE_ANSWER_TOKENS", "200"))
+FAKE_ENGINE_FIRST_TOKEN_DELAY_MS = float(
+    os.getenv("FAKE_ENGINE_FIRST_TOKEN_DELAY_MS", "500")
+)
+FAKE_ENGINE_TOKENS_PER_SECOND = float(os.getenv("FAKE_ENGINE_TOKENS_PER_SECOND", "50"))
+# Tool call/response pairs streamed before the answer, each taking FAKE_ENGINE_TOOL_LATENCY_MS
+FAKE_ENGINE_TOOL_CALLS = int(os.getenv("FAKE_ENGINE_TOOL_CALLS", "0"))
+FAKE_ENGINE_TOOL_LATENCY_MS = float(os.getenv("FAKE_ENGINE_TOOL_LATENCY_MS", "200"))
+# Injected failures, as the fraction of queries that get them: a 404 for an
+# expired session, a 429, or a stream cut off halfway through the answer
+FAKE_ENGINE_SESSION_404_RATE = float(os.getenv("FAKE_ENGINE_SESSION_404_RATE", "0"))
+FAKE_ENGINE_429_RATE = float(os.getenv("FAKE_ENGINE_429_RATE", "0"))
+FAKE_ENGINE_STREAM_DROP_RATE = float(os.getenv("FAKE_ENGINE_STREAM_DROP_RATE", "0"))
+# Seed of the failure draws, for reproducible runs. Empty for a random seed.
+FAKE_ENGINE_SEED = os.getenv("FAKE_ENGINE_SEED", "")
@@ -5,16 +5,32 @@ from google.adk.memory import VertexAiMemoryBankService
 from google.adk.artifacts import GcsArtifactService
 # from google.adk.tools.tool_confirmation import ToolConfirmation
 from google.genai import types
+from google.cloud import storage
+from google.api_core.exceptions import PreconditionFailed
 
+import asyncio
 import datetime
+import functools
+import io
 import json
+import logging
+import time
 import uuid
 import base64
 from google.oauth2 import service_account
+from google.auth.credentials import AnonymousCredentials
 import google.auth
 from google.auth.transport import requests as google_requests
 import config
+import attachment_modules
+import cache_modules
+import executor_modules
+import fake_engine_modules
+import metrics_modules
+import stream_events
+import tracing_modules
 
+logger = logging.getLogger(__name__)
 
 # --- Auth ---
 def get_credentials():
@@ -32,30 +48,42 @@ def get_credentials():
 
 
 # --- Initialization ---
-# Get credentials from the service account
-credentials = get_credentials()
-
-google.auth.default = lambda *args, **kwargs: (credentials, credentials.project_id)
-
-# Initialize the Vertex AI SDK globally
-vertexai_init(
-    credentials=credentials,
-    project=config.GOOGLE_CLOUD_PROJECT,
-    location=config.GOOGLE_CLOUD_LOCATION,
-)
+if config.AGENT_ENGINE_FAKE:
+    # Offline: the services below come from fake_engine_modules
+    credentials = None
+else:
+    # Get credentials from the service account
+    credentials = get_credentials()
+
+    google.auth.default = lambda *args, **kwargs: (credentials, credentials.project_id)
+
+    # Initialize the Vertex AI SDK globally
+    vertexai_init(
+        credentials=credentials,
+        project=config.GOOGLE_CLOUD_PROJECT,
+        location=config.GOOGLE_CLOUD_LOCATION,
+    )
 
 # --- Necessary variables ---
-MAX_FILE_SIZE_BYTES = 20 * 1024 * 1024
-MIME_TYPE_MAPPING = {
-    "png": "image/png",
-    "jpg": "image/jpeg",
-    "jpeg": "image/jpeg",
-    "webp": "image/webp",
-    "pdf": "application/pdf",
-    "txt": "text/plain",
-    "csv": "text/plain",
-}
-SUPPORTED_MIME_TYPES = set([x for x in MIME_TYPE_MAPPING.values()])
+MAX_FILE_SIZE_BYTES = attachment_modules.MAX_FILE_SIZE_BYTES
+MIME_TYPE_MAPPING = attachment_modules.MIME_TYPE_MAPPING
+SUPPORTED_MIME_TYPES = attachment_modules.SUPPORTED_MIME_TYPES
+# Text kept in the session event for text files stored as artifacts
+CONTEXT_EXCERPT_BYTES = 2000
+# Bucket folder of offloaded attachments, which the lifecycle rule applies to
+ATTACHMENT_PREFIX = "attachments/"
+attachment_cache = (
+    cache_modules.DiskLRUCache(
+        config.ATTACHMENT_CACHE_DIR, config.ATTACHMENT_CACHE_MAX_BYTES
+    )
+    if config.ATTACHMENT_CACHE_MAX_BYTES
+    else None
+)
+artifact_cache = (
+    cache_modules.DiskLRUCache(config.ARTIFACT_CACHE_DIR, config.ARTIFACT_CACHE_MAX_BYTES)
+    if config.ARTIFACT_CACHE_MAX_BYTES
+    else None
+)
 
 
 # --- Remote Agent and Services ---
@@ -63,12 +91,16 @@ SUPPORTED_MIME_TYPES = set([x for x in MIME_TYPE_MAPPING.values()])
 
 def get_remote_agent(resource_name=config.AGENT_ENGINE_ID):
     """Gets the remote agent engine, relying on the global SDK initialization."""
+    if config.AGENT_ENGINE_FAKE:
+        return fake_engine_modules.get_agent_app()
     remote_app = agent_engines.get(resource_name)
     return remote_app
 
 
 def get_session_service() -> VertexAiSessionService:
     """Initializes the session service with explicit credentials."""
+    if config.AGENT_ENGINE_FAKE:
+        return fake_engine_modules.get_session_service()
     return VertexAiSessionService(
         project=config.GOOGLE_CLOUD_PROJECT,
         location=config.GOOGLE_CLOUD_LOCATION,
@@ -77,6 +109,8 @@ def get_session_service() -> VertexAiSessionService:
 
 def get_memory_service() -> VertexAiMemoryBankService:
     """Initializes the memory service with explicit credentials."""
+    if config.AGENT_ENGINE_FAKE:
+        return fake_engine_modules.get_memory_service()
     return VertexAiMemoryBankService(
         agent_engine_id=config.AGENT_ENGINE_ID.split("/")[-1],
         project=credentials.project_id,
@@ -85,12 +119,190 @@ def get_memory_service() -> VertexAiMemoryBankService:
 
 def get_artifact_service() -> GcsArtifactService:
     """Initializes the artifact service with explicit credentials."""
+    if config.AGENT_ENGINE_FAKE:
+        return fake_engine_modules.get_artifact_service()
     return GcsArtifactService(
         bucket_name=config.GOOGLE_CLOUD_BUCKET, credentials=credentials
     )
 
 
+@functools.cache
+def get_storage_client() -> storage.Client:
+    """Initializes the Cloud Storage client, or an emulator client if STORAGE_EMULATOR_HOST is set."""
+    if config.STORAGE_EMULATOR_HOST:
+        return storage.Client(
+            project=config.GOOGLE_CLOUD_PROJECT or "local",
+            credentials=AnonymousCredentials(),
+        )
+    return storage.Client(project=config.GOOGLE_CLOUD_PROJECT, credentials=credentials)
+
+
+@functools.cache
+def ensure_attachment_lifecycle() -> None:
+    """
+    Adds a rule deleting offloaded attachments ATTACHMENT_RETENTION_DAYS after
+    upload, once per process. Without storage.buckets.update permission the rule
+    has to be set on the bucket by hand (same age, prefix "attachments/").
+    """
+    if not config.ATTACHMENT_RETENTION_DAYS:
+        return
+    try:
+        bucket = get_storage_client().get_bucket(config.GOOGLE_CLOUD_BUCKET)
+        for rule in bucket.lifecycle_rules:
+            condition = rule.get("condition", {})
+            if (
+                rule.get("action", {}).get("type") == "Delete"
+                and condition.get("age") == config.ATTACHMENT_RETENTION_DAYS
+                and condition.get("matchesPrefix") == [ATTACHMENT_PREFIX]
+            ):
+                return
+        bucket.add_lifecycle_delete_rule(
+            age=config.ATTACHMENT_RETENTION_DAYS, matches_prefix=[ATTACHMENT_PREFIX]
+        )
+        bucket.patch()
+        logger.info(
+            f"Attachments in {config.GOOGLE_CLOUD_BUCKET} now expire after "
+            f"{config.ATTACHMENT_RETENTION_DAYS} days"
+        )
+    except Exception as e:
+        logger.warning(f"Could not set the attachment lifecycle rule: {e}")
+
+
+def is_upload_fresh(uploaded_at: float) -> bool:
+    """Whether an upload has at least a day left before the lifecycle rule deletes it."""
+    if not config.ATTACHMENT_RETENTION_DAYS:
+        return True
+    age_days = (time.time() - uploaded_at) / 86400
+    return age_days < config.ATTACHMENT_RETENTION_DAYS - 1
+
+
+def upload_attachment(file_content: bytes, file_name: str, mime_type: str) -> str:
+    """
+    Uploads an attachment to GOOGLE_CLOUD_BUCKET and returns its gs:// URI.
+    Objects are named by content digest, so a file that was uploaded before
+    (by this or any other process) costs a hash and a cache lookup, or a
+    metadata request, as long as the upload isn't about to expire.
+    """
+    digest = cache_modules.content_digest(file_content)
+    if attachment_cache:
+        cached = attachment_cache.get(digest, "uri")
+        cached_uri, _, uploaded_at = (cached or b"").decode("utf-8", "replace").partition(" ")
+        try:
+            if cached_uri and is_upload_fresh(float(uploaded_at)):
+                return cached_uri
+        except ValueError:
+            pass  # unreadable entry: check the bucket instead
+
+    ensure_attachment_lifecycle()
+    bucket = get_storage_client().bucket(config.GOOGLE_CLOUD_BUCKET)
+    name = f"{ATTACHMENT_PREFIX}{digest}"
+    # A simple upload sends the whole body before a precondition can fail, so
+    # look for the object first: known content costs one metadata request
+    existing = bucket.get_blob(name)
+    if existing is not None and is_upload_fresh(existing.time_created.timestamp()):
+        logger.debug(f"Attachment '{file_name}' already uploaded as {name}")
+        blob, uploaded_at = existing, existing.time_created.timestamp()
+    else:
+        blob = bucket.blob(name)
+        try:
+            # Create, or replace an upload near expiry so the lifecycle rule's
+            # age starts over; a concurrent upload of the same content wins
+            blob.upload_from_file(
+                io.BytesIO(file_content),
+                size=len(file_content),
+                content_type=mime_type,
+                if_generation_match=existing.generation if existing else 0,
+            )
+        except PreconditionFailed:
+            logger.debug(f"Attachment '{file_name}' was uploaded concurrently as {name}")
+        uploaded_at = time.time()
+    file_uri = f"gs://{config.GOOGLE_CLOUD_BUCKET}/{blob.name}"
+    if attachment_cache:
+        attachment_cache.put(digest, "uri", f"{file_uri} {uploaded_at:.0f}".encode("utf-8"))
+    return file_uri
+
+
+def preprocess_attachment(file_content: bytes, mime_type: str) -> tuple[bytes, str]:
+    """Runs the optional local preprocessing stages, reusing cached results."""
+    if not attachment_modules.should_downscale_image(len(file_content), mime_type):
+        return file_content, mime_type
+
+    digest = cache_modules.content_digest(file_content)
+    kind = attachment_modules.get_image_settings_key()
+    if attachment_cache:
+        cached_image = attachment_cache.get(digest, kind)
+        if cached_image == b"":
+            # Cached verdict: re-encoding doesn't make this image smaller
+            return file_content, mime_type
+        if cached_image:
+            return cached_image, attachment_modules.IMAGE_FORMAT_MIME_TYPES.get(
+                config.IMAGE_FORMAT, mime_type
+            )
+    try:
+        result = attachment_modules.downscale_image(file_content, mime_type)
+    except Exception as e:
+        logger.warning(f"Image preprocessing failed, sending original: {e}")
+        return file_content, mime_type
+    if result is None:
+        if attachment_cache:
+            attachment_cache.put(digest, kind, b"")
+        return file_content, mime_type
+    processed, processed_mime_type = result
+    if attachment_cache:
+        attachment_cache.put(digest, kind, processed)
+    return processed, processed_mime_type
+
+
+def get_document_text(
+    file_content: bytes,
+    file_name: str,
+    provided_file_type: str | None,
+    originals: list | None = None,
+) -> str | None:
+    """
+    Returns extracted text (PDF) or a schema and sample (CSV) to send instead of
+    the raw file, or None if the file should be sent as-is. If `originals` is
+    given, the file is appended to it as (name, mime_type, content) for the
+    caller to keep as an artifact.
+    """
+    kind = attachment_modules.get_document_kind(
+        file_name, provided_file_type, len(file_content)
+    )
+    if not kind:
+        return None
+
+    digest = cache_modules.content_digest(file_content)
+    cache_kind = f"{kind}{config.PDF_MAX_TEXT_CHARS if kind == 'pdf' else config.CSV_SAMPLE_ROWS}"
+    cached_text = attachment_cache.get(digest, cache_kind) if attachment_cache else None
+    if cached_text is not None:
+        document_text = cached_text.decode("utf-8")
+    else:
+        try:
+            if kind == "pdf":
+                document_text = attachment_modules.extract_pdf_text(file_content)
+            else:
+                document_text = attachment_modules.summarize_csv(file_content)
+        except Exception as e:
+            logger.warning(f"Text extraction failed for '{file_name}', sending file: {e}")
+            return None
+        if document_text is None:
+            return None
+        if attachment_cache:
+            attachment_cache.put(digest, cache_kind, document_text.encode("utf-8"))
+
+    header = f"[Attached file '{file_name}', {'extracted text' if kind == 'pdf' else 'CSV summary'}"
+    # Keep the full file reachable for tools that need more than the sample
+    mime_type = "application/pdf" if kind == "pdf" else "text/csv"
+    if originals is not None:
+        originals.append((file_name, mime_type, file_content))
+        header += f"; original saved as artifact '{file_name}'"
+    elif attachment_modules.is_offload_enabled():
+        header += f"; full file: {upload_attachment(file_content, file_name, mime_type)}"
+    return f"{header}]\n{document_text}"
+
+
 # --- Session Management ---
+@metrics_modules.counted("agent_engine")
 async def list_sessions(
     session_service: VertexAiSessionService, user_id: str
 ) -> list | None:
@@ -103,6 +315,7 @@ async def list_sessions(
         return None
 
 
+@metrics_modules.counted("agent_engine")
 async def create_session(
     session_service: VertexAiSessionService, user_id: str, session_id: str | None = None
 ) -> str:
@@ -112,6 +325,7 @@ async def create_session(
     return remote_session.id
 
 
+@metrics_modules.counted("agent_engine")
 async def get_session(
     session_service: VertexAiSessionService, user_id: str, session_id: str
 ) -> Session | None:
@@ -131,6 +345,7 @@ async def get_or_create_session(
     return await create_session(session_service, user_id, session_id)
 
 
+@metrics_modules.counted("agent_engine")
 async def delete_session(
     session_service: VertexAiSessionService, user_id: str, session_id: str
 ):
@@ -139,6 +354,55 @@ async def delete_session(
     )
 
 
+def build_event_parts(
+    message: str | None, file_list: list | None, as_artifacts: bool = False
+) -> tuple[list[types.Part], list[tuple]]:
+    """
+    Builds the parts of a session event. With `as_artifacts`, accepted files are
+    returned as (name, mime_type, content, size) tuples instead of inline parts.
+    """
+    parts = []
+    accepted_files = []  # files to be stored as artifacts
+    if message:
+        parts.append(types.Part(text=message))
+
+    if file_list:
+        for file in file_list:
+            file_content = file["content"]  # This is the raw file data in bytes
+            file_name = file.get("name", "unknown_file")
+            file_size = file.get("size") or len(file_content)
+            provided_file_type = file.get("mime_type")
+
+            rejection_reason = attachment_modules.get_rejection_reason(
+                file_size,
+                provided_file_type,
+                max_size=None if as_artifacts else MAX_FILE_SIZE_BYTES,
+                file_name=file_name,
+            )
+            if rejection_reason:
+                logger.info(f"Skipping file '{file_name}': {rejection_reason}")
+                continue
+            actual_mime_type = attachment_modules.classify_file(
+                file_name, provided_file_type, file_content
+            )
+            if not actual_mime_type:
+                logger.info(f"Skipping file '{file_name}': Content doesn't match a supported type.")
+                continue
+            if as_artifacts:
+                accepted_files.append(
+                    (file_name, actual_mime_type, file_content, file_size)
+                )
+                continue
+            parts.append(
+                types.Part(
+                    inline_data=types.Blob(
+                        mime_type=actual_mime_type, data=file_content
+                    )
+                )
+            )
+    return parts, accepted_files
+
+
 async def update_session(
     session_service: VertexAiSessionService,
     session_id: str,
@@ -147,6 +411,7 @@ async def update_session(
     message: str | None = None,
     file_list: list | None = None,
     state_delta: dict = {},
+    artifact_service: GcsArtifactService | None = None,
 ):
     """
     file_list, if provided, must be a list of dicts with keys:
@@ -156,57 +421,88 @@ async def update_session(
         "content": response_content,  # This is the raw file data in bytes
         "size": file_size,
     }
+    If artifact_service is provided, files are saved as artifacts and the event only
+    keeps a short reference (plus an excerpt for text files) instead of the raw bytes.
     """
 
-    # Assuming get_session is a working helper function you have defined elsewhere
-    session = await get_session(
-        session_service=session_service, user_id=user_id, session_id=session_id
-    )
-    parts = []
-    if message:
-        parts.append(types.Part(text=message))
-
-    if file_list:
-        for file in file_list:
-            file_content = file["content"]  # This is the raw file data in bytes
-            file_name = file.get("name", "unknown_file")
-            file_size = file.get("size", len(file_content))
-            provided_file_type = file.get("mime_type")
-            if provided_file_type and "/" in provided_file_type:
-                provided_file_type = provided_file_type.split("/")[-1]
-
-            if file_size > MAX_FILE_SIZE_BYTES:
-                print(
-                    f"Skipping file '{file_name}': Size ({file_size / (1024*1024):.2f} MB) exceeds 20 MB limit."
-                )
-                continue
+    payload_bytes = sum(len(file["content"]) for file in file_list or [])
+    with tracing_modules.span(
+        "update_session", session_id=session_id, payload_bytes=payload_bytes
+    ):
+        # Assuming get_session is a working helper function you have defined elsewhere
+        session = await get_session(
+            session_service=session_service, user_id=user_id, session_id=session_id
+        )
+        parts, accepted_files = await executor_modules.run_blocking(
+            build_event_parts,
+            message,
+            file_list,
+            as_artifacts=artifact_service is not None,
+            payload_bytes=payload_bytes,
+        )
 
-            actual_mime_type = MIME_TYPE_MAPPING.get(provided_file_type, None)
-            if actual_mime_type not in SUPPORTED_MIME_TYPES:
-                print(
-                    f"Skipping file '{file_name}': Unsupported MIME type '{provided_file_type}' (resolved to '{actual_mime_type}')."
-                )
-                continue
-            parts.append(
-                types.Part(
-                    inline_data=types.Blob(
-                        mime_type=actual_mime_type, data=file_content
+        if accepted_files:
+            versions = await asyncio.gather(
+                *[
+                    save_artifact(
+                        artifact_service=artifact_service,
+                        session_id=session_id,
+                        user_id=user_id,
+                        filename=file_name,
+                        file_content=file_content,
+                        mime_type=mime_type,
+                    )
+                    for file_name, mime_type, file_content, _ in accepted_files
+                ],
+                return_exceptions=True,
+            )
+            for (file_name, mime_type, file_content, file_size), version in zip(
+                accepted_files, versions
+            ):
+                # One failed save must not cost the event its text and other files
+                if isinstance(version, Exception):
+                    logger.warning(
+                        f"Skipping file '{file_name}': could not save it as an artifact: {version}"
+                    )
+                    continue
+                parts.append(
+                    types.Part(
+                        text=get_artifact_reference(
+                            file_name, mime_type, file_content, file_size, version
+                        )
                     )
                 )
+
+        if session:
+            actions = EventActions(state_delta=state_delta)
+            event = Event(
+                actions=actions,
+                content=types.Content(parts=parts, role=author),
+                author=author,
+                invocation_id=f"invocation_{uuid.uuid4()}",
+                id=f"id_{uuid.uuid4()}",
             )
+            await session_service.append_event(session=session, event=event)
 
-    if session:
-        actions = EventActions(state_delta=state_delta)
-        event = Event(
-            actions=actions,
-            content=types.Content(parts=parts, role=author),
-            author=author,
-            invocation_id=f"invocation_{uuid.uuid4()}",
-            id=f"id_{uuid.uuid4()}",
+
+def get_artifact_reference(
+    file_name: str, mime_type: str, file_content: bytes, file_size: int, version
+) -> str:
+    """Short text stand-in for an attachment stored as an artifact."""
+    reference = (
+        f"[Attached file '{file_name}' ({mime_type}, {file_size} bytes) "
+        f"saved as artifact '{file_name}', version {version}.]"
+    )
+    if mime_type == "text/plain":
+        excerpt = bytes(file_content[:CONTEXT_EXCERPT_BYTES]).decode(
+            "utf-8", errors="replace"
         )
-        await session_service.append_event(session=session, event=event)
+        truncated = " (truncated)" if file_size > CONTEXT_EXCERPT_BYTES else ""
+        reference += f"\nExcerpt{truncated}:\n{excerpt}"
+    return reference
 
 
+@metrics_modules.counted("agent_engine")
 async def save_artifact(
     artifact_service: GcsArtifactService,
     session_id,
@@ -223,12 +519,15 @@ async def save_artifact(
         filename=filename,
         artifact=part,
     )
-    print(f"ARTIFACT SAVE RESULT: {result}\n\n\n")
+    logger.debug(
+        f"Saved artifact '{filename}' ({mime_type}, {len(file_content)} bytes) as version {result}"
+    )
     return result
 
 
+@metrics_modules.counted("agent_engine")
 async def load_artifact(
-    artifact_service: GcsArtifactService, session_id, user_id, filename
+    artifact_service: GcsArtifactService, session_id, user_id, filename, version=None
 ):
     try:
         result = await artifact_service.load_artifact(
@@ -236,15 +535,97 @@ async def load_artifact(
             user_id=user_id,
             session_id=session_id,
             filename=filename,
+            version=version,
+        )
+        # Metadata only: the Part holds the whole file
+        inline_data = result.inline_data if result else None
+        logger.debug(
+            f"Loaded artifact '{filename}' version {version}: "
+            f"{len(inline_data.data or b'') if inline_data else 0} bytes"
         )
-        print(f"ARTIFACT LOAD RESULT: {result}\n\n\n")
     except Exception as e:
-        print(f"Error loading artifact '{filename}': {e}")
+        logger.error(f"Error loading artifact '{filename}': {e}")
         return None
     return result
 
 
-def prepare_message_dict(text: str, file_list: list | None = None) -> dict:
+async def load_artifact_cached(
+    artifact_service: GcsArtifactService, session_id, user_id, filename, version
+) -> tuple[bytes, str] | None:
+    """
+    Loads the (data, mime_type) of an artifact version. Versions never change,
+    so they are kept in the local artifact cache after the first fetch.
+    """
+    key = cache_modules.content_digest(
+        f"{config.APP_NAME}/{user_id}/{session_id}/{filename}/{version}".encode("utf-8")
+    )
+    if artifact_cache:
+        cached_data = artifact_cache.get(key, "data")
+        cached_mime_type = artifact_cache.get(key, "mime")
+        if cached_data is not None and cached_mime_type is not None:
+            return cached_data, cached_mime_type.decode("utf-8")
+
+    artifact = await load_artifact(
+        artifact_service=artifact_service,
+        session_id=session_id,
+        user_id=user_id,
+        filename=filename,
+        version=version,
+    )
+    if not artifact:
+        return None
+    if artifact.inline_data and artifact.inline_data.data is not None:
+        data = artifact.inline_data.data
+        mime_type = artifact.inline_data.mime_type or "application/octet-stream"
+    elif artifact.text is not None:
+        data, mime_type = artifact.text.encode("utf-8"), "text/plain"
+    else:
+        return None
+    if artifact_cache and version is not None:
+        artifact_cache.put(key, "data", data)
+        artifact_cache.put(key, "mime", mime_type.encode("utf-8"))
+    return data, mime_type
+
+
+class ArtifactPrefetchSink(stream_events.StreamSink):
+    """
+    Starts fetching each artifact the agent creates as soon as its delta is
+    streamed, so the files are ready when the answer is done. Keeps only the
+    latest version of each filename; call cancel() once the answer is posted, or
+    abandoned, so no fetch outlives the reply.
+    """
+
+    wants_artifacts = True
+
+    def __init__(self, artifact_service: GcsArtifactService, session_id, user_id):
+        self.artifact_service = artifact_service
+        self.session_id = session_id
+        self.user_id = user_id
+        self.tasks: dict[str, asyncio.Task] = {}
+
+    def on_artifact_delta(self, event: stream_events.ArtifactDelta):
+        replaced = self.tasks.get(event.filename)
+        if replaced:
+            replaced.cancel()
+        self.tasks[event.filename] = asyncio.create_task(
+            load_artifact_cached(
+                artifact_service=self.artifact_service,
+                session_id=self.session_id,
+                user_id=self.user_id,
+                filename=event.filename,
+                version=event.version,
+            )
+        )
+
+    def cancel(self):
+        """Cancels the fetches that haven't finished yet."""
+        for task in self.tasks.values():
+            task.cancel()
+
+
+def prepare_message_dict(
+    text: str, file_list: list | None = None, originals: list | None = None
+) -> dict:
     """
     file_list, if provided, must be a list of dicts with keys:
     {
@@ -253,6 +634,8 @@ def prepare_message_dict(text: str, file_list: list | None = None) -> dict:
         "content": response_content,  # This is the raw file data in bytes
         "size": file_size,
     }
+    Documents sent as extracted text are appended to `originals`, if given
+    (see get_document_text).
     """
     message = {"parts": [], "role": "user"}
 
@@ -263,25 +646,50 @@ def prepare_message_dict(text: str, file_list: list | None = None) -> dict:
         for file in file_list:
             file_content = file["content"]  # This is the raw file data in bytes
             file_name = file.get("name", "unknown_file")
-            file_size = file.get("size", len(file_content))
+            file_size = file.get("size") or len(file_content)
             provided_file_type = file.get("mime_type")
-            if provided_file_type and "/" in provided_file_type:
-                provided_file_type = provided_file_type.split("/")[-1]
-            encoded_content = base64.b64encode(file_content).decode("utf-8")
 
-            if file_size > MAX_FILE_SIZE_BYTES:
-                print(
-                    f"Skipping file '{file_name}': Size ({file_size / (1024*1024):.2f} MB) exceeds 20 MB limit."
-                )
+            # Check limits before encoding so skipped files cost nothing
+            rejection_reason = attachment_modules.get_rejection_reason(
+                file_size, provided_file_type, file_name=file_name
+            )
+            if rejection_reason:
+                logger.info(f"Skipping file '{file_name}': {rejection_reason}")
+                continue
+            actual_mime_type = attachment_modules.classify_file(
+                file_name, provided_file_type, file_content
+            )
+            if not actual_mime_type:
+                logger.info(f"Skipping file '{file_name}': Content doesn't match a supported type.")
                 continue
 
-            actual_mime_type = MIME_TYPE_MAPPING.get(provided_file_type, None)
-            if actual_mime_type not in SUPPORTED_MIME_TYPES:
-                print(
-                    f"Skipping file '{file_name}': Unsupported MIME type '{provided_file_type}' (resolved to '{actual_mime_type}')."
+            document_text = get_document_text(
+                file_content, file_name, provided_file_type, originals
+            )
+            if document_text is not None:
+                message["parts"].append({"text": document_text})
+                continue
+
+            file_content, actual_mime_type = preprocess_attachment(
+                file_content, actual_mime_type
+            )
+            file_size = len(file_content)
+
+            # Large files are referenced by URI instead of being inlined as base64
+            if attachment_modules.should_offload(file_size):
+                file_uri = upload_attachment(file_content, file_name, actual_mime_type)
+                message["parts"].append(
+                    {
+                        "file_data": {
+                            "file_uri": file_uri,
+                            "mime_type": actual_mime_type,
+                        }
+                    }
                 )
                 continue
 
+            encoded_content = base64.b64encode(file_content).decode("utf-8")
+
             message["parts"].append(
                 {
                     "inline_data": {
@@ -293,6 +701,51 @@ def prepare_message_dict(text: str, file_list: list | None = None) -> dict:
     return message
 
 
+async def prepare_message_dict_async(
+    text: str,
+    file_list: list | None = None,
+    artifact_service: GcsArtifactService | None = None,
+    session_id: str | None = None,
+    user_id: str | None = None,
+) -> dict:
+    """
+    prepare_message_dict for async handlers: large payloads are encoded off the
+    event loop, and so is any message whose files may be uploaded to the bucket.
+    With an artifact_service, documents sent as extracted text are also saved
+    whole as session artifacts.
+    """
+    payload_bytes = sum(len(file["content"]) for file in file_list or [])
+    originals = [] if artifact_service is not None else None
+    with tracing_modules.span("prepare_message_dict", payload_bytes=payload_bytes):
+        message = await executor_modules.run_blocking(
+            prepare_message_dict,
+            text,
+            file_list,
+            originals,
+            payload_bytes=payload_bytes,
+            network=bool(file_list) and attachment_modules.is_offload_enabled(),
+        )
+    if originals:
+        results = await asyncio.gather(
+            *[
+                save_artifact(
+                    artifact_service=artifact_service,
+                    session_id=session_id,
+                    user_id=user_id,
+                    filename=file_name,
+                    file_content=file_content,
+                    mime_type=mime_type,
+                )
+                for file_name, mime_type, file_content in originals
+            ],
+            return_exceptions=True,
+        )
+        for (file_name, _, _), result in zip(originals, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error saving original of '{file_name}' as an artifact: {result}")
+    return message
+
+
 async def list_messages(session_service: VertexAiSessionService, session_id, user_id):
     session = await get_session(
         session_service=session_service, session_id=session_id, user_id=user_id
@@ -355,8 +808,6 @@ async def send_tool_confirmation(
 
 
 if __name__ == "__main__":
-    import asyncio
-
     agent_app = get_remote_agent()
     session_service = get_session_service()
     session_id = asyncio.run(
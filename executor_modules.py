@@ -0,0 +1,35 @@
+"""Bounded pools that keep blocking attachment work off the bots' event loops."""
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import config
+
+_thread_pool: concurrent.futures.ThreadPoolExecutor | None = None
+
+
+def get_thread_pool() -> concurrent.futures.ThreadPoolExecutor:
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=config.EXECUTOR_THREADS, thread_name_prefix="attachments"
+        )
+    return _thread_pool
+
+
+async def run_blocking(
+    func, *args, payload_bytes: int = 0, network: bool = False, **kwargs
+):
+    """
+    Awaits a blocking call. Small payloads run inline, since a thread hop costs
+    more than the work itself; larger ones run in the bounded thread pool.
+    Calls that may wait on the network (`network`) always run in the pool.
+    Pooled calls run in a copy of the caller's context, so spans carry over.
+    """
+    if not network and payload_bytes < config.EXECUTOR_INLINE_MAX_BYTES:
+        return func(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        get_thread_pool(), functools.partial(context.run, func, *args, **kwargs)
+    )
@@ -0,0 +1,407 @@
+"""
+Offline stand-in for Vertex AI Agent Engine, for local runs and load tests.
+
+- In-process: FakeSessionService (an ADK InMemorySessionService that fails
+  like the Vertex one), FakeAgentApp (async_stream_query), plus in-memory
+  artifact and memory services. engine_modules returns these instead of the
+  real services when AGENT_ENGINE_FAKE is set.
+- Over HTTP: start_fake_server() serves the same agent on the `:query` and
+  `:streamQuery` REST methods that api_modules and the Streamlit app call, with
+  the stream as newline-delimited JSON. Run it with `python fake_engine_modules.py`.
+
+The answer is an echo of the message padded to FAKE_ENGINE_ANSWER_TOKENS words,
+streamed in chunks after FAKE_ENGINE_FIRST_TOKEN_DELAY_MS at
+FAKE_ENGINE_TOKENS_PER_SECOND, optionally after FAKE_ENGINE_TOOL_CALLS tool
+calls. Failures are injected at the configured rates: a 404 for an expired
+session, a 429, or a stream cut off halfway through the answer.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from google.adk.artifacts import InMemoryArtifactService
+from google.adk.events import Event
+from google.adk.sessions import InMemorySessionService, Session
+from google.genai import errors, types
+
+import config
+import json_modules
+
+logger = logging.getLogger(__name__)
+
+AGENT_NAME = "fake_agent"
+TOKENS_PER_CHUNK = 5
+_FILLER = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+    "incididunt ut labore et dolore magna aliqua"
+).split()
+
+
+class FakeEngineSettings:
+    """Knobs of the fake agent; defaults come from the FAKE_ENGINE_* settings."""
+
+    def __init__(
+        self,
+        answer_tokens: int = config.FAKE_ENGINE_ANSWER_TOKENS,
+        first_token_delay_ms: float = config.FAKE_ENGINE_FIRST_TOKEN_DELAY_MS,
+        tokens_per_second: float = config.FAKE_ENGINE_TOKENS_PER_SECOND,
+        tool_calls: int = config.FAKE_ENGINE_TOOL_CALLS,
+        tool_latency_ms: float = config.FAKE_ENGINE_TOOL_LATENCY_MS,
+        session_404_rate: float = config.FAKE_ENGINE_SESSION_404_RATE,
+        rate_limit_rate: float = config.FAKE_ENGINE_429_RATE,
+        stream_drop_rate: float = config.FAKE_ENGINE_STREAM_DROP_RATE,
+        seed: int | None = int(config.FAKE_ENGINE_SEED) if config.FAKE_ENGINE_SEED else None,
+    ):
+        self.answer_tokens = answer_tokens
+        self.first_token_delay_ms = first_token_delay_ms
+        self.tokens_per_second = tokens_per_second
+        self.tool_calls = tool_calls
+        self.tool_latency_ms = tool_latency_ms
+        self.session_404_rate = session_404_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.stream_drop_rate = stream_drop_rate
+        self.random = random.Random(seed)
+
+    def draw(self, rate: float) -> bool:
+        return rate > 0 and self.random.random() < rate
+
+
+class StreamDropped(ConnectionError):
+    """The fake engine cut the stream off, as a dropped connection would."""
+
+
+def session_not_found(session_id: str) -> errors.ClientError:
+    # Same message shape as Vertex, so the bots' 404 retry path kicks in
+    return errors.ClientError(
+        404,
+        {
+            "error": {
+                "code": 404,
+                "message": f"sessionId {session_id} not found.",
+                "status": "NOT_FOUND",
+            }
+        },
+    )
+
+
+def rate_limited() -> errors.ClientError:
+    return errors.ClientError(
+        429,
+        {
+            "error": {
+                "code": 429,
+                "message": "Resource exhausted, please try again later.",
+                "status": "RESOURCE_EXHAUSTED",
+            }
+        },
+    )
+
+
+# --- In-process services ---
+class FakeSessionService(InMemorySessionService):
+    """InMemorySessionService that raises a Vertex-style 404 for unknown sessions."""
+
+    async def get_session(self, *, app_name, user_id, session_id, config=None) -> Session:
+        session = await super().get_session(
+            app_name=app_name, user_id=user_id, session_id=session_id, config=config
+        )
+        if session is None:
+            raise session_not_found(session_id)
+        return session
+
+    async def delete_session(self, *, app_name, user_id, session_id) -> None:
+        await self.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+        await super().delete_session(
+            app_name=app_name, user_id=user_id, session_id=session_id
+        )
+
+
+class FakeMemoryService:
+    async def add_session_to_memory(self, session: Session) -> None:
+        pass
+
+
+def _message_text(message) -> tuple[str, int]:
+    """The text of a query message (str or content dict) and its estimated prompt tokens."""
+    if isinstance(message, str):
+        return message, len(message) // 4
+    texts = [part["text"] for part in message.get("parts", []) if part.get("text")]
+    attachments = sum(1 for part in message.get("parts", []) if not part.get("text"))
+    text = "\n".join(texts)
+    # Gemini counts 258 tokens per image; a flat guess for any attachment
+    return text, len(text) // 4 + 258 * attachments
+
+
+class FakeAgentApp:
+    """Stands in for the agent_engines app: streams event dicts like async_stream_query."""
+
+    def __init__(
+        self,
+        session_service: FakeSessionService,
+        settings: FakeEngineSettings | None = None,
+        app_name: str = config.AGENT_ENGINE_ID,
+    ):
+        self.session_service = session_service
+        self.settings = settings or FakeEngineSettings()
+        self.app_name = app_name
+
+    async def async_stream_query(self, user_id: str, session_id: str, message, **kwargs):
+        settings = self.settings
+        session = await self.session_service.get_session(
+            app_name=self.app_name, user_id=user_id, session_id=session_id
+        )
+        if settings.draw(settings.session_404_rate):
+            # The session expired server-side
+            await self.session_service.delete_session(
+                app_name=self.app_name, user_id=user_id, session_id=session_id
+            )
+            raise session_not_found(session_id)
+        if settings.draw(settings.rate_limit_rate):
+            raise rate_limited()
+        drop = settings.draw(settings.stream_drop_rate)
+
+        text, prompt_tokens = _message_text(message)
+        invocation_id = f"e-{uuid.uuid4()}"
+        await self.session_service.append_event(
+            session,
+            Event(
+                author="user",
+                invocation_id=invocation_id,
+                content=types.Content(role="user", parts=[types.Part(text=text)]),
+            ),
+        )
+
+        await asyncio.sleep(settings.first_token_delay_ms / 1000)
+        for i in range(settings.tool_calls):
+            call_id = f"call-{uuid.uuid4().hex[:8]}"
+            function_call = types.FunctionCall(
+                id=call_id, name="lookup", args={"query": text[:100], "step": i}
+            )
+            yield self._event_dict(invocation_id, types.Part(function_call=function_call))
+            await asyncio.sleep(settings.tool_latency_ms / 1000)
+            function_response = types.FunctionResponse(
+                id=call_id, name="lookup", response={"result": f"fake result {i}"}
+            )
+            yield self._event_dict(
+                invocation_id, types.Part(function_response=function_response)
+            )
+
+        words = f"Echo: {text}".split()[: settings.answer_tokens]
+        words += [
+            _FILLER[i % len(_FILLER)] for i in range(settings.answer_tokens - len(words))
+        ]
+        chunk_delay = (
+            TOKENS_PER_CHUNK / settings.tokens_per_second
+            if settings.tokens_per_second
+            else 0
+        )
+        chunks = [
+            " ".join(words[i : i + TOKENS_PER_CHUNK]) + " "
+            for i in range(0, len(words), TOKENS_PER_CHUNK)
+        ]
+        for i, chunk in enumerate(chunks):
+            if drop and i >= len(chunks) // 2:
+                raise StreamDropped("Fake engine dropped the stream")
+            if i:
+                await asyncio.sleep(chunk_delay)
+            event = self._event_dict(invocation_id, types.Part(text=chunk))
+            if i == len(chunks) - 1:
+                event["usage_metadata"] = {
+                    "prompt_token_count": prompt_tokens,
+                    "candidates_token_count": len(words),
+                    "total_token_count": prompt_tokens + len(words),
+                }
+            yield event
+
+        # The session keeps the whole answer as one event, as the real agent's does
+        await self.session_service.append_event(
+            session,
+            Event(
+                author=AGENT_NAME,
+                invocation_id=invocation_id,
+                content=types.Content(
+                    role="model", parts=[types.Part(text="".join(chunks))]
+                ),
+            ),
+        )
+
+    def _event_dict(self, invocation_id: str, part: types.Part) -> dict:
+        event = Event(
+            author=AGENT_NAME,
+            invocation_id=invocation_id,
+            content=types.Content(role="model", parts=[part]),
+        )
+        return event.model_dump(mode="json", exclude_none=True)
+
+
+_session_service: FakeSessionService | None = None
+_agent_app: FakeAgentApp | None = None
+_artifact_service: InMemoryArtifactService | None = None
+
+
+def get_session_service() -> FakeSessionService:
+    global _session_service
+    if _session_service is None:
+        _session_service = FakeSessionService()
+    return _session_service
+
+
+def get_agent_app() -> FakeAgentApp:
+    """The process-wide fake agent, sharing its sessions with get_session_service()."""
+    global _agent_app
+    if _agent_app is None:
+        _agent_app = FakeAgentApp(get_session_service())
+    return _agent_app
+
+
+def get_artifact_service() -> InMemoryArtifactService:
+    global _artifact_service
+    if _artifact_service is None:
+        _artifact_service = InMemoryArtifactService()
+    return _artifact_service
+
+
+def get_memory_service() -> FakeMemoryService:
+    return FakeMemoryService()
+
+
+# --- HTTP server ---
+class _FakeEngineHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Set by start_fake_server: the agent and the loop its coroutines run on
+    agent_app: FakeAgentApp
+    loop: asyncio.AbstractEventLoop
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        try:
+            body = json_modules.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        except Exception:
+            self._send_json(400, {"error": {"code": 400, "message": "Invalid JSON body"}})
+            return
+        try:
+            if path.endswith(":streamQuery"):
+                self._stream_query(body.get("input", {}))
+            elif path.endswith(":query"):
+                self._send_json(200, {"output": self._run(self._query(body))})
+            else:
+                self._send_json(404, {"error": {"code": 404, "message": "Unknown method"}})
+        except errors.APIError as e:
+            self._send_json(e.code, e.details)
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def _query(self, body: dict):
+        service = self.agent_app.session_service
+        app_name = self.agent_app.app_name
+        method = body.get("class_method")
+        args = body.get("input", {})
+        if method == "list_sessions":
+            response = await service.list_sessions(app_name=app_name, user_id=args["user_id"])
+            return {
+                "sessions": [s.model_dump(mode="json", exclude_none=True) for s in response.sessions]
+            }
+        if method == "create_session":
+            session = await service.create_session(
+                app_name=app_name, user_id=args["user_id"], session_id=args.get("session_id")
+            )
+            return session.model_dump(mode="json", exclude_none=True)
+        if method == "get_session":
+            session = await service.get_session(
+                app_name=app_name, user_id=args["user_id"], session_id=args["session_id"]
+            )
+            return session.model_dump(mode="json", exclude_none=True)
+        if method == "delete_session":
+            await service.delete_session(
+                app_name=app_name, user_id=args["user_id"], session_id=args["session_id"]
+            )
+            return {}
+        raise errors.ClientError(
+            400, {"error": {"code": 400, "message": f"Unknown class_method {method}"}}
+        )
+
+    def _stream_query(self, args: dict):
+        stream = self.agent_app.async_stream_query(
+            user_id=args.get("user_id"),
+            session_id=args.get("session_id"),
+            message=args.get("message", ""),
+        )
+        # Errors before the first event are reported as a status code, like the real API
+        try:
+            first = self._run(anext(stream))
+        except StopAsyncIteration:
+            first = None
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        event = first
+        try:
+            while event is not None:
+                self._write_chunk(json_modules.dumps(event) + b"\n")
+                try:
+                    event = self._run(anext(stream))
+                except StopAsyncIteration:
+                    event = None
+            self._write_chunk(b"")
+        except StreamDropped:
+            # No terminating chunk: the client sees the connection break mid-stream
+            self.close_connection = True
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away mid-stream, e.g. a stopped Streamlit answer
+            self.close_connection = True
+        finally:
+            self._run(stream.aclose())
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status: int, payload: dict):
+        data = json_modules.dumps(payload)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # one line per request would dominate load-test output
+
+
+def start_fake_server(
+    port: int = config.FAKE_ENGINE_PORT, agent_app: FakeAgentApp | None = None
+) -> ThreadingHTTPServer:
+    """
+    Serves the fake agent over HTTP from daemon threads. Its coroutines run on a
+    private event loop thread. Returns the server; call shutdown() to stop it.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="fake-engine-loop", daemon=True).start()
+    handler = type(
+        "FakeEngineHandler",
+        (_FakeEngineHandler,),
+        {"agent_app": agent_app or get_agent_app(), "loop": loop},
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-engine", daemon=True).start()
+    logger.info(f"Fake Agent Engine listening on http://127.0.0.1:{server.server_port}")
+    return server
+
+
+if __name__ == "__main__":
+    import logging_modules
+
+    logging_modules.setup_logging()
+    start_fake_server()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
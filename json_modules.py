@@ -0,0 +1,43 @@
+"""
+JSON encoding for request bodies and streamed events.
+
+orjson is used when it's installed, otherwise the stdlib json module. Either way
+dumps() returns UTF-8 bytes ready to send, so requests doesn't encode the body
+again. With orjson, large bodies (e.g. base64 attachments) are also never built
+as a str; the stdlib fallback builds one and encodes it.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional ('speed' extra): the stdlib codec is used without it
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+# Same errors from either backend (orjson.JSONDecodeError subclasses this one)
+JSONDecodeError = json.JSONDecodeError
+
+
+def dumps(obj) -> bytes:
+    """Serializes to compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    # ASCII output keeps the stdlib on its fastest escaping path
+    return json.dumps(obj, separators=(",", ":")).encode("ascii")
+
+
+def loads(data: bytes | bytearray | memoryview | str):
+    """
+    Parses JSON from bytes or str. orjson reads bytes directly; the stdlib fallback
+    decodes them to a str first (and copies a memoryview to bytes before that).
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = bytes(data)
+    try:
+        return json.loads(data)
+    except UnicodeDecodeError as e:
+        # orjson reports invalid UTF-8 as a JSONDecodeError too
+        raise JSONDecodeError(f"Invalid UTF-8: {e.reason}", "", e.start) from None
@@ -0,0 +1,205 @@
+"""
+Logging setup for the bots.
+
+setup_logging() replaces the root handlers with a QueueHandler: the calling
+thread only tags the record and enqueues it, and a QueueListener thread formats
+and writes it. The queue is bounded (LOG_QUEUE_SIZE), so a burst of logs drops
+records instead of growing memory.
+
+Each record carries the request id bound by the with_request_id decorator, and
+the trace id when the request is traced, so the lines of one request can be
+grepped together across awaits. Messages are truncated to LOG_MAX_MESSAGE_CHARS
+(a stack meant to be logged whole goes in extra={"stack": ...}), and a warning
+repeated from the same line is let through once per LOG_RATE_LIMIT_SECONDS.
+Errors are never rate limited.
+"""
+import atexit
+import contextvars
+import copy
+import datetime
+import functools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+import uuid
+
+import config
+import tracing_modules
+
+_request_id: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "request_id", default=None
+)
+
+
+def current_request_id() -> str | None:
+    return _request_id.get()
+
+
+def with_request_id(func):
+    """Binds a new request id for the duration of an async handler."""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = _request_id.set(uuid.uuid4().hex[:16])
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _request_id.reset(token)
+
+    return wrapper
+
+
+# --- Filters (run in the caller's thread, before the record is queued) ---
+class ContextFilter(logging.Filter):
+    """Copies the request and trace ids onto the record; context vars don't reach the writer thread."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        active_span = tracing_modules.current_span()
+        record.trace_id = getattr(active_span, "trace_id", None)
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets a warning from a given code line through once per `interval` seconds.
+    Errors all pass: one line often logs different failures, and none may be lost.
+    """
+
+    def __init__(self, interval: float):
+        super().__init__()
+        self.interval = interval
+        self._last: dict[tuple[str, int], float] = {}
+        self._suppressed: dict[tuple[str, int], int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last.get(key, -self.interval) < self.interval:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return False
+            self._last[key] = now
+            record.suppressed = self._suppressed.pop(key, 0)
+        return True
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Drops records when the queue is full rather than blocking or raising."""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # QueueHandler.prepare formats the message (with any traceback) and drops
+        # args and exc_info, so queued records don't keep request objects alive.
+        # Only the message itself is truncated, not the traceback.
+        message = record.getMessage()
+        if len(message) > config.LOG_MAX_MESSAGE_CHARS:
+            record = copy.copy(record)
+            record.msg = (
+                f"{message[: config.LOG_MAX_MESSAGE_CHARS]}"
+                f"... [{len(message) - config.LOG_MAX_MESSAGE_CHARS} chars truncated]"
+            )
+            record.args = None
+        return super().prepare(record)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DroppingQueueHandler.dropped += 1
+
+
+# How long shutdown waits for the writer thread to make room for its stop signal
+STOP_TIMEOUT_SECONDS = 5
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    """A QueueListener whose stop() waits for room in a full queue instead of raising."""
+
+    def enqueue_sentinel(self) -> None:
+        # The listener thread frees slots as it writes; queue.Full after the
+        # timeout means it's stuck, and stop() gives up instead of joining it
+        self.queue.put(self._sentinel, timeout=STOP_TIMEOUT_SECONDS)
+
+
+# --- Formatters (run on the writer thread) ---
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in ("request_id", "trace_id", "suppressed", "stack"):
+            value = getattr(record, field, None)
+            if value:
+                entry[field] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        if getattr(record, "request_id", None):
+            line = f"{line} [request_id={record.request_id}]"
+        if getattr(record, "suppressed", 0):
+            line = f"{line} ({record.suppressed} similar suppressed)"
+        if getattr(record, "stack", None):
+            line = f"{line}\n{record.stack}"
+        return line
+
+
+_listener: _QueueListener | None = None
+
+
+def setup_logging(level: str = config.LOG_LEVEL) -> None:
+    """Routes all logging through the queue. Call once at startup; later calls do nothing."""
+    global _listener
+    if _listener is not None:
+        return
+    writer = logging.StreamHandler(sys.stderr)
+    writer.setFormatter(JsonFormatter() if config.LOG_FORMAT == "json" else TextFormatter())
+
+    handler = _DroppingQueueHandler(queue.Queue(maxsize=config.LOG_QUEUE_SIZE))
+    handler.addFilter(RateLimitFilter(config.LOG_RATE_LIMIT_SECONDS))
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    # One line per HTTP request from httpx is the noisiest thing on the hot path
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = _QueueListener(
+        handler.queue, writer, respect_handler_level=True
+    )
+    _listener.start()
+    atexit.register(_stop)
+
+
+def _stop() -> None:
+    if _listener is not None:
+        try:
+            _listener.stop()
+        except queue.Full:
+            sys.stderr.write("Log writer is stuck; exiting without flushing the log queue\n")
+    if _DroppingQueueHandler.dropped:
+        sys.stderr.write(
+            f"{_DroppingQueueHandler.dropped} log records dropped (queue full)\n"
+        )
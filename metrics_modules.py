@@ -0,0 +1,300 @@
+"""
+Prometheus metrics for the front-ends, in the text exposition format.
+
+Metrics live in a process-wide registry and are served by a small HTTP server
+thread on METRICS_PORT (see start_metrics_server). Every front-end runs in its
+own process, so each one exposes its own endpoint.
+"""
+import contextlib
+import functools
+import inspect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+import stream_events
+
+logger = logging.getLogger(__name__)
+
+# Agent latencies span from sub-second first tokens to multi-minute tool runs
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120, 300)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _format_labels(self, key: tuple, extra: str = "") -> str:
+        pairs = [
+            f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)
+        ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key: tuple, value) -> list[str]:
+        return [f"{self.name}{self._format_labels(key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    @contextlib.contextmanager
+    def track(self, **labels):
+        """Counts the block as in progress while it runs."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            # [count per bucket..., +Inf count, sum]
+            state = self._values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            else:
+                state[len(self.buckets)] += 1
+            state[-1] += value
+
+    def _render_value(self, key: tuple, state) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            lines.append(
+                f'{self.name}_bucket{self._format_labels(key, f"le=\"{le}\"")} {cumulative}'
+            )
+        lines.append(f"{self.name}_sum{self._format_labels(key)} {state[-1]}")
+        lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# --- Registry ---
+REGISTRY: list[_Metric] = []
+
+requests_total = Counter(
+    "agent_requests_total",
+    "Messages handled, by front-end and route (dm, mention, context).",
+    ("frontend", "route"),
+)
+first_token_seconds = Histogram(
+    "agent_first_token_seconds",
+    "Time from sending a query to the first streamed answer text.",
+    ("frontend",),
+)
+stream_seconds = Histogram(
+    "agent_stream_seconds",
+    "Total time of an agent query stream.",
+    ("frontend",),
+)
+streams_in_flight = Gauge(
+    "agent_streams_in_flight",
+    "Agent query streams currently open.",
+    ("frontend",),
+)
+api_calls_total = Counter(
+    "api_calls_total",
+    "Calls to the Slack, Telegram and Agent Engine APIs.",
+    ("api", "method"),
+)
+api_errors_total = Counter(
+    "api_errors_total",
+    "Failed calls to the Slack, Telegram and Agent Engine APIs.",
+    ("api", "method"),
+)
+session_cache_lookups_total = Counter(
+    "session_cache_lookups_total",
+    "Session id lookups, by result (hit or miss).",
+    ("frontend", "result"),
+)
+attachment_bytes_total = Counter(
+    "attachment_bytes_total",
+    "Bytes of attachments downloaded and passed on to the agent.",
+    ("frontend",),
+)
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Instrumentation helpers ---
+class StreamTimer(stream_events.StreamSink):
+    """
+    Context manager around one agent query stream: keeps the in-flight gauge,
+    observes the total stream time and counts the Agent Engine call. As a sink,
+    it observes the time to the first answer text.
+    """
+
+    def __init__(self, frontend: str):
+        self.frontend = frontend
+        self._start = 0.0
+        self._first_token_seen = False
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        streams_in_flight.inc(frontend=self.frontend)
+        return self
+
+    def on_text_delta(self, event: stream_events.TextDelta):
+        if not self._first_token_seen:
+            self._first_token_seen = True
+            first_token_seconds.observe(
+                time.perf_counter() - self._start, frontend=self.frontend
+            )
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        streams_in_flight.dec(frontend=self.frontend)
+        stream_seconds.observe(time.perf_counter() - self._start, frontend=self.frontend)
+        # A stream closed early by its consumer (GeneratorExit) isn't a failure
+        failed = exc_type is not None and issubclass(exc_type, Exception)
+        count_api_call("agent_engine", "stream_query", failed=failed)
+        return False
+
+
+def count_api_call(api: str, method: str, failed: bool = False) -> None:
+    api_calls_total.inc(api=api, method=method)
+    if failed:
+        api_errors_total.inc(api=api, method=method)
+
+
+def counted(api: str, method: str | None = None):
+    """Decorator counting calls and failures of a sync or async API function."""
+
+    def decorator(func):
+        name = method or func.__name__
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception:
+                    count_api_call(api, name, failed=True)
+                    raise
+                count_api_call(api, name)
+                return result
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                count_api_call(api, name, failed=True)
+                raise
+            count_api_call(api, name)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+# --- Endpoint ---
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes would flood the bot logs
+
+
+_server: ThreadingHTTPServer | None = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int = config.METRICS_PORT) -> None:
+    """Serves /metrics from a daemon thread. Does nothing if port is 0 or it's already running."""
+    global _server
+    if not port:
+        return
+    with _server_lock:
+        if _server is not None:
+            return
+        try:
+            _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+        except OSError as e:
+            logger.error(f"Could not start the metrics endpoint on port {port}: {e}")
+            return
+        _server.daemon_threads = True
+        threading.Thread(
+            target=_server.serve_forever, name="metrics-server", daemon=True
+        ).start()
+    logger.info(f"Serving metrics on port {port}")
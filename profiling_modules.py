@@ -0,0 +1,233 @@
+"""
+Opt-in profiling of live bot processes.
+
+- A sampling profiler: a thread snapshots the stacks of all other threads every
+  PROFILE_SAMPLE_INTERVAL_MS and writes them as collapsed stacks (one
+  "frame;frame;frame count" line per distinct stack), the input format of
+  flamegraph.pl and speedscope. Triggered by SIGUSR1 or the /profile command.
+- An event-loop lag watchdog: a heartbeat task runs on the loop, and a watchdog
+  thread logs the loop thread's stack when the heartbeat stalls for longer than
+  LOOP_LAG_THRESHOLD_MS, i.e. while a callback is still blocking it.
+"""
+import asyncio
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_profile_lock = threading.Lock()
+
+
+# --- Sampling profiler ---
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    # ";" separates frames in the collapsed format
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(
+        ";", ":"
+    )
+
+
+def sample_stacks(seconds: float, interval: float) -> collections.Counter:
+    """Samples the stacks of all threads but the calling one. Returns {collapsed stack: count}."""
+    own_thread_id = threading.get_ident()
+    counts: collections.Counter = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread_id:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(thread_names.get(thread_id, str(thread_id)))
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return counts
+
+
+def parse_profile_args(args: list[str]) -> float:
+    """
+    Parses "/profile [seconds]" into a duration capped at PROFILE_MAX_SECONDS.
+    Raises ValueError with a usage hint on bad input.
+    """
+    if not args:
+        return min(config.PROFILE_SECONDS, config.PROFILE_MAX_SECONDS)
+    try:
+        seconds = float(args[0])
+    except ValueError:
+        seconds = 0.0
+    # "not >" also rejects nan
+    if len(args) > 1 or not seconds > 0:
+        raise ValueError(
+            f"Usage: /profile [seconds], up to {config.PROFILE_MAX_SECONDS:g} seconds"
+        )
+    return min(seconds, config.PROFILE_MAX_SECONDS)
+
+
+def run_profile(seconds: float | None = None) -> str | None:
+    """
+    Profiles the process for `seconds` (capped at PROFILE_MAX_SECONDS), blocking
+    the calling thread. Returns the path of the collapsed-stack file, or None if
+    a profile is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        return _profile(seconds)
+    finally:
+        _profile_lock.release()
+
+
+def start_profile(seconds: float | None = None, on_done=None) -> bool:
+    """
+    Runs a profile in a background thread. False if one is already running.
+    on_done, if given, is called from that thread with the profile's path.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            path = _profile(seconds)
+        finally:
+            _profile_lock.release()
+        if on_done is not None:
+            try:
+                on_done(path)
+            except Exception as e:
+                logger.error(f"Error reporting profile {path}: {e}")
+
+    threading.Thread(target=run, name="profiler", daemon=True).start()
+    return True
+
+
+def _profile(seconds: float | None) -> str:
+    seconds = min(seconds or config.PROFILE_SECONDS, config.PROFILE_MAX_SECONDS)
+    logger.info(f"Profiling for {seconds:g} s...")
+    counts = sample_stacks(seconds, config.PROFILE_SAMPLE_INTERVAL_MS / 1000)
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    path = os.path.join(
+        config.PROFILE_DIR,
+        f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.collapsed",
+    )
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in counts.most_common():
+            f.write(f"{stack} {count}\n")
+    logger.info(f"Wrote profile ({sum(counts.values())} samples) to {path}")
+    return path
+
+
+def summarize_profile(path: str, top: int = 10) -> str:
+    """The functions that appear in most samples, for chat replies."""
+    inclusive: collections.Counter = collections.Counter()
+    total = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            total += int(count)
+            # Skip the thread name; count each function once per stack
+            for label in set(stack.split(";")[1:]):
+                inclusive[label] += int(count)
+    lines = [f"{total} samples, top {top} functions by inclusive share:"]
+    for label, count in inclusive.most_common(top):
+        lines.append(f"{100 * count / max(total, 1):5.1f}%  {label}")
+    return "\n".join(lines)
+
+
+def install_signal_handler() -> None:
+    """SIGUSR1 starts a PROFILE_SECONDS profile. Must be called from the main thread."""
+    if not config.PROFILING_ENABLED or not hasattr(signal, "SIGUSR1"):
+        return
+    signal.signal(signal.SIGUSR1, lambda signum, frame: start_profile())
+    logger.info(f"Profiling enabled: send SIGUSR1 to pid {os.getpid()}")
+
+
+# --- Event loop lag watchdog ---
+class _LoopWatch:
+    def __init__(self, thread_id: int):
+        self.thread_id = thread_id
+        self.last_beat = time.monotonic()
+        self.reported = False
+
+
+_watches: dict[asyncio.AbstractEventLoop, _LoopWatch] = {}
+_watches_lock = threading.Lock()
+_watchdog_thread: threading.Thread | None = None
+
+
+def watch_event_loop() -> None:
+    """
+    Starts lag monitoring of the running event loop, if LOOP_LAG_THRESHOLD_MS is
+    set. Safe to call repeatedly; the monitoring ends with the loop.
+    """
+    if not config.LOOP_LAG_THRESHOLD_MS:
+        return
+    loop = asyncio.get_running_loop()
+    with _watches_lock:
+        if loop in _watches:
+            return
+        watch = _LoopWatch(threading.get_ident())
+        _watches[loop] = watch
+        _start_watchdog()
+    loop.create_task(_heartbeat(loop, watch))
+
+
+async def _heartbeat(loop: asyncio.AbstractEventLoop, watch: _LoopWatch):
+    interval = config.LOOP_LAG_THRESHOLD_MS / 1000 / 4
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            if watch.reported:
+                logger.warning(
+                    f"Event loop was blocked for {(now - watch.last_beat) * 1000:.0f} ms"
+                )
+            watch.last_beat = now
+            watch.reported = False
+    finally:
+        with _watches_lock:
+            _watches.pop(loop, None)
+
+
+def _start_watchdog() -> None:
+    global _watchdog_thread
+    if _watchdog_thread is None:
+        _watchdog_thread = threading.Thread(
+            target=_watchdog, name="loop-watchdog", daemon=True
+        )
+        _watchdog_thread.start()
+
+
+def _watchdog() -> None:
+    threshold = config.LOOP_LAG_THRESHOLD_MS / 1000
+    while True:
+        time.sleep(threshold / 4)
+        now = time.monotonic()
+        with _watches_lock:
+            stalled = [
+                watch
+                for watch in _watches.values()
+                if not watch.reported and now - watch.last_beat > threshold
+            ]
+        if not stalled:
+            continue
+        frames = sys._current_frames()
+        for watch in stalled:
+            watch.reported = True
+            frame = frames.get(watch.thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(unavailable)\n"
+            logger.warning(
+                f"Event loop blocked for over {(now - watch.last_beat) * 1000:.0f} ms "
+                f"in thread {watch.thread_id}",
+                extra={"stack": stack},
+            )
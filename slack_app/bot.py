@@ -2,6 +2,7 @@ import os
 import requests
 import json
 import asyncio
+import functools
 import logging
 
 from slack_bolt import App
@@ -14,13 +15,46 @@ if os.path.dirname(os.path.dirname(os.path.abspath(__file__))) not in sys.path:
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import config
 import engine_modules
+import attachment_modules
+import stream_events
+import tracing_modules
+import metrics_modules
+import usage_modules
+import profiling_modules
+import logging_modules
+
+logging_modules.setup_logging()
+logger = logging.getLogger(__name__)
 
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+# Bolt verifies the token on construction, before a custom API URL could be set
+# on its client. Passing a client of our own instead makes Bolt warn, since it also
+# reads SLACK_BOT_TOKEN from the environment. So with a custom URL the eager check
+# is skipped and the URL set afterwards; the auth_test below still runs at startup.
+app = App(
+    token=config.SLACK_BOT_TOKEN,
+    signing_secret=config.SLACK_SIGNING_SECRET,
+    token_verification_enabled=not config.SLACK_API_URL,
 )
-logger = logging.getLogger(__name__)
+if config.SLACK_API_URL:
+    app.client.base_url = config.SLACK_API_URL
+
+def count_slack_calls(api_call):
+    """Wraps WebClient.api_call, which every Slack Web API method goes through."""
+
+    @functools.wraps(api_call)
+    def wrapper(api_method, **kwargs):
+        try:
+            response = api_call(api_method, **kwargs)
+        except Exception:
+            metrics_modules.count_api_call("slack", api_method, failed=True)
+            raise
+        metrics_modules.count_api_call("slack", api_method)
+        return response
+
+    return wrapper
 
-app = App(token=config.SLACK_BOT_TOKEN, signing_secret=config.SLACK_SIGNING_SECRET)
+
+app.client.api_call = count_slack_calls(app.client.api_call)
 
 # --- Fetch bot user ID at startup ---
 bot_user_id = None
@@ -97,22 +131,39 @@ def get_event_info(body) -> dict:
 
             # logger.info(f"Downloading file: {file_name} ({file_type}) from {url}\n\n\n")
 
+            # Reject oversized and unsupported files before spending bandwidth on them
+            rejection_reason = attachment_modules.get_rejection_reason(
+                file_size, file_type, file_name=file_name
+            )
+            if rejection_reason:
+                logger.info(f"Skipping file '{file_name}': {rejection_reason}")
+                continue
+
             headers = {"Authorization": f"Bearer {config.SLACK_BOT_TOKEN}"}
             try:
+                # The content is classified from its first bytes, and the download
+                # is abandoned right there if it turns out to be unsupported
+                buffer = attachment_modules.PreallocatedBuffer(
+                    file_size, file_name=file_name, provided_file_type=file_type
+                )
+                with tracing_modules.span(
+                    "download_file", file_type=file_type, payload_bytes=file_size
+                ), requests.get(url, headers=headers, stream=True) as response:
+                    response.raise_for_status()  # Raises an exception for bad status codes
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        buffer.write(chunk)
 
-                response = requests.get(url, headers=headers)
-                response.raise_for_status()  # Raises an exception for bad status codes
-
-                response_content = response.content
                 files_info.append(
                     {
                         "name": file_name,
                         "mime_type": file_type,
-                        "content": response_content,  # This is the raw file data in bytes
+                        "content": buffer.getvalue(),  # This is the raw file data in bytes
                         "size": file_size,
                     }
                 )
 
+            except attachment_modules.AttachmentRejectedError as e:
+                logger.info(f"Skipping file '{file_name}': {e}")
             except requests.exceptions.RequestException as e:
                 logger.error(f"Failed to download file {file_name}: {e}")
                 app.client.chat_postMessage(
@@ -127,6 +178,9 @@ def get_event_info(body) -> dict:
         f"Message from {event_info['display_name']} {event_info['user_email']} ({event_info['user_id']}): {event_info['message_text']}"
     )
     if files_info:
+        metrics_modules.attachment_bytes_total.inc(
+            sum(len(f["content"]) for f in files_info), frontend="slack"
+        )
         event_info["files_attached"] = files_info
         event_info[
             "enriched_message"
@@ -135,11 +189,15 @@ def get_event_info(body) -> dict:
     return event_info
 
 
+@tracing_modules.traced("get_session_id")
 async def get_session_id(user_id):
     if user_id in sessions_dict:
+        tracing_modules.current_span().set(cache_hit=True)
+        metrics_modules.session_cache_lookups_total.inc(frontend="slack", result="hit")
         logger.info(f"Using cached session ID for user {user_id}")
         return sessions_dict[user_id]
     else:
+        metrics_modules.session_cache_lookups_total.inc(frontend="slack", result="miss")
         logger.info(f"Creating / fetching new session ID for user {user_id}")
         session_id = await engine_modules.get_or_create_session(
             session_service=session_service, user_id=user_id
@@ -148,11 +206,46 @@ async def get_session_id(user_id):
         return session_id
 
 
+class SlackThreadSink(stream_events.StreamSink):
+    """Posts thoughts and tool activity to the thread, if enabled."""
+
+    def __init__(self, event_info: dict, show_thoughts: bool, show_tools: bool):
+        self.event_info = event_info
+        self.wants_thoughts = show_thoughts
+        self.wants_tools = show_tools
+
+    def post(self, text: str):
+        app.client.chat_postMessage(
+            channel=self.event_info["channel_id"],
+            thread_ts=self.event_info["thread_ts"],
+            text=text,
+        )
+
+    def on_thought(self, event: stream_events.Thought):
+        self.post(f"🧠 *Thought* ({event.author}): {event.text}")
+
+    def on_tool_call(self, event: stream_events.ToolCall):
+        self.post(
+            f"🔧 *Tool Call* ({event.author}): `{event.name}` with args: `{event.args}`"
+        )
+
+    def on_tool_response(self, event: stream_events.ToolResponse):
+        self.post(f"📥 *Tool Response* for `{event.name}`: `{event.response}`")
+
+
+@logging_modules.with_request_id
+@tracing_modules.traced("slack.query_agent_and_reply", root=True)
 async def query_agent_and_reply(body, say):
     """
     Queries the agent in a background thread and posts the response back to Slack.
     """
-    event_info = get_event_info(body)
+    profiling_modules.watch_event_loop()
+    with tracing_modules.span("get_event_info"):
+        event_info = get_event_info(body)
+    tracing_modules.current_span().set(
+        channel=event_info["channel_id"],
+        payload_bytes=sum(f["size"] for f in event_info.get("files_attached", [])),
+    )
     try:
         initial_reply = say(text="🧠 Thinking...", thread_ts=event_info["thread_ts"])
         reply_ts = initial_reply["ts"]
@@ -161,11 +254,11 @@ async def query_agent_and_reply(body, say):
         return
 
     final_answer = ""
-    last_text = ""
-    thoughts = []
+    artifact_sink = None
     session_id = None
     try:
         session_id = await get_session_id(event_info["session_user_id"])
+        tracing_modules.current_span().set(session_id=session_id)
 
         # change user_id temporarily to the message's user email for personal memories access
         await engine_modules.update_session(
@@ -175,101 +268,60 @@ async def query_agent_and_reply(body, say):
             state_delta={"user_id": event_info["user_email"]},
         )
 
-        prepared_message = engine_modules.prepare_message_dict(
+        prepared_message = await engine_modules.prepare_message_dict_async(
             text=event_info["enriched_message"],
             file_list=event_info.get("files_attached", []),
+            artifact_service=artifact_service,
+            session_id=session_id,
+            user_id=event_info["session_user_id"],
         )
 
-        async for response in agent_app.async_stream_query(  # type: ignore
-            user_id=event_info["session_user_id"],
+        artifact_sink = engine_modules.ArtifactPrefetchSink(
+            artifact_service=artifact_service,
             session_id=session_id,
-            message=prepared_message,
+            user_id=event_info["session_user_id"],
+        )
+        with (
+            tracing_modules.span("agent_stream") as stream_span,
+            metrics_modules.StreamTimer("slack") as stream_timer,
+            usage_modules.UsageRecorder(
+                frontend="slack",
+                channel=event_info["channel_id"],
+                channel_name=event_info["channel_display_name"],
+                user_id=event_info["user_id"],
+                session_id=session_id,
+                file_list=event_info.get("files_attached"),
+            ) as usage_recorder,
         ):
-            response_author = response.get("author")
-            # logger.info("[EVENT]" + "-" * 40)
-            # logger.info(response)
-            # logger.info("\n\n\n")
-
-            if not response:
-                continue
-            try:
-                # Handle validator agent output
-                if response_author == "answer_validator_agent":
-                    # validator_text = (
-                    #     response.get("content", {})
-                    #     .get("parts", [{}])[0]
-                    #     .get("text", "{}")
-                    # )
-                    # thoughts.append(f"🕵️ *Validator Agent*: `{validator_text}`")
-                    continue
+            demux = stream_events.StreamDemux(
+                SlackThreadSink(event_info, show_thoughts, show_tools),
+                artifact_sink,
+                tracing_modules.StreamSpanSink(stream_span),
+                stream_timer,
+                usage_recorder,
+            )
 
-                # Handle other agents' output
-                parts = response.get("content", {}).get("parts", [])
-                for part in parts:
-                    # logger.info(f"[PART{i}]" + '-' * 40)
-                    # logger.info(f"{part} \n\n\n")
-                    if part.get("text") and not part.get("thought"):
-                        # logger.info(f"logging part without thought: {part.get('text')}")
-                        final_answer += part.get("text")
-                    if part.get("text") and part.get("thought"):
-                        # logger.info(f"logging part WITH thought: {part.get('text')}")
-                        thought = (
-                            f"🧠 *Thought* ({response_author}): {part.get('text')}"
-                        )
-                        thoughts.append(thought)
-                        if show_thoughts:
-                            app.client.chat_postMessage(
-                                channel=event_info["channel_id"],
-                                thread_ts=event_info["thread_ts"],
-                                text=thought,
-                            )
-                        last_text = thought
-
-                    elif part.get("function_call"):
-                        fc = part.get("function_call")
-                        thought = f"🔧 *Tool Call* ({response_author}): `{fc.get('name')}` with args: `{fc.get('args')}`"
-                        thoughts.append(thought)
-                        if show_tools:
-                            app.client.chat_postMessage(
-                                channel=event_info["channel_id"],
-                                thread_ts=event_info["thread_ts"],
-                                text=thought,
-                            )
-                        last_text = thought
-
-                    elif part.get("function_response"):
-                        fr = part.get("function_response")
-                        thought = f"📥 *Tool Response* for `{fr.get('name')}`: `{fr.get('response')}`"
-                        thoughts.append(thought)
-                        if show_tools:
-                            app.client.chat_postMessage(
-                                channel=event_info["channel_id"],
-                                thread_ts=event_info["thread_ts"],
-                                text=thought,
-                            )
-                        last_text = thought
-
-                # if artifact_delta:
-                #     filename = artifact_delta.keys()[0]
-                #     artifact = await engine_modules.load_artifact(
-                #         artifact_service=artifact_service,
-                #         session_id=session_id,
-                #         user_id=event_info["session_user_id"],
-                #         filename=filename,
-                #     )
-
-            except json.JSONDecodeError as e:
-                app.client.chat_postMessage(
-                    channel=event_info["channel_id"],
-                    thread_ts=event_info["thread_ts"],
-                    text=f"ERROR: Ran into JSON decoding issue: {str(e)}",
-                )
-            except Exception as e:
-                app.client.chat_postMessage(
-                    channel=event_info["channel_id"],
-                    thread_ts=event_info["thread_ts"],
-                    text=f"ERROR: Ran into an unexpected issue: {str(e)}",
-                )
+            async for response in agent_app.async_stream_query(  # type: ignore
+                user_id=event_info["session_user_id"],
+                session_id=session_id,
+                message=prepared_message,
+            ):
+                stream_span.mark("first_event")
+                try:
+                    demux.feed(response)
+                except json.JSONDecodeError as e:
+                    app.client.chat_postMessage(
+                        channel=event_info["channel_id"],
+                        thread_ts=event_info["thread_ts"],
+                        text=f"ERROR: Ran into JSON decoding issue: {str(e)}",
+                    )
+                except Exception as e:
+                    app.client.chat_postMessage(
+                        channel=event_info["channel_id"],
+                        thread_ts=event_info["thread_ts"],
+                        text=f"ERROR: Ran into an unexpected issue: {str(e)}",
+                    )
+            final_answer = demux.text
 
         # change user_id back to channel id to prevent personal memories access
         await engine_modules.update_session(
@@ -291,6 +343,9 @@ async def query_agent_and_reply(body, say):
             except Exception as delete_e:
                 logger.error(f"Error deleting invalid session: {delete_e}")
             logger.info("Session not found, creating a new one and retrying...")
+            if artifact_sink:
+                artifact_sink.cancel()
+                artifact_sink = None
             await query_agent_and_reply(body, say)
         else:
             final_answer = f"Sorry, an error occurred: {e}"
@@ -303,42 +358,78 @@ async def query_agent_and_reply(body, say):
             app.client.chat_delete(channel=event_info["channel_id"], ts=reply_ts)
         except Exception as e:
             logger.error(f"Error deleting 'Thinking...' message: {e}")
+        await post_artifacts(event_info, artifact_sink)
         return
 
     # Otherwise, update the message with the final answer and post thoughts.
+    with tracing_modules.span("post_reply", chars=len(final_answer)):
+        try:
+            chunks = stream_events.split_text(final_answer, 3900)
+            # Send extra chunks as new messages in the same thread
+            app.client.chat_postMessage(
+                channel=event_info["channel_id"],
+                thread_ts=event_info["thread_ts"],
+                text=f"⬇️⬇️⬇️Final message:\n{chunks[0]}",
+            )
+            if len(chunks) > 1:
+                for chunk in chunks[1:]:
+                    app.client.chat_postMessage(
+                        channel=event_info["channel_id"],
+                        thread_ts=event_info["thread_ts"],
+                        text=chunk,
+                    )
+            # Send the first chunk as an update to the initial reply
+            # app.client.chat_update(
+            #     channel=event_info["channel_id"], ts=reply_ts, text=":white_check_mark: Check my reply in thread. Ping me there if you need to continue conversation..."
+            # )
+            try:
+                app.client.chat_delete(channel=event_info["channel_id"], ts=reply_ts)
+            except Exception as e:
+                logger.error(f"Error deleting 'Thinking...' message: {e}")
+
+        except Exception as e:
+            logger.error(f"Error updating message or posting thoughts: {e}")
+
+    await post_artifacts(event_info, artifact_sink)
+
+
+@tracing_modules.traced("post_artifacts")
+async def post_artifacts(
+    event_info: dict, artifact_sink: engine_modules.ArtifactPrefetchSink | None
+):
+    """Uploads the artifacts the agent created to the conversation thread."""
+    if not artifact_sink:
+        return
     try:
-        chunks = [final_answer[i : i + 3900] for i in range(0, len(final_answer), 3900)]
-        # Send extra chunks as new messages in the same thread
-        app.client.chat_postMessage(
-            channel=event_info["channel_id"],
-            thread_ts=event_info["thread_ts"],
-            text=f"⬇️⬇️⬇️Final message:\n{chunks[0]}",
-        )
-        if len(chunks) > 1:
-            for chunk in chunks[1:]:
-                app.client.chat_postMessage(
+        for filename, task in artifact_sink.tasks.items():
+            try:
+                artifact = await task
+                if not artifact:
+                    continue
+                data, _ = artifact
+                app.client.files_upload_v2(
                     channel=event_info["channel_id"],
                     thread_ts=event_info["thread_ts"],
-                    text=chunk,
+                    content=data,
+                    filename=filename,
+                    title=filename,
                 )
-        # Send the first chunk as an update to the initial reply
-        # app.client.chat_update(
-        #     channel=event_info["channel_id"], ts=reply_ts, text=":white_check_mark: Check my reply in thread. Ping me there if you need to continue conversation..."
-        # )
-        try:
-            app.client.chat_delete(channel=event_info["channel_id"], ts=reply_ts)
-        except Exception as e:
-            logger.error(f"Error deleting 'Thinking...' message: {e}")
-
-    except Exception as e:
-        logger.error(f"Error updating message or posting thoughts: {e}")
+            except Exception as e:
+                logger.error(f"Error posting artifact '{filename}': {e}")
+    finally:
+        artifact_sink.cancel()
 
 
+@logging_modules.with_request_id
+@tracing_modules.traced("slack.process_message_for_context", root=True)
 async def process_message_for_context(body):
     """
     Silently sends a message to the agent engine for context-building.
     """
-    event_info = get_event_info(body)
+    profiling_modules.watch_event_loop()
+    with tracing_modules.span("get_event_info"):
+        event_info = get_event_info(body)
+    tracing_modules.current_span().set(channel=event_info["channel_id"])
     try:
         session_id = await get_session_id(event_info["session_user_id"])
 
@@ -349,6 +440,7 @@ async def process_message_for_context(body):
             author=event_info["display_name"],
             message=event_info["enriched_message"],
             file_list=event_info.get("files_attached", []),
+            artifact_service=artifact_service,
         )
 
         logger.info(
@@ -421,9 +513,47 @@ def handle_save_session(ack, body, say):
             say(f"❌ {error_msg}")
 
 
+@app.command("/usage")
+def handle_usage(ack, body, respond):
+    """Token usage report. Admins see every channel, everyone else only this one."""
+    ack()
+    try:
+        group_by, days = usage_modules.parse_usage_args(body.get("text", "").split())
+    except ValueError as e:
+        respond(str(e))
+        return
+    channel = None if body["user_id"] in config.ADMIN_IDS else body["channel_id"]
+    rows = usage_modules.summarize(group_by, days, channel=channel)
+    respond(f"```{usage_modules.format_report(rows, group_by, days)}```")
+
+
+@app.command("/profile")
+def handle_profile(ack, body, respond):
+    """Samples the bot's stacks for N seconds and reports the hottest functions. Admins only."""
+    ack()
+    if not config.PROFILING_ENABLED or body["user_id"] not in config.ADMIN_IDS:
+        respond("Profiling is not available.")
+        return
+    try:
+        seconds = profiling_modules.parse_profile_args(body.get("text", "").split())
+    except ValueError as e:
+        respond(str(e))
+        return
+
+    def report(path):
+        respond(f"Wrote `{path}`\n```{profiling_modules.summarize_profile(path)}```")
+
+    # Sampled from the profiler thread, so no Bolt worker is held while it runs
+    if not profiling_modules.start_profile(seconds, on_done=report):
+        respond("A profile is already running.")
+        return
+    respond(f"Profiling for {seconds:g} s...")
+
+
 @app.event("app_mention")
 def handle_app_mention(body, say, ack):
     ack()
+    metrics_modules.requests_total.inc(frontend="slack", route="mention")
     asyncio.run(query_agent_and_reply(body, say))
 
 
@@ -447,22 +577,29 @@ def handle_message_events(body, say, logger):
     channel_type = event.get("channel_type")
     if channel_type == "im":
         logger.info("Received DM, processing for reply...")
+        metrics_modules.requests_total.inc(frontend="slack", route="dm")
         asyncio.run(query_agent_and_reply(body, say))
         return
 
     if channel_type in ["channel", "group"]:
         logger.info("Received channel message, processing for context...")
+        metrics_modules.requests_total.inc(frontend="slack", route="context")
         asyncio.run(process_message_for_context(body))
         return
 
 
 @app.event("reaction_added")
 def handle_reaction_added_events(body, logger):
-    logger.info(f"REACTION NEEDED: {body}")
+    event = body["event"]
+    logger.info(
+        f"REACTION NEEDED: :{event.get('reaction')}: in {event.get('item', {}).get('channel')}"
+    )
 
 
 # --- App Start ---
 if __name__ == "__main__":
+    metrics_modules.start_metrics_server()
+    profiling_modules.install_signal_handler()
     logger.info("🤖 Slack bot is running in Socket Mode...")
     handler = SocketModeHandler(app, config.SLACK_APP_TOKEN)
     handler.start()
@@ -0,0 +1,247 @@
+"""
+Typed parsing of the events streamed by the agent engine, shared by all front-ends.
+
+The agent streams one dict per ADK event. StreamDemux parses each of them once,
+turns the interesting parts into small typed events and hands them to the sinks
+that asked for them. Kinds no sink wants (e.g. thoughts when they're hidden) are
+never built.
+"""
+
+VALIDATOR_AUTHOR = "answer_validator_agent"
+
+
+# --- Events ---
+class TextDelta:
+    __slots__ = ("author", "text")
+    handler = "on_text_delta"
+    channel = "text"
+
+    def __init__(self, author: str, text: str):
+        self.author = author
+        self.text = text
+
+
+class Thought:
+    __slots__ = ("author", "text")
+    handler = "on_thought"
+    channel = "thoughts"
+
+    def __init__(self, author: str, text: str):
+        self.author = author
+        self.text = text
+
+
+class ToolCall:
+    __slots__ = ("author", "name", "args", "call_id")
+    handler = "on_tool_call"
+    channel = "tools"
+
+    def __init__(self, author: str, name: str, args: dict | None, call_id: str | None):
+        self.author = author
+        self.name = name
+        self.args = args
+        self.call_id = call_id
+
+
+class ToolResponse:
+    __slots__ = ("author", "name", "response", "call_id")
+    handler = "on_tool_response"
+    channel = "tools"
+
+    def __init__(self, author: str, name: str, response, call_id: str | None):
+        self.author = author
+        self.name = name
+        self.response = response
+        self.call_id = call_id
+
+
+class ArtifactDelta:
+    __slots__ = ("author", "filename", "version")
+    handler = "on_artifact_delta"
+    channel = "artifacts"
+
+    def __init__(self, author: str, filename: str, version: int | None):
+        self.author = author
+        self.filename = filename
+        self.version = version
+
+
+class Usage:
+    __slots__ = (
+        "author",
+        "invocation_id",
+        "prompt_tokens",
+        "output_tokens",
+        "thought_tokens",
+        "total_tokens",
+    )
+    handler = "on_usage"
+    channel = "usage"
+
+    def __init__(
+        self,
+        author: str,
+        invocation_id: str | None,
+        prompt_tokens: int,
+        output_tokens: int,
+        thought_tokens: int,
+        total_tokens: int,
+    ):
+        self.author = author
+        self.invocation_id = invocation_id
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+        self.thought_tokens = thought_tokens
+        self.total_tokens = total_tokens
+
+
+class ValidatorOutput:
+    """Raw text of the answer validator agent, which is never part of the answer."""
+
+    __slots__ = ("author", "text")
+    handler = "on_validator_output"
+    channel = "validator"
+
+    def __init__(self, author: str, text: str):
+        self.author = author
+        self.text = text
+
+
+CHANNELS = ("text", "thoughts", "tools", "artifacts", "usage", "validator")
+
+
+# --- Sinks ---
+class StreamSink:
+    """
+    Base class for consumers of typed stream events. Override the handlers you
+    need; a handler may be a coroutine function when used with StreamDemux.afeed.
+    The wants_* flags select the kinds of events the sink receives; kinds no
+    sink wants aren't built at all.
+    """
+
+    wants_text = True
+    wants_thoughts = False
+    wants_tools = False
+    wants_artifacts = False
+    wants_usage = False
+    wants_validator = False
+
+    def on_text_delta(self, event: TextDelta):
+        pass
+
+    def on_thought(self, event: Thought):
+        pass
+
+    def on_tool_call(self, event: ToolCall):
+        pass
+
+    def on_tool_response(self, event: ToolResponse):
+        pass
+
+    def on_artifact_delta(self, event: ArtifactDelta):
+        pass
+
+    def on_usage(self, event: Usage):
+        pass
+
+    def on_validator_output(self, event: ValidatorOutput):
+        pass
+
+
+# --- Demultiplexer ---
+class StreamDemux:
+    """Parses streamed events and dispatches them to sinks, collecting the answer text."""
+
+    def __init__(self, *sinks: StreamSink):
+        self.sinks = sinks
+        # Each kind of event only goes to the sinks that asked for it
+        self._routes = {
+            channel: [sink for sink in sinks if getattr(sink, f"wants_{channel}")]
+            for channel in CHANNELS
+        }
+        self.wants_thoughts = bool(self._routes["thoughts"])
+        self.wants_tools = bool(self._routes["tools"])
+        self.wants_artifacts = bool(self._routes["artifacts"])
+        self.wants_usage = bool(self._routes["usage"])
+        self.wants_validator = bool(self._routes["validator"])
+        self._text_chunks: list[str] = []
+
+    @property
+    def text(self) -> str:
+        """The final answer so far. Joined on demand, instead of growing a str per chunk."""
+        return "".join(self._text_chunks)
+
+    def parse(self, response: dict) -> list:
+        """Turns one streamed event dict into the typed events the sinks want."""
+        events = []
+        if not response:
+            return events
+        author = response.get("author", "")
+        content = response.get("content") or {}
+
+        if author == VALIDATOR_AUTHOR:
+            # Never part of the answer, but its tokens still count as usage
+            if self.wants_validator:
+                parts = content.get("parts") or [{}]
+                events.append(ValidatorOutput(author, parts[0].get("text", "{}")))
+        else:
+            for part in content.get("parts") or []:
+                text = part.get("text")
+                if text:
+                    if not part.get("thought"):
+                        events.append(TextDelta(author, text))
+                    elif self.wants_thoughts:
+                        events.append(Thought(author, text))
+                elif self.wants_tools and part.get("function_call"):
+                    fc = part["function_call"]
+                    events.append(
+                        ToolCall(author, fc.get("name"), fc.get("args"), fc.get("id"))
+                    )
+                elif self.wants_tools and part.get("function_response"):
+                    fr = part["function_response"]
+                    events.append(
+                        ToolResponse(author, fr.get("name"), fr.get("response"), fr.get("id"))
+                    )
+
+            if self.wants_artifacts:
+                artifact_delta = (response.get("actions") or {}).get("artifact_delta")
+                for filename, version in (artifact_delta or {}).items():
+                    events.append(ArtifactDelta(author, filename, version))
+
+        if self.wants_usage and response.get("usage_metadata"):
+            usage = response["usage_metadata"]
+            events.append(
+                Usage(
+                    author,
+                    response.get("invocation_id"),
+                    usage.get("prompt_token_count") or 0,
+                    usage.get("candidates_token_count") or 0,
+                    usage.get("thoughts_token_count") or 0,
+                    usage.get("total_token_count") or 0,
+                )
+            )
+        return events
+
+    def feed(self, response: dict) -> list:
+        """
+        Dispatches one streamed event to the sinks. Returns whatever the handlers
+        returned that is awaitable, so async callers can await it (see afeed).
+        """
+        pending = []
+        for event in self.parse(response):
+            if isinstance(event, TextDelta):
+                self._text_chunks.append(event.text)
+            for sink in self._routes[event.channel]:
+                result = getattr(sink, event.handler)(event)
+                if result is not None and hasattr(result, "__await__"):
+                    pending.append(result)
+        return pending
+
+    async def afeed(self, response: dict) -> None:
+        for awaitable in self.feed(response):
+            await awaitable
+
+
+def split_text(text: str, limit: int) -> list[str]:
+    """Splits a long answer into chunks that fit a chat platform's message limit."""
+    return [text[i : i + limit] for i in range(0, len(text), limit)]
@@ -1,6 +1,8 @@
 import streamlit as st
 
 PREAUTHORIZED_EMAILS = [x.strip() for x in st.secrets["AUTHORIZED_USERS"]]
+# Optional: users who can see the usage report
+ADMIN_EMAILS = [x.strip() for x in st.secrets.get("ADMIN_USERS", [])]
 
 
 def login_screen():
@@ -6,19 +6,72 @@ import streamlit as st
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import config
-from streamlit_app.login import require_login
-from api_modules import list_sessions, create_session
-from streamlit_app.query_streamlit import query_agent
+import metrics_modules
+from streamlit_app.login import require_login, ADMIN_EMAILS
+from api_modules import list_sessions, create_session, delete_session, list_messages
+from streamlit_app.query_streamlit import query_agent, cancel_active_stream
+from streamlit_app.usage_view import render_usage_report
+from streamlit_app.transcript import (
+    ASSISTANT_AVATAR,
+    append_turn,
+    render_transcript,
+    split_payloads,
+)
 
 # === Config ===
+# Started once per server process; later reruns find it running
+metrics_modules.start_metrics_server()
 require_login()
+# A rerun while a reply is streaming abandons it: stop its reader, which releases
+# the upstream connection
+cancel_active_stream()
+
+
+SESSIONS_CACHE_TTL_SECONDS = 300
+HISTORY_CACHE_TTL_SECONDS = 600
+HISTORY_PAGE_SIZE = 20
+
+
+@st.cache_data(ttl=SESSIONS_CACHE_TTL_SECONDS, show_spinner=False)
+def get_session_ids(user_id) -> list[str]:
+    """Lists the user's sessions, newest first. Cached across reruns."""
+    sessions = list_sessions(user_id)
+    return [x["id"] for x in reversed(sessions)]
+
+
+@st.cache_resource(ttl=HISTORY_CACHE_TTL_SECONDS, show_spinner=False, max_entries=50)
+def get_session_messages(user_id, session_id) -> tuple[list[dict], dict]:
+    """
+    Loads the whole transcript of a session once. The Agent Engine returns all
+    events of a session in one response, so paging only limits what is rendered.
+    cache_resource hands back the same objects on every rerun instead of
+    unpickling a copy; finished turns are appended to them in place rather than
+    refetching the session.
+    """
+    return split_payloads(list_messages(user_id, session_id))
+
+
+def load_older_messages():
+    st.session_state.history_pages += 1
 
 
 def run_session_creation(user_id):
     new_session = create_session(user_id)
+    get_session_ids.clear(user_id)
+    st.session_state.selected_session = new_session
     st.toast(f"New session created: {new_session}")
 
 
+def run_session_deletion(user_id):
+    session_id = st.session_state.get("selected_session")
+    if not session_id:
+        return
+    delete_session(user_id, session_id)
+    get_session_ids.clear(user_id)
+    st.session_state.pop("selected_session", None)
+    st.toast(f"Session deleted: {session_id}")
+
+
 USER_ID = (
     st.user.email
     if "email" in st.user and isinstance(st.user.email, str)
@@ -29,8 +82,7 @@ user_picture = (
     if st.user.picture and isinstance(st.user.picture, str)
     else "streamlit_app/media/user_avatar.jpg"
 )
-sessions = list_sessions(USER_ID)
-session_ids = [x["id"] for x in sessions]
+session_ids = get_session_ids(USER_ID)
 with st.sidebar:
     create_chat_col, delete_chat_col = st.columns([1, 1])
     new_chat = create_chat_col.button(
@@ -39,41 +91,51 @@ with st.sidebar:
         kwargs={"user_id": USER_ID},
         type="tertiary",
     )
-    delete_chat = delete_chat_col.button("Delete chat", type="tertiary")
+    delete_chat = delete_chat_col.button(
+        "Delete chat",
+        on_click=run_session_deletion,
+        kwargs={"user_id": USER_ID},
+        type="tertiary",
+    )
     show_tool_calls = st.checkbox("Show tool calls", value=False)
     show_thoughts = st.checkbox("Show thoughts", value=False)
-    sessions_list = st.selectbox("Sessions", session_ids)
+    typewriter = st.checkbox("Typewriter effect", value=False)
+    sessions_list = st.selectbox("Sessions", session_ids, key="selected_session")
+    show_usage = USER_ID in ADMIN_EMAILS and st.toggle("Usage report", value=False)
 
 
 # --- Streamlit UI ---
 st.set_page_config(layout="wide")
 
+if show_usage:
+    render_usage_report()
+    st.stop()
+
 if "messages" not in st.session_state:
     st.session_state.messages = []
+    st.session_state.live_payloads = {}
 
-for msg in st.session_state.messages:
-    if msg["role"] == "thought":
-        icon = "🧠"
-        if msg.get("type") == "tool_call":
-            icon = "🔧"
-        elif msg.get("type") == "tool_response":
-            icon = "📥"
-
-        with st.expander(msg["label"], icon=icon):
-            if msg.get("type") == "tool_response":
-                st.json(msg["content"])
-            else:
-                st.info(msg["content"])
-    else:
-        with st.chat_message(
-            msg["role"],
-            avatar=(
-                user_picture
-                if msg["role"] == "user"
-                else "streamlit_app/media/haken.jpg"
-            ),
-        ):
-            st.markdown(msg["content"])
+# Reset the live transcript and history paging when another session is selected
+if st.session_state.get("active_session") != sessions_list:
+    st.session_state.active_session = sessions_list
+    st.session_state.messages = []
+    st.session_state.live_payloads = {}
+    st.session_state.history_pages = 1
+
+history, payloads = (
+    get_session_messages(USER_ID, sessions_list) if sessions_list else ([], {})
+)
+visible_count = st.session_state.history_pages * HISTORY_PAGE_SIZE
+if len(history) > visible_count:
+    st.button("Load older messages", on_click=load_older_messages, type="tertiary")
+
+render_transcript(
+    history[-visible_count:] + st.session_state.messages,
+    user_picture,
+    {**payloads, **st.session_state.live_payloads},
+    show_thoughts=show_thoughts,
+    show_tool_calls=show_tool_calls,
+)
 
 
 if prompt := st.chat_input("Type your message"):
@@ -82,16 +144,42 @@ if prompt := st.chat_input("Type your message"):
     with st.chat_message("user", avatar=user_picture):
         st.markdown(prompt)
 
+    if not sessions_list:
+        sessions_list = create_session(USER_ID)
+        get_session_ids.clear(USER_ID)
+
+    stop_placeholder = st.empty()
+    stop_placeholder.button(
+        "Stop generating", on_click=cancel_active_stream, type="tertiary"
+    )
+
     # Query agent
-    with st.chat_message("assistant", avatar="streamlit_app/media/haken.jpg"):
+    turn_failed = False
+    with st.chat_message("assistant", avatar=ASSISTANT_AVATAR):
         try:
             st.write_stream(
                 query_agent(
                     USER_ID,
                     prompt,
+                    session_id=sessions_list,
                     show_thoughts=show_thoughts,
                     show_tool_calls=show_tool_calls,
+                    typewriter=typewriter,
                 )
             )
         except Exception as e:
+            turn_failed = True
             st.write(f"Sorry, an error occurred, please try later:\n{e}")
+    stop_placeholder.empty()
+
+    # Move the finished turn into the cached history instead of refetching the
+    # whole session. A failed turn may have left partial events, so reload then.
+    # A session created above has no cached history yet and loads on the next rerun.
+    if turn_failed:
+        get_session_messages.clear(USER_ID, sessions_list)
+    else:
+        append_turn(
+            history, payloads, st.session_state.messages, st.session_state.live_payloads
+        )
+    st.session_state.messages = []
+    st.session_state.live_payloads = {}
@@ -1,16 +1,169 @@
-import json
+import queue
+import threading
 import requests
 import time
 import streamlit as st
 import config
+import json_modules
+import metrics_modules
+import usage_modules
+import stream_events
 from api_modules import get_or_create_session, get_identity_token
+from streamlit_app.transcript import strip_payload
+
+
+# --- Rendering ---
+# Text that arrives faster than this is coalesced into a single paint.
+FRAME_INTERVAL_SECONDS = 1 / 30
+# Optional typewriter effect: number of slices a frame is split into.
+TYPEWRITER_SLICES = 8
+# How often to check for a Stop click or rerun while waiting on the agent.
+CANCEL_POLL_SECONDS = 0.25
+_END_OF_STREAM = object()
+
+
+def read_events(resp: requests.Response, events: queue.Queue, stop: threading.Event):
+    """
+    Parses streamed lines in a background thread so the UI thread only paints.
+    Stops between chunks once `stop` is set, and closes the response itself:
+    closing it from the UI thread does not reliably interrupt a blocked read.
+    """
+    try:
+        for chunk in resp.iter_lines():
+            if stop.is_set():
+                break
+            if not chunk:
+                continue
+            try:
+                events.put(json_modules.loads(chunk))
+            except Exception:
+                continue
+    except Exception as e:
+        events.put(e)
+    finally:
+        resp.close()
+        events.put(_END_OF_STREAM)
+
+
+def cancel_active_stream():
+    """Stops the reader of a generation still running in this browser session."""
+    stop = st.session_state.pop("active_stream", None)
+    if stop is not None:
+        stop.set()
+
+
+def paint(text: str, events: queue.Queue, typewriter: bool = False):
+    """
+    Yields a frame of text. With `typewriter` on, the frame is revealed in slices
+    spread over at most one frame interval, and the effect stops as soon as new
+    events are waiting, so it never holds the stream back.
+    """
+    if not typewriter or len(text) < TYPEWRITER_SLICES:
+        yield text
+        return
+    slice_size = -(-len(text) // TYPEWRITER_SLICES)
+    for i in range(0, len(text), slice_size):
+        if not events.empty():
+            yield text[i:]
+            return
+        yield text[i : i + slice_size]
+        time.sleep(FRAME_INTERVAL_SECONDS / TYPEWRITER_SLICES)
+
+
+class TranscriptSink(stream_events.StreamSink):
+    """
+    Records stream events in the session transcript, and queues them in arrival
+    order for the painting loop.
+    """
+
+    wants_validator = True
+
+    def __init__(self, show_thoughts: bool, show_tool_calls: bool):
+        self.wants_thoughts = show_thoughts
+        self.wants_tools = show_tool_calls
+        self._outbox: list[dict] = []
+
+    def add(self, message_data: dict):
+        # The live transcript keeps large tool payloads aside, as loaded history does;
+        # only the painting loop gets the full message
+        live_payloads = st.session_state.setdefault("live_payloads", {})
+        payload_id = f"live_payload_{len(st.session_state.messages)}"
+        st.session_state.messages.append(
+            strip_payload(message_data, live_payloads, payload_id)
+        )
+        self._outbox.append(message_data)
+
+    def drain(self) -> list[dict]:
+        outbox, self._outbox = self._outbox, []
+        return outbox
+
+    def on_text_delta(self, event: stream_events.TextDelta):
+        self.add(
+            {
+                "role": "assistant",
+                "type": "response",
+                "label": "Response",
+                "content": f"{event.author}: {event.text}",
+            }
+        )
+
+    def on_thought(self, event: stream_events.Thought):
+        self.add(
+            {
+                "role": "thought",
+                "type": "thought",
+                "label": "Thought",
+                "content": f"{event.author}'s thought: {event.text}",
+            }
+        )
+
+    def on_tool_call(self, event: stream_events.ToolCall):
+        self.add(
+            {
+                "role": "thought",
+                "type": "tool_call",
+                "label": event.name,
+                "content": event.args,
+            }
+        )
+
+    def on_tool_response(self, event: stream_events.ToolResponse):
+        self.add(
+            {
+                "role": "thought",
+                "type": "tool_response",
+                "label": event.name,
+                "content": event.response,
+            }
+        )
+
+    def on_validator_output(self, event: stream_events.ValidatorOutput):
+        st.toast(json_modules.loads(event.text))
+        # if not validator_answer.get("answer_needed"):
+        #     st.toast("No answer required")
+
+
+def render_live_thought(thought_data: dict):
+    if thought_data["type"] == "thought":
+        with st.expander(thought_data["label"], icon="🧠"):
+            st.info(thought_data["content"])
+    else:
+        icon = "🔧" if thought_data["type"] == "tool_call" else "📥"
+        with st.expander(thought_data["label"], icon=icon):
+            st.json(thought_data["content"])
 
 
 # --- Query ---
 def query_agent(
-    user_id: str, message_text: str, show_tool_calls=True, show_thoughts=True
+    user_id: str,
+    message_text: str,
+    session_id: str | None = None,
+    show_tool_calls=True,
+    show_thoughts=True,
+    typewriter=False,
 ):
-    session_id = get_or_create_session(user_id)
+    if not session_id:
+        session_id = get_or_create_session(user_id)
 
     url = f"{config.ENDPOINT}:streamQuery?alt=sse"
     headers = {
@@ -26,76 +179,99 @@ def query_agent(
         },
     }
 
-    resp = requests.post(url, headers=headers, data=json.dumps(body), stream=True)
+    cancel_active_stream()
+    resp = requests.post(
+        url, headers=headers, data=json_modules.dumps(body), stream=True
+    )
     resp.raise_for_status()
+    stop = threading.Event()
+    st.session_state.active_stream = stop
 
-    for chunk in resp.iter_lines():
-        if not chunk:
-            continue
+    metrics_modules.requests_total.inc(frontend="streamlit", route="chat")
+    try:
+        with (
+            metrics_modules.StreamTimer("streamlit") as stream_timer,
+            usage_modules.UsageRecorder(
+                frontend="streamlit",
+                channel=user_id,
+                channel_name="Streamlit",
+                user_id=user_id,
+                session_id=session_id,
+            ) as usage_recorder,
+        ):
+            yield from stream_response(
+                resp,
+                stop,
+                show_tool_calls,
+                show_thoughts,
+                typewriter,
+                stream_timer,
+                usage_recorder,
+            )
+    finally:
+        # Runs on completion, errors, Stop and reruns alike (the generator is
+        # closed); the reader closes the response once it sees the event
+        stop.set()
+        if st.session_state.get("active_stream") is stop:
+            st.session_state.pop("active_stream", None)
+
+
+def stream_response(
+    resp: requests.Response,
+    stop: threading.Event,
+    show_tool_calls: bool,
+    show_thoughts: bool,
+    typewriter: bool,
+    *extra_sinks: stream_events.StreamSink,
+):
+    events: queue.Queue = queue.Queue()
+    threading.Thread(
+        target=read_events, args=(resp, events, stop), daemon=True
+    ).start()
+
+    sink = TranscriptSink(show_thoughts, show_tool_calls)
+    demux = stream_events.StreamDemux(sink, *extra_sinks)
+    pending = []  # text received but not painted yet
+    last_frame = time.monotonic()
+    while True:
+        timeout = CANCEL_POLL_SECONDS
+        if pending:
+            timeout = max(0.0, FRAME_INTERVAL_SECONDS - (time.monotonic() - last_frame))
         try:
-            event = json.loads(chunk.decode("utf-8"))
-        except Exception:
+            event = events.get(timeout=timeout)
+        except queue.Empty:
+            if not pending:
+                # Session state access is a Streamlit yield point: a pending
+                # Stop click or rerun interrupts the script here.
+                if st.session_state.get("active_stream") is not stop:
+                    break
+                continue
+            # Nothing new arrived within the frame: paint what we have
+            yield from paint("".join(pending), events, typewriter)
+            pending = []
+            last_frame = time.monotonic()
             continue
-        event_author = event.get("author", "")
 
-        if event_author == "answer_validator_agent":
-            validator_answer = json.loads(
-                event.get("content", {}).get("parts", [{}])[0].get("text", "{}")
-            )
-            st.toast(validator_answer)
-            # if not validator_answer.get("answer_needed"):
-            #     st.toast("No answer required")
-        else:
-            parts = event.get("content", {}).get("parts", [])
-            for part in parts:
-
-                # Case 1: It's regular text for the final reply
-                if part.get("text", "") and not part.get("thought"):
-                    message_data = {
-                        "role": "assistant",
-                        "type": "response",
-                        "label": "Response",
-                        "content": f'{event_author}: {part.get("text")}',
-                    }
-                    st.session_state.messages.append(message_data)
-                    for char in message_data["content"]:
-                        yield char + ""
-                        time.sleep(0.01)
-
-                # Case 2: It's a "thought" from the planner
-                elif part.get("thought") and show_thoughts:
-                    thought_data = {
-                        "role": "thought",
-                        "type": "thought",
-                        "label": "Thought",
-                        "content": f"""{event_author}'s thought: {part.get("text")}""",
-                    }
-                    st.session_state.messages.append(thought_data)
-                    with st.expander(thought_data["label"], icon="🧠"):
-                        st.info(thought_data["content"])
-
-                # Case 3: It's a tool call
-                elif part.get("function_call") and show_tool_calls:
-                    fc = part.get("function_call")
-                    thought_data = {
-                        "role": "thought",
-                        "type": "tool_call",
-                        "label": fc.get("name"),
-                        "content": fc.get("args"),
-                    }
-                    st.session_state.messages.append(thought_data)
-                    with st.expander(thought_data["label"], icon="🔧"):
-                        st.json(thought_data["content"])
-
-                # Case 4: It's a tool response
-                elif part.get("function_response") and show_tool_calls:
-                    fr = part.get("function_response")
-                    thought_data = {
-                        "role": "thought",
-                        "type": "tool_response",
-                        "label": fr.get("name"),
-                        "content": fr.get("response"),
-                    }
-                    st.session_state.messages.append(thought_data)
-                    with st.expander(thought_data["label"], icon="📥"):
-                        st.json(thought_data["content"])
+        if event is _END_OF_STREAM:
+            break
+        if isinstance(event, Exception):
+            raise event
+        demux.feed(event)
+        for message_data in sink.drain():
+            if message_data["role"] == "assistant":
+                pending.append(message_data["content"])
+                continue
+            # Thoughts and tool calls must appear after the text before them
+            if pending:
+                yield from paint("".join(pending), events)
+                pending = []
+                last_frame = time.monotonic()
+            render_live_thought(message_data)
+
+        if pending and time.monotonic() - last_frame >= FRAME_INTERVAL_SECONDS:
+            yield from paint("".join(pending), events, typewriter)
+            pending = []
+            last_frame = time.monotonic()
+
+    if pending:
+        yield from paint("".join(pending), events, typewriter)
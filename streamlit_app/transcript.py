@@ -0,0 +1,123 @@
+import json
+import streamlit as st
+
+# --- Rendering limits ---
+# Turns (a user message and everything after it) drawn in full on every rerun.
+RECENT_TURNS = 10
+# Tool payloads larger than this (serialized chars) are only rendered on demand.
+INLINE_PAYLOAD_CHARS = 2000
+ASSISTANT_AVATAR = "streamlit_app/media/haken.jpg"
+
+
+def strip_payload(msg: dict, payloads: dict, payload_id: str) -> dict:
+    """
+    Moves a large tool payload of one message into `payloads` under `payload_id`.
+    The returned message carries "payload_id" and "size" instead of "content".
+    """
+    if msg["role"] == "thought" and msg.get("type") in ["tool_call", "tool_response"]:
+        size = len(json.dumps(msg["content"], default=str))
+        if size > INLINE_PAYLOAD_CHARS:
+            payloads[payload_id] = msg["content"]
+            msg = {**msg, "content": None, "payload_id": payload_id, "size": size}
+    return msg
+
+
+def split_payloads(messages: list[dict]) -> tuple[list[dict], dict]:
+    """
+    Moves large tool payloads out of the transcript.
+    Returns the lightweight messages and a {payload_id: payload} dict.
+    """
+    payloads = {}
+    light_messages = [
+        strip_payload(msg, payloads, f"payload_{i}") for i, msg in enumerate(messages)
+    ]
+    return light_messages, payloads
+
+
+def append_turn(
+    history: list[dict], payloads: dict, messages: list[dict], live_payloads: dict
+):
+    """
+    Appends a finished live turn to a loaded transcript in place. Stripped
+    payloads are re-keyed by their position in `history`, as split_payloads
+    would key them, so the next turn's live ids cannot collide with them.
+    """
+    for msg in messages:
+        if msg.get("payload_id"):
+            payload_id = f"payload_{len(history)}"
+            payloads[payload_id] = live_payloads[msg["payload_id"]]
+            msg = {**msg, "payload_id": payload_id}
+        history.append(msg)
+
+
+def split_turns(messages: list[dict]) -> list[list[dict]]:
+    """Groups messages into turns, each starting with a user message."""
+    turns = []
+    for msg in messages:
+        if msg["role"] == "user" or not turns:
+            turns.append([])
+        turns[-1].append(msg)
+    return turns
+
+
+def render_message(msg: dict, user_picture: str, payloads: dict, key: str):
+    if msg["role"] == "thought":
+        icon = "🧠"
+        if msg.get("type") == "tool_call":
+            icon = "🔧"
+        elif msg.get("type") == "tool_response":
+            icon = "📥"
+
+        with st.expander(msg["label"], icon=icon):
+            if msg.get("payload_id"):
+                # Expander bodies always run, so gate the heavy st.json behind a toggle
+                if st.toggle(f"Show payload ({msg['size'] / 1024:.0f} KB)", key=key):
+                    st.json(payloads.get(msg["payload_id"]), expanded=False)
+            elif msg.get("type") == "tool_response":
+                st.json(msg["content"])
+            else:
+                st.info(msg["content"])
+    else:
+        with st.chat_message(
+            msg["role"],
+            avatar=user_picture if msg["role"] == "user" else ASSISTANT_AVATAR,
+        ):
+            st.markdown(msg["content"])
+
+
+def render_transcript(
+    messages: list[dict],
+    user_picture: str,
+    payloads: dict | None = None,
+    show_thoughts: bool = False,
+    show_tool_calls: bool = False,
+):
+    """
+    Draws the last RECENT_TURNS turns in full. Older turns are collapsed behind
+    a toggle and not rendered at all unless it is switched on.
+    """
+    payloads = payloads or {}
+    visible = [
+        msg
+        for msg in messages
+        if msg["role"] != "thought"
+        or (show_thoughts if msg.get("type") == "thought" else show_tool_calls)
+    ]
+    turns = split_turns(visible)
+    older_turns, recent_turns = turns[:-RECENT_TURNS], turns[-RECENT_TURNS:]
+
+    # Keys count from the end so they stay stable when older pages are loaded
+    position = len(visible)
+    if older_turns:
+        older_count = sum(len(turn) for turn in older_turns)
+        if st.toggle(f"Show {len(older_turns)} earlier turns", key="show_older_turns"):
+            for turn in older_turns:
+                for msg in turn:
+                    render_message(msg, user_picture, payloads, key=f"msg_{position}")
+                    position -= 1
+        else:
+            position -= older_count
+    for turn in recent_turns:
+        for msg in turn:
+            render_message(msg, user_picture, payloads, key=f"msg_{position}")
+            position -= 1
@@ -0,0 +1,39 @@
+import streamlit as st
+import usage_modules
+
+USAGE_CACHE_TTL_SECONDS = 60
+
+
+@st.cache_data(ttl=USAGE_CACHE_TTL_SECONDS, show_spinner=False)
+def get_usage(group_by: str, days: float) -> list[dict]:
+    return usage_modules.summarize(group_by, days, limit=100)
+
+
+def render_usage_report():
+    """Admin view of recorded token usage, across all front-ends."""
+    st.header("Token usage")
+    group_col, days_col = st.columns([1, 1])
+    group_by = group_col.selectbox("Group by", list(usage_modules.GROUP_BY_COLUMNS))
+    days = days_col.number_input("Days", min_value=1, max_value=365, value=30)
+    rows = get_usage(group_by, float(days))
+    if not rows:
+        st.info(f"No usage recorded in the last {days} days.")
+        return
+
+    totals = {
+        key: sum(row[key] or 0 for row in rows)
+        for key in ["invocations", "prompt_tokens", "output_tokens", "thought_tokens"]
+    }
+    metric_cols = st.columns(4)
+    metric_cols[0].metric("Invocations", f"{totals['invocations']:,}")
+    metric_cols[1].metric("Prompt tokens", f"{totals['prompt_tokens']:,}")
+    metric_cols[2].metric("Output tokens", f"{totals['output_tokens']:,}")
+    metric_cols[3].metric("Thought tokens", f"{totals['thought_tokens']:,}")
+    st.dataframe(
+        [
+            {group_by: row["key"], **{k: v for k, v in row.items() if k != "key"}}
+            for row in rows
+        ],
+        use_container_width=True,
+        hide_index=True,
+    )
@@ -7,12 +7,15 @@ import sys
 if os.path.dirname(os.path.dirname(os.path.abspath(__file__))) not in sys.path:
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# import asyncio
+import asyncio
+import html
+import time
 from typing import Any, Dict, List
 import config
 
-from telegram import Update
+from telegram import Message, Update
 from telegram.constants import ChatAction
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     # Application,
     ApplicationBuilder,
@@ -23,6 +26,13 @@ from telegram.ext import (
     filters,
 )
 import engine_modules
+import attachment_modules
+import stream_events
+import tracing_modules
+import metrics_modules
+import usage_modules
+import profiling_modules
+import logging_modules
 
 # Suppress absl warnings
 from absl import logging as absl_logging
@@ -31,9 +41,7 @@ from absl import logging as absl_logging
 absl_logging.set_verbosity(absl_logging.ERROR)
 
 
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s"
-)
+logging_modules.setup_logging()
 logger = logging.getLogger(__name__)
 
 agent_app = engine_modules.get_remote_agent()
@@ -45,57 +53,159 @@ memory_service = engine_modules.get_memory_service()
 show_tools = False
 show_thoughts = False
 sessions_dict = {}
+# Pending album updates, keyed by "<chat_id>:<media_group_id>", and when the
+# latest item of each arrived (time.monotonic())
+media_groups: Dict[str, List[Update]] = {}
+media_group_last_seen: Dict[str, float] = {}
 
 # --- Constants ---
 TELEGRAM_TOKEN = config.TELEGRAM_BOT_TOKEN
+# The typing status lasts about 5 seconds
+TYPING_REFRESH_SECONDS = 4
+# Attachments take longer than the bot's default read timeout for API calls
+DOWNLOAD_READ_TIMEOUT_SECONDS = 60
+# The Bot API's getFile refuses files above this, whatever the agent could take
+TELEGRAM_MAX_DOWNLOAD_BYTES = 20 * 1024 * 1024
 
 
 # --- Helper Functions ---
-async def download_files_from_update(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that counts Bot API calls and failures by method."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        try:
+            status_code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            metrics_modules.count_api_call("telegram", api_method, failed=True)
+            raise
+        metrics_modules.count_api_call("telegram", api_method, failed=status_code >= 400)
+        return status_code, payload
+
+
+def get_max_download_size() -> int:
+    return min(attachment_modules.get_max_file_size(), TELEGRAM_MAX_DOWNLOAD_BYTES)
+
+
+@tracing_modules.traced("download_file")
+async def download_file(
+    context: ContextTypes.DEFAULT_TYPE, file_info: Dict[str, Any]
+) -> bytearray | None:
+    """
+    Downloads a Telegram file through the bot's own request object (so its proxy,
+    pool and timeouts apply) into a buffer preallocated from its reported size.
+    The buffer is returned as-is, without a bytes() copy. Returns None if the
+    content turns out to be unsupported.
+    """
+    tracing_modules.current_span().set(
+        file_type=file_info["mime_type"], payload_bytes=file_info["size"]
+    )
+    file = await context.bot.get_file(file_info["file_id"])
+    buffer = attachment_modules.PreallocatedBuffer(
+        file_info["size"] or file.file_size,
+        max_size=get_max_download_size(),
+        file_name=file_info["name"],
+        provided_file_type=file_info["mime_type"],
+    )
+    try:
+        # Also handles local Bot API server mode, where the file is already on disk
+        await file.download_to_memory(out=buffer, read_timeout=DOWNLOAD_READ_TIMEOUT_SECONDS)
+        return buffer.getvalue()
+    except attachment_modules.AttachmentRejectedError as e:
+        logger.info(f"Skipping file '{file_info['name']}': {e}")
+        return None
+
+
+async def download_files_from_updates(
+    updates: List[Update], context: ContextTypes.DEFAULT_TYPE
 ) -> List[Dict[str, Any]]:
-    """Download files (documents and photos) from a Telegram update."""
+    """Download files (documents and photos) from one or more Telegram updates."""
+    files_info: List[Dict[str, Any]] = []
+    for update in updates:
+        files_info.extend(get_files_from_message(update.effective_message))
+
+    # Reject oversized and unsupported files before spending bandwidth on them
+    accepted_files = []
+    for file_info in files_info:
+        rejection_reason = attachment_modules.get_rejection_reason(
+            file_info["size"],
+            file_info["mime_type"],
+            max_size=get_max_download_size(),
+            file_name=file_info["name"],
+        )
+        if rejection_reason:
+            logger.info(f"Skipping file '{file_info['name']}': {rejection_reason}")
+            continue
+        accepted_files.append(file_info)
+
+    # A failed download only costs its own file, not the whole message
+    contents = await asyncio.gather(
+        *[download_file(context, file_info) for file_info in accepted_files],
+        return_exceptions=True,
+    )
+    downloaded_files = []
+    for file_info, content in zip(accepted_files, contents):
+        if isinstance(content, Exception):
+            logger.warning(f"Skipping file '{file_info['name']}': download failed: {content}")
+            continue
+        if content is None:
+            continue
+        file_info.pop("file_id")
+        file_info["content"] = content
+        downloaded_files.append(file_info)
+    return downloaded_files
+
+
+def get_files_from_message(message: Message | None) -> List[Dict[str, Any]]:
+    """Collects metadata of the documents and photos attached to a message."""
     files_info: List[Dict[str, Any]] = []
-    message = update.effective_message
     if not message:
         return files_info
 
-    async def download_file(file_id: str) -> bytes:
-        file = await context.bot.get_file(file_id)
-        content = await file.download_as_bytearray()
-        return bytes(content)
-
     # Documents
     if message.document:
-        file_content = await download_file(message.document.file_id)
         files_info.append(
             {
                 "name": message.document.file_name or "document",
                 "mime_type": message.document.mime_type or "application/octet-stream",
-                "content": file_content,
+                "file_id": message.document.file_id,
                 "size": message.document.file_size,
             }
         )
     # Photos
     if message.photo:
         largest_photo = message.photo[-1]
-        file_content = await download_file(largest_photo.file_id)
         files_info.append(
             {
                 "name": f"photo_{largest_photo.file_id}.jpg",
                 "mime_type": "image/jpeg",
-                "content": file_content,
+                "file_id": largest_photo.file_id,
                 "size": largest_photo.file_size,
             }
         )
     return files_info
 
 
+def get_message_text(updates: List[Update]) -> str:
+    """Returns the first text or caption found in the updates (albums carry one caption)."""
+    for update in updates:
+        message = update.effective_message
+        if message and (message.text or message.caption):
+            return message.text or message.caption or ""
+    return ""
+
+
+@tracing_modules.traced("get_session_id")
 async def get_session_id(user_id):
     if user_id in sessions_dict:
+        tracing_modules.current_span().set(cache_hit=True)
+        metrics_modules.session_cache_lookups_total.inc(frontend="telegram", result="hit")
         logger.info(f"Using cached session ID for user {user_id}")
         return sessions_dict[user_id]
     else:
+        metrics_modules.session_cache_lookups_total.inc(
+            frontend="telegram", result="miss"
+        )
         logger.info(f"Creating / fetching new session ID for user {user_id}")
         session_id = await engine_modules.get_or_create_session(
             session_service=session_service, user_id=user_id
@@ -104,10 +214,18 @@ async def get_session_id(user_id):
         return session_id
 
 
+@tracing_modules.traced("get_event_info")
 async def get_event_info(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    updates: List[Update] | None = None,
 ) -> Dict[str, Any]:
-    """Extracts and structures event information from a Telegram update."""
+    """
+    Extracts and structures event information from a Telegram update.
+    `updates`, if provided, holds all updates of a media group (album) and their
+    attachments are merged into a single event.
+    """
+    updates = updates or [update]
     message = update.effective_message
     chat = update.effective_chat
     user = update.effective_user
@@ -127,19 +245,22 @@ async def get_event_info(
         "display_name": display_name,
         "chat_id": chat_id,
         "chat_type": chat.type if chat else "N/A",
-        "message_text": message.text if message and message.text else "",
+        "message_text": get_message_text(updates),
         "session_user_id": session_user_id,
         "personal_user_id": personal_user_id,
     }
 
     # Handle files
-    files_info = await download_files_from_update(update, context)
+    files_info = await download_files_from_updates(updates, context)
 
     # Enrich the message
     enriched_message = (
         f"Message from {display_name} ({user_id}): {event_info['message_text']}"
     )
     if files_info:
+        metrics_modules.attachment_bytes_total.inc(
+            sum(len(f["content"]) for f in files_info), frontend="telegram"
+        )
         event_info["files_attached"] = files_info
         enriched_message += (
             f" Attached files: {', '.join([f['name'] for f in files_info])}."
@@ -152,7 +273,35 @@ async def get_event_info(
 
 
 # --- Core Agent Logic ---
-async def query_agent_and_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
+class TelegramReplySink(stream_events.StreamSink):
+    """Replies with thoughts and tool activity, if enabled."""
+
+    def __init__(self, message: Message, show_thoughts: bool, show_tools: bool):
+        self.message = message
+        self.wants_thoughts = show_thoughts
+        self.wants_tools = show_tools
+
+    async def on_thought(self, event: stream_events.Thought):
+        await self.message.reply_text(f"🧠 *Thought* ({event.author}): {event.text}")
+
+    async def on_tool_call(self, event: stream_events.ToolCall):
+        await self.message.reply_text(
+            f"🔧 *Tool Call* ({event.author}): `{event.name}` with args: `{event.args}`"
+        )
+
+    async def on_tool_response(self, event: stream_events.ToolResponse):
+        await self.message.reply_text(
+            f"📥 *Tool Response* for `{event.name}`: `{event.response}`"
+        )
+
+
+@logging_modules.with_request_id
+@tracing_modules.traced("telegram.query_agent_and_reply", root=True)
+async def query_agent_and_reply(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    updates: List[Update] | None = None,
+):
     """
     Queries the agent and replies to the user.
     """
@@ -163,14 +312,18 @@ async def query_agent_and_reply(update: Update, context: ContextTypes.DEFAULT_TY
         chat_id=update.effective_chat.id, action=ChatAction.TYPING
     )
 
-    event_info = await get_event_info(update, context)
+    event_info = await get_event_info(update, context, updates)
+    tracing_modules.current_span().set(
+        channel=event_info["chat_id"],
+        payload_bytes=sum(f["size"] or 0 for f in event_info.get("files_attached", [])),
+    )
 
     final_answer = ""
-    last_text = ""
-    thoughts = []
+    artifact_sink = None
     session_id = None
     try:
         session_id = await get_session_id(event_info["session_user_id"])
+        tracing_modules.current_span().set(session_id=session_id)
 
         # Temporarily change user_id for personal memories access
         await engine_modules.update_session(
@@ -180,39 +333,54 @@ async def query_agent_and_reply(update: Update, context: ContextTypes.DEFAULT_TY
             state_delta={"user_id": f'Telegram: {event_info["user_id"]}'},
         )
 
-        prepared_message = engine_modules.prepare_message_dict(
+        prepared_message = await engine_modules.prepare_message_dict_async(
             text=event_info["enriched_message"],
             file_list=event_info.get("files_attached", []),
+            artifact_service=artifact_service,
+            session_id=session_id,
+            user_id=event_info["session_user_id"],
         )
 
-        async for response in agent_app.async_stream_query(  # type: ignore
-            user_id=event_info["session_user_id"],
+        artifact_sink = engine_modules.ArtifactPrefetchSink(
+            artifact_service=artifact_service,
             session_id=session_id,
-            message=prepared_message,
+            user_id=event_info["session_user_id"],
+        )
+        with (
+            tracing_modules.span("agent_stream") as stream_span,
+            metrics_modules.StreamTimer("telegram") as stream_timer,
+            usage_modules.UsageRecorder(
+                frontend="telegram",
+                channel=event_info["chat_id"],
+                channel_name=event_info["session_user_id"],
+                user_id=event_info["user_id"],
+                session_id=session_id,
+                file_list=event_info.get("files_attached"),
+            ) as usage_recorder,
         ):
-            if not response:
-                continue
-
-            # logger.info(
-            #     "******************[EVENT LOGGING]******************************:"
-            # )
-            # logger.info(response)
-            # logger.info(f"RESPONSE TYPE: {type(response)}")
-            # logger.info("\n\n\n")
-
-            response_author = response.get("author")
-
-            try:
+            demux = stream_events.StreamDemux(
+                TelegramReplySink(update.effective_message, show_thoughts, show_tools),
+                artifact_sink,
+                tracing_modules.StreamSpanSink(stream_span),
+                stream_timer,
+                usage_recorder,
+            )
+            last_typing = time.monotonic()
 
-                if response_author == "answer_validator_agent":
+            async for response in agent_app.async_stream_query(  # type: ignore
+                user_id=event_info["session_user_id"],
+                session_id=session_id,
+                message=prepared_message,
+            ):
+                if not response:
                     continue
+                stream_span.mark("first_event")
 
                 # if confirmation_request := response.get("actions", {}).get(
                 #     "requested_tool_confirmations"
                 # ):
                 #     call_id = list(confirmation_request.keys())[0]
                 #     logger.info(f"[SENDING TOOL CONFIRMATION] for call_id: {call_id}")
-                #     logger.info("\n\n\n")
                 # Send inline Yes / No buttons to ask the user to confirm the tool call
                 # keyboard = [
                 #     [
@@ -221,8 +389,6 @@ async def query_agent_and_reply(update: Update, context: ContextTypes.DEFAULT_TY
                 #     ]
                 # ]
                 # reply_markup = InlineKeyboardMarkup(keyboard)
-                # logger.info("[REPLY MARKUP]:")
-                # logger.info("\n\n\n")
 
                 # await update.effective_message.reply_text(
                 #     "⚠️ The agent requests to run a tool. Confirm?",
@@ -239,78 +405,24 @@ async def query_agent_and_reply(update: Update, context: ContextTypes.DEFAULT_TY
                 #     )
                 # break
 
-                parts = response.get("content", {}).get("parts", [])
-                for part in parts:
+                try:
+                    await demux.afeed(response)
+                except json.JSONDecodeError as e:
+                    await update.effective_message.reply_text(
+                        f"ERROR: Ran into JSON decoding issue: {str(e)}"
+                    )
+                except Exception as e:
+                    await update.effective_message.reply_text(
+                        f"ERROR: Ran into an unexpected issue: {str(e)}"
+                    )
 
-                    send_typing = context.bot.send_chat_action(
+                # Refresh the typing status while the answer streams, not once per part
+                if time.monotonic() - last_typing > TYPING_REFRESH_SECONDS:
+                    last_typing = time.monotonic()
+                    await context.bot.send_chat_action(
                         chat_id=update.effective_chat.id, action=ChatAction.TYPING
                     )
-
-                    # logger.info("%%%%%%%%%%%%%%%[PART]%%%%%%%%%%%%%%%%%")
-                    # logger.info(part)
-                    # logger.info(f"Part type: {type(part)}")
-                    # logger.info("\n\n\n")
-
-                    if part.get("text") and not part.get("thought"):
-                        final_answer += part.get("text")
-
-                    elif part.get("text") and part.get("thought"):
-                        thought = (
-                            f"🧠 *Thought* ({response_author}): {part.get('text')}"
-                        )
-                        thoughts.append(thought)
-                        if show_thoughts:
-                            await update.effective_message.reply_text(thought)
-                        last_text = thought
-
-                    elif part.get("function_call"):
-                        fc = part.get("function_call")
-                        thought = f"🔧 *Tool Call* ({response_author}): `{fc.get('name')}` with args: `{fc.get('args')}`"
-                        thoughts.append(thought)
-                        if show_tools:
-                            await update.effective_message.reply_text(thought)
-                        last_text = thought
-                        # logger.info(f"[FUNCTION CALL] for call_id: {fc.get('id')}")
-                        # logger.info(
-                        #     f"############################################################\n\n\n"
-                        # )
-
-                        # get tool confirmation
-                        # if response.get('finish_reason'):
-                        #     logger.info(
-                        #         f"[SENDING TOOL CONFIRMATION] for call_id: {fc.get('id')}"
-                        #     )
-                        #     logger.info("\n\n\n")
-                        #     await engine_modules.send_tool_confirmation(
-                        #         session_service=session_service,
-                        #         session_id=session_id,
-                        #         user_id=event_info["session_user_id"],
-                        #         confirmation=True,
-                        #         call_id=fc.get("id"),
-                        #         invocation_id=response.get('invocation_id')
-                        #     )
-                        #     logger.info(
-                        #         f"[TOOL CONFIRMATION SENT] for call_id: {fc.get('id')}"
-                        #     )
-
-                    elif part.get("function_response"):
-                        fr = part.get("function_response")
-                        thought = f"📥 *Tool Response* for `{fr.get('name')}`: `{fr.get('response')}`"
-                        thoughts.append(thought)
-                        if show_tools:
-                            await update.effective_message.reply_text(thought)
-                        last_text = thought
-
-                    await send_typing
-
-            except json.JSONDecodeError as e:
-                await update.effective_message.reply_text(
-                    f"ERROR: Ran into JSON decoding issue: {str(e)}"
-                )
-            except Exception as e:
-                await update.effective_message.reply_text(
-                    f"ERROR: Ran into an unexpected issue: {str(e)}"
-                )
+            final_answer = demux.text
 
         # Change user_id back
         await engine_modules.update_session(
@@ -334,35 +446,71 @@ async def query_agent_and_reply(update: Update, context: ContextTypes.DEFAULT_TY
             except Exception as delete_e:
                 logger.error(f"Error deleting invalid session: {delete_e}")
             logger.info("Session not found, creating a new one and retrying...")
-            await query_agent_and_reply(update, context)  # Recurse
+            if artifact_sink:
+                artifact_sink.cancel()
+                artifact_sink = None
+            await query_agent_and_reply(update, context, updates)  # Recurse
             return  # Important to exit after recursion
         else:
             final_answer = f"Sorry, an error occurred: {e}"
             logger.error(final_answer)
 
-    if not final_answer and not last_text:
+    if not final_answer:
         logger.info("Agent provided no final answer.")
+        await send_artifacts(update, artifact_sink)
         return
 
-    try:
-        # post_message = final_answer or last_text
-        # Telegram max message length is 4096
-        if final_answer:
-            chunks = [
-                final_answer[i : i + 4096] for i in range(0, len(final_answer), 4096)
-            ]
-            for chunk in chunks:
-                await update.effective_message.reply_text(chunk)
+    with tracing_modules.span("post_reply", chars=len(final_answer)):
+        try:
+            # post_message = final_answer or last_text
+            # Telegram max message length is 4096
+            if final_answer:
+                for chunk in stream_events.split_text(final_answer, 4096):
+                    await update.effective_message.reply_text(chunk)
 
-    except Exception as e:
-        logger.error(f"Error posting final answer: {e}")
-        await update.effective_message.reply_text(
-            f"Sorry, an error occurred while sending the reply: {e}"
-        )
+        except Exception as e:
+            logger.error(f"Error posting final answer: {e}")
+            await update.effective_message.reply_text(
+                f"Sorry, an error occurred while sending the reply: {e}"
+            )
+
+    await send_artifacts(update, artifact_sink)
+
+
+@tracing_modules.traced("send_artifacts")
+async def send_artifacts(
+    update: Update, artifact_sink: engine_modules.ArtifactPrefetchSink | None
+):
+    """Sends the artifacts the agent created: images as photos, anything else as documents."""
+    if not artifact_sink:
+        return
+    try:
+        if not update.effective_message:
+            return
+        for filename, task in artifact_sink.tasks.items():
+            try:
+                artifact = await task
+                if not artifact:
+                    continue
+                data, mime_type = artifact
+                if mime_type in ["image/png", "image/jpeg", "image/webp"]:
+                    await update.effective_message.reply_photo(photo=data, filename=filename)
+                else:
+                    await update.effective_message.reply_document(
+                        document=data, filename=filename
+                    )
+            except Exception as e:
+                logger.error(f"Error sending artifact '{filename}': {e}")
+    finally:
+        artifact_sink.cancel()
 
 
+@logging_modules.with_request_id
+@tracing_modules.traced("telegram.process_message_for_context", root=True)
 async def process_message_for_context(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    updates: List[Update] | None = None,
 ):
     """
     Silently sends a message to the agent engine for context-building.
@@ -370,7 +518,7 @@ async def process_message_for_context(
     if not update.effective_message:
         return
 
-    event_info = await get_event_info(update, context)
+    event_info = await get_event_info(update, context, updates)
     try:
         session_id = await get_session_id(event_info["session_user_id"])
 
@@ -381,6 +529,7 @@ async def process_message_for_context(
             author=event_info["display_name"],
             message=event_info["enriched_message"],
             file_list=event_info.get("files_attached", []),
+            artifact_service=artifact_service,
         )
 
         logger.info(f"Processed message for context in chat {event_info['chat_id']}")
@@ -397,7 +546,7 @@ async def process_message_for_context(
             except Exception as delete_e:
                 logger.error(f"Error deleting invalid session: {delete_e}")
             logger.info("Session not found, creating a new one and retrying...")
-            await process_message_for_context(update, context)  # Recurse
+            await process_message_for_context(update, context, updates)  # Recurse
             return  # Important to exit after recursion
 
 
@@ -527,6 +676,55 @@ async def save_session_command(update: Update, context: ContextTypes.DEFAULT_TYP
 
 
 # --- Message Handler ---
+async def usage_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Token usage report. Admins see every chat, everyone else only this one."""
+    if not update.effective_chat or not update.effective_message:
+        return
+    try:
+        group_by, days = usage_modules.parse_usage_args(context.args or [])
+    except ValueError as e:
+        await update.effective_message.reply_text(str(e))
+        return
+    user_id = str(update.effective_user.id) if update.effective_user else ""
+    chat_id = None if user_id in config.ADMIN_IDS else str(update.effective_chat.id)
+    rows = await asyncio.to_thread(
+        usage_modules.summarize, group_by, days, channel=chat_id
+    )
+    report = usage_modules.format_report(rows, group_by, days)
+    await update.effective_message.reply_text(
+        f"<pre>{html.escape(report)}</pre>", parse_mode="HTML"
+    )
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Samples the bot's stacks for N seconds and sends the collapsed-stack file. Admins only."""
+    if not update.effective_message:
+        return
+    user_id = str(update.effective_user.id) if update.effective_user else ""
+    if not config.PROFILING_ENABLED or user_id not in config.ADMIN_IDS:
+        await update.effective_message.reply_text("Profiling is not available.")
+        return
+    try:
+        seconds = profiling_modules.parse_profile_args(context.args or [])
+    except ValueError as e:
+        await update.effective_message.reply_text(str(e))
+        return
+    await update.effective_message.reply_text(f"Profiling for {seconds:g} s...")
+    # Sampled from a worker thread, so the event loop keeps serving updates meanwhile
+    path = await asyncio.to_thread(profiling_modules.run_profile, seconds)
+    if path is None:
+        await update.effective_message.reply_text("A profile is already running.")
+        return
+    summary = profiling_modules.summarize_profile(path)
+    with open(path, "rb") as f:
+        await update.effective_message.reply_document(
+            document=f,
+            filename=os.path.basename(path),
+            caption=f"<pre>{html.escape(summary[:900])}</pre>",
+            parse_mode="HTML",
+        )
+
+
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles incoming messages and routes them."""
     message = update.effective_message
@@ -539,40 +737,110 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if message.from_user and message.from_user.is_bot:
         return
 
+    # Albums arrive as one update per item: collect them and route once
+    if message.media_group_id:
+        group_key = f"{chat.id}:{message.media_group_id}"
+        group_updates = media_groups.setdefault(group_key, [])
+        group_updates.append(update)
+        media_group_last_seen[group_key] = time.monotonic()
+        if len(group_updates) == 1:
+            context.application.create_task(flush_media_group(group_key, context))
+        return
+
+    await route_message(update, context)
+
+
+async def flush_media_group(group_key: str, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Waits for the rest of an album to arrive, then routes it as a single message.
+    The window restarts with each item, so it ends TELEGRAM_MEDIA_GROUP_WINDOW
+    after the last one.
+    """
+    while True:
+        remaining = (
+            media_group_last_seen.get(group_key, 0)
+            + config.TELEGRAM_MEDIA_GROUP_WINDOW
+            - time.monotonic()
+        )
+        if remaining <= 0:
+            break
+        await asyncio.sleep(remaining)
+    media_group_last_seen.pop(group_key, None)
+    group_updates = media_groups.pop(group_key, [])
+    if not group_updates:
+        return
+    # Route on the item carrying the caption, so group mentions are detected
+    primary_update = next(
+        (u for u in group_updates if u.effective_message and u.effective_message.caption),
+        group_updates[0],
+    )
+    logger.info(f"Received media group with {len(group_updates)} items")
+    await route_message(primary_update, context, group_updates)
+
+
+async def route_message(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    updates: List[Update] | None = None,
+):
+    """Replies to private messages and group mentions; everything else is context."""
+    message = update.effective_message
+    chat = update.effective_chat
+    if not message or not chat:
+        return
+
     bot = await context.bot.get_me()
+    message_text = message.text or message.caption
 
     # Route based on chat type
     if chat.type == "private":
         logger.info("Received private message, processing for reply...")
-        await query_agent_and_reply(update, context)
+        metrics_modules.requests_total.inc(frontend="telegram", route="dm")
+        await query_agent_and_reply(update, context, updates)
 
     elif chat.type in ["group", "supergroup", "channel"]:
         # In groups, reply only on mention. In channels, always process for context.
         if (
-            message.text
-            and f"@{bot.username}" in message.text
+            message_text
+            and f"@{bot.username}" in message_text
             and chat.type != "channel"
         ):
             logger.info("Received group mention, processing for reply...")
-            await query_agent_and_reply(update, context)
+            metrics_modules.requests_total.inc(frontend="telegram", route="mention")
+            await query_agent_and_reply(update, context, updates)
         else:
             logger.info(f"Received {chat.type} message, processing for context...")
-            await process_message_for_context(update, context)
+            metrics_modules.requests_total.inc(frontend="telegram", route="context")
+            await process_message_for_context(update, context, updates)
 
 
 # --- Main Application Setup ---
+async def start_loop_watch(app):
+    profiling_modules.watch_event_loop()
+
+
 def main():
     """Sets up and runs the Telegram bot."""
     if not TELEGRAM_TOKEN:
         logger.error("TELEGRAM_BOT_TOKEN is not set. Exiting.")
         return
 
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+    app = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .post_init(start_loop_watch)
+        .build()
+    )
+    metrics_modules.start_metrics_server()
+    profiling_modules.install_signal_handler()
 
     # Command handlers
     app.add_handler(CommandHandler("delete_session", delete_session_command))
     app.add_handler(CommandHandler("save_session", save_session_command))
     app.add_handler(CommandHandler("create_session", create_session_command))
+    app.add_handler(CommandHandler("usage", usage_command))
+    app.add_handler(CommandHandler("profile", profile_command))
 
     # # Callback query handler for buttons
     # app.add_handler(CallbackQueryHandler(button_handler, pattern=r"^tool_confirm:"))
@@ -0,0 +1,17 @@
+import os
+import tempfile
+
+# Set before config is imported: tests never reach Google Cloud, and caches and
+# the usage database go to a scratch directory
+_run_dir = tempfile.mkdtemp(prefix="agent_interface_tests_")
+os.environ.update(
+    {
+        "AGENT_ENGINE_FAKE": "true",
+        "APP_NAME": "agent_interface_tests",
+        "ATTACHMENT_CACHE_DIR": os.path.join(_run_dir, "attachments"),
+        "ARTIFACT_CACHE_DIR": os.path.join(_run_dir, "artifacts"),
+        "USAGE_DB_PATH": os.path.join(_run_dir, "usage.sqlite3"),
+        "METRICS_PORT": "0",
+        "TRACE_EXPORTER": "",
+    }
+)
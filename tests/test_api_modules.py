@@ -0,0 +1,63 @@
+import api_modules
+
+
+def user_event(text):
+    return {"author": "user", "content": {"role": "user", "parts": [{"text": text}]}}
+
+
+def test_session_to_messages_maps_each_part_kind():
+    session = {
+        "output": {
+            "events": [
+                user_event("hi"),
+                {
+                    "author": "root_agent",
+                    "content": {
+                        "role": "model",
+                        "parts": [
+                            {"text": "pondering", "thought": True},
+                            {"function_call": {"name": "search", "args": {"q": "x"}}},
+                            {"function_response": {"name": "search", "response": {"n": 1}}},
+                            {"text": "hello"},
+                        ],
+                    },
+                },
+            ]
+        }
+    }
+
+    messages = api_modules.session_to_messages(session)
+
+    assert [(m["role"], m["type"]) for m in messages] == [
+        ("user", "response"),
+        ("thought", "thought"),
+        ("thought", "tool_call"),
+        ("thought", "tool_response"),
+        ("assistant", "response"),
+    ]
+    assert messages[0]["content"] == "hi"
+    assert messages[1]["content"] == "root_agent's thought: pondering"
+    assert (messages[2]["label"], messages[2]["content"]) == ("search", {"q": "x"})
+    assert (messages[3]["label"], messages[3]["content"]) == ("search", {"n": 1})
+    assert messages[4]["content"] == "root_agent: hello"
+
+
+def test_session_to_messages_skips_validator_and_empty_events():
+    session = {
+        "events": [
+            user_event("hi"),
+            {
+                "author": "answer_validator_agent",
+                "content": {"role": "model", "parts": [{"text": "ok"}]},
+            },
+            {"author": "root_agent", "content": None},
+            {"author": "root_agent", "content": {"role": "model", "parts": []}},
+        ]
+    }
+
+    assert [m["content"] for m in api_modules.session_to_messages(session)] == ["hi"]
+
+
+def test_session_to_messages_accepts_a_session_without_events():
+    assert api_modules.session_to_messages({"output": {"events": None}}) == []
+    assert api_modules.session_to_messages({}) == []
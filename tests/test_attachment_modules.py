@@ -0,0 +1,226 @@
+import io
+
+import pytest
+
+import attachment_modules
+import config
+from attachment_modules import AttachmentRejectedError, PreallocatedBuffer
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4
+MB = 1024 * 1024
+
+
+@pytest.fixture(autouse=True)
+def no_offload(monkeypatch):
+    monkeypatch.setattr(config, "ATTACHMENT_OFFLOAD_THRESHOLD_BYTES", 0)
+
+
+# --- get_rejection_reason ---
+def test_rejection_accepts_supported_types():
+    assert attachment_modules.get_rejection_reason(1024, "image/png") is None
+    assert attachment_modules.get_rejection_reason(1024, "pdf") is None
+    assert attachment_modules.get_rejection_reason(None, "text/plain") is None
+
+
+def test_rejection_refuses_oversized_files():
+    reason = attachment_modules.get_rejection_reason(21 * MB, "image/png")
+    assert reason.startswith("Size (21.00 MB) exceeds 20 MB")
+
+
+def test_rejection_honours_explicit_max_size():
+    assert attachment_modules.get_rejection_reason(2048, "image/png", max_size=1024)
+    assert attachment_modules.get_rejection_reason(21 * MB, "image/png", max_size=50 * MB) is None
+
+
+def test_rejection_refuses_unsupported_types():
+    reason = attachment_modules.get_rejection_reason(1024, "application/zip")
+    assert "Unsupported MIME type 'application/zip'" in reason
+
+
+def test_rejection_defers_generic_types_to_content():
+    assert attachment_modules.get_rejection_reason(1024, "application/octet-stream") is None
+    assert attachment_modules.get_rejection_reason(1024, None, file_name="archive.zip") is None
+
+
+# --- classify_file ---
+@pytest.mark.parametrize(
+    "file_name, declared, head, expected",
+    [
+        ("chart.png", "image/png", PNG, "image/png"),
+        ("chart", "application/octet-stream", PNG, "image/png"),
+        ("notes.txt", "text/plain", "Grüße\n".encode("utf-8"), "text/plain"),
+        ("notes", None, b"plain words\n", "text/plain"),
+        # Excel's CSV export on Windows
+        ("report.csv", "text/csv", "Größe;Preis\n12;3,50 €\n".encode("cp1252"), "text/plain"),
+        ("notes.txt", None, "Grüße\n".encode("utf-16"), "text/plain"),
+        ("notes.txt", "text/plain", "Grüße\n".encode("utf-16-be"), None),
+        ("empty.txt", "text/plain", b"", "text/plain"),
+        ("empty.txt", None, b"", "text/plain"),
+        ("empty", None, b"", None),
+        # Declared as an image, but not one
+        ("chart.png", "image/png", b"plain words\n", None),
+        ("report.csv", "text/csv", b"\x01\x00\x02\x00", None),
+        ("data.bin", "application/octet-stream", "Größe".encode("cp1252"), None),
+    ],
+)
+def test_classify_file(file_name, declared, head, expected):
+    assert attachment_modules.classify_file(file_name, declared, head) == expected
+
+
+def test_empty_text_file_passes_the_buffer():
+    buffer = PreallocatedBuffer(0, file_name="empty.txt", provided_file_type="text/plain")
+    assert buffer.getvalue() == b""
+    assert buffer.mime_type == "text/plain"
+
+
+@pytest.mark.parametrize(
+    "encoding", ["utf-8", "utf-8-sig", "utf-16", "utf-32", "cp1252"]
+)
+def test_decode_text(encoding):
+    text = "Größe;Preis\n12;3,50\n"
+    assert attachment_modules.decode_text(text.encode(encoding)) == text
+
+
+def test_csv_summary_reads_cp1252(monkeypatch):
+    monkeypatch.setattr(config, "CSV_SAMPLE_ROWS", 5)
+    summary = attachment_modules.summarize_csv("Größe,Preis\n12,3.5\n".encode("cp1252"))
+    assert "Columns: Größe (int), Preis (float)" in summary
+
+
+# --- PreallocatedBuffer ---
+def test_buffer_collects_chunks_in_place():
+    buffer = PreallocatedBuffer(len(PNG), file_name="chart.png", provided_file_type="image/png")
+    for i in range(0, len(PNG), 100):
+        buffer.write(PNG[i : i + 100])
+    value = buffer.getvalue()
+    assert value == PNG
+    assert isinstance(value, bytearray)
+    assert buffer.mime_type == "image/png"
+
+
+def test_buffer_grows_when_reported_size_is_wrong():
+    buffer = PreallocatedBuffer(10, file_name="chart.png", provided_file_type="image/png")
+    buffer.write(PNG[:600])
+    buffer.write(PNG[600:])
+    assert buffer.getvalue() == PNG
+
+
+def test_buffer_trims_when_reported_size_is_too_large():
+    buffer = PreallocatedBuffer(len(PNG) + 500, file_name="chart.png", provided_file_type="image/png")
+    buffer.write(PNG)
+    assert buffer.getvalue() == PNG
+
+
+def test_buffer_rejects_downloads_over_the_limit():
+    buffer = PreallocatedBuffer(None, max_size=1000, file_name="chart.png", provided_file_type="image/png")
+    buffer.write(PNG[:600])
+    with pytest.raises(AttachmentRejectedError, match="exceeds"):
+        buffer.write(PNG[600:])
+
+
+def test_buffer_rejects_mismatched_content_after_the_first_bytes():
+    buffer = PreallocatedBuffer(4096, file_name="chart.png", provided_file_type="image/png")
+    with pytest.raises(AttachmentRejectedError, match="doesn't match"):
+        buffer.write(b"\x00\x01\x02" * 200)
+
+
+def test_buffer_classifies_short_files_on_getvalue():
+    buffer = PreallocatedBuffer(None, file_name="notes.txt", provided_file_type="text/plain")
+    buffer.write(b"short note")
+    assert buffer.getvalue() == b"short note"
+    assert buffer.mime_type == "text/plain"
+
+
+# --- downscale_image ---
+def make_image(size, format, **save_options) -> bytes:
+    from PIL import Image
+
+    output = io.BytesIO()
+    Image.effect_noise(size, 64).convert("RGB").save(output, format=format, **save_options)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize("image_format", ["PNG", "WEBP"])
+def test_downscale_drops_icc_profiles(monkeypatch, image_format):
+    pytest.importorskip("PIL")
+    from PIL import Image, ImageCms
+
+    icc = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    original = make_image((800, 600), image_format, icc_profile=icc)
+    monkeypatch.setattr(config, "IMAGE_MAX_SIDE_PX", 200)
+    monkeypatch.setattr(config, "IMAGE_FORMAT", image_format)
+
+    processed, mime_type = attachment_modules.downscale_image(original, "image/png")
+    with Image.open(io.BytesIO(processed)) as image:
+        assert max(image.size) == 200
+        assert "icc_profile" not in image.info
+    assert mime_type == attachment_modules.IMAGE_FORMAT_MIME_TYPES[image_format]
+
+
+def test_downscale_keeps_the_original_when_not_smaller(monkeypatch):
+    pytest.importorskip("PIL")
+    original = make_image((64, 64), "JPEG", quality=20)
+    monkeypatch.setattr(config, "IMAGE_MAX_SIDE_PX", 4096)
+    monkeypatch.setattr(config, "IMAGE_FORMAT", "PNG")
+    assert attachment_modules.downscale_image(original, "image/jpeg") is None
+
+
+# --- summarize_csv ---
+def test_csv_summary_keeps_quoted_newlines_in_one_row(monkeypatch):
+    monkeypatch.setattr(config, "CSV_SAMPLE_ROWS", 2)
+    data = (
+        b'id,note,amount\n'
+        b'1,"first line\nsecond line",3.5\n'
+        b'2,plain,4\n'
+        b'\n'
+        b'3,"a, b",5\n'
+        b'4,"x\ny\nz",6\n'
+        b'5,last,7\n'
+    )
+    summary = attachment_modules.summarize_csv(data)
+    lines = summary.split("\n")
+    assert lines[0] == "Rows: 5, columns: 3"
+    assert lines[1] == "Columns: id (int), note (text), amount (float)"
+    assert 'First 2 rows:\nid,note,amount\n1,"first line\nsecond line",3.5\n2,plain,4' in summary
+    assert 'Last 2 rows:\nid,note,amount\n4,"x\ny\nz",6\n5,last,7' in summary
+
+
+def test_csv_summary_of_a_short_file_has_no_tail(monkeypatch):
+    monkeypatch.setattr(config, "CSV_SAMPLE_ROWS", 20)
+    summary = attachment_modules.summarize_csv(b"a,b\n1,2\n")
+    assert summary == "Rows: 1, columns: 2\nColumns: a (int), b (int)\nFirst 1 rows:\na,b\n1,2"
+
+
+# --- Optional libraries ---
+@pytest.fixture
+def missing_libraries(monkeypatch):
+    monkeypatch.setattr(attachment_modules, "Image", None)
+    monkeypatch.setattr(attachment_modules, "PdfReader", None)
+    attachment_modules.warn_missing_library.cache_clear()
+    yield
+    attachment_modules.warn_missing_library.cache_clear()
+
+
+def test_enabled_features_warn_once_when_their_library_is_missing(
+    missing_libraries, monkeypatch, caplog
+):
+    monkeypatch.setattr(config, "IMAGE_MAX_SIDE_PX", 1024)
+    monkeypatch.setattr(config, "DOCUMENT_EXTRACTION_ENABLED", True)
+    monkeypatch.setattr(config, "DOCUMENT_EXTRACTION_MIN_BYTES", 0)
+    for _ in range(3):
+        assert not attachment_modules.should_downscale_image(MB, "image/png")
+        assert attachment_modules.get_document_kind("report.pdf", "application/pdf", MB) is None
+    warnings = [r.getMessage() for r in caplog.records if r.levelname == "WARNING"]
+    assert len(warnings) == 2
+    assert warnings[0].startswith("IMAGE_MAX_SIDE_PX is set, but Pillow is not installed")
+    assert warnings[1].startswith("DOCUMENT_EXTRACTION_ENABLED is set, but pypdf is not installed")
+    # CSV summaries need no library
+    assert attachment_modules.get_document_kind("totals.csv", "text/csv", MB) == "csv"
+
+
+def test_disabled_features_dont_warn(missing_libraries, monkeypatch, caplog):
+    monkeypatch.setattr(config, "IMAGE_MAX_SIDE_PX", 0)
+    monkeypatch.setattr(config, "DOCUMENT_EXTRACTION_ENABLED", False)
+    assert not attachment_modules.should_downscale_image(MB, "image/png")
+    assert attachment_modules.get_document_kind("report.pdf", "application/pdf", MB) is None
+    assert caplog.records == []
@@ -0,0 +1,83 @@
+import os
+
+from cache_modules import DiskLRUCache, content_digest
+
+
+def test_digest_is_sha256_hex():
+    assert content_digest(b"") == "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855"
+
+
+def test_get_returns_what_was_put(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), 1024)
+    cache.put("abc", "uri", b"gs://bucket/attachments/abc")
+    assert cache.get("abc", "uri") == b"gs://bucket/attachments/abc"
+    assert cache.get("abc", "img") is None
+    assert cache.get("missing", "uri") is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), 300)
+    cache.put("a", "x", b"1" * 100)
+    cache.put("b", "x", b"2" * 100)
+    cache.put("c", "x", b"3" * 100)
+    cache.get("a", "x")  # now more recent than b
+    cache.put("d", "x", b"4" * 100)
+    assert cache.get("b", "x") is None
+    assert not (tmp_path / "b.x").exists()
+    assert cache.get("a", "x") == b"1" * 100
+    assert cache.get("d", "x") == b"4" * 100
+
+
+def test_overwriting_an_entry_counts_its_size_once(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), 250)
+    cache.put("a", "x", b"1" * 100)
+    cache.put("a", "x", b"1" * 100)
+    cache.put("b", "x", b"2" * 100)
+    assert cache.get("a", "x") is not None
+    assert cache.get("b", "x") is not None
+
+
+def test_entries_larger_than_the_cache_are_not_stored(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), 100)
+    cache.put("a", "x", b"1" * 101)
+    assert cache.get("a", "x") is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_entries_survive_a_restart_in_lru_order(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), 300)
+    cache.put("a", "x", b"1" * 100)
+    cache.put("b", "x", b"2" * 100)
+    os.utime(tmp_path / "a.x", (1, 1))
+    os.utime(tmp_path / "b.x", (2, 2))
+    restarted = DiskLRUCache(str(tmp_path), 150)
+    assert restarted.get("a", "x") is None
+    assert restarted.get("b", "x") == b"2" * 100
+
+
+def test_leftover_temporary_files_are_ignored(tmp_path):
+    (tmp_path / "a.x.1234.tmp").write_bytes(b"half written")
+    cache = DiskLRUCache(str(tmp_path), 100)
+    assert cache.get("a", "x") is None
+    cache.put("b", "x", b"2" * 100)
+    assert cache.get("b", "x") == b"2" * 100
+
+
+def test_entry_deleted_behind_the_cache_is_forgotten(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), 200)
+    cache.put("a", "x", b"1" * 100)
+    os.remove(tmp_path / "a.x")
+    assert cache.get("a", "x") is None
+    # Its size no longer counts towards the limit
+    cache.put("b", "x", b"2" * 100)
+    cache.put("c", "x", b"3" * 100)
+    assert cache.get("b", "x") is not None
+    assert cache.get("c", "x") is not None
+
+
+def test_truncated_entry_is_dropped(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), 200)
+    cache.put("a", "img", b"1" * 100)
+    (tmp_path / "a.img").write_bytes(b"1" * 40)
+    assert cache.get("a", "img") is None
+    assert not (tmp_path / "a.img").exists()
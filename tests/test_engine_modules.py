@@ -0,0 +1,142 @@
+import asyncio
+
+import pytest
+
+import cache_modules
+import config
+import engine_modules
+
+
+@pytest.fixture
+def image_cache(monkeypatch, tmp_path):
+    cache = cache_modules.DiskLRUCache(str(tmp_path), 10 * 1024 * 1024)
+    monkeypatch.setattr(engine_modules, "attachment_cache", cache)
+    monkeypatch.setattr(config, "IMAGE_MAX_SIDE_PX", 1024)
+    monkeypatch.setattr(config, "IMAGE_MIN_BYTES", 0)
+    monkeypatch.setattr(engine_modules.attachment_modules, "Image", object())
+    calls = []
+
+    def downscale_image(file_content, mime_type):
+        calls.append(file_content)
+        return downscale_image.result
+
+    monkeypatch.setattr(engine_modules.attachment_modules, "downscale_image", downscale_image)
+    return downscale_image, calls
+
+
+def test_images_not_made_smaller_are_decoded_once(image_cache):
+    downscale_image, calls = image_cache
+    downscale_image.result = None
+    original = b"\xff\xd8\xff" + b"\x00" * 1000
+    for _ in range(3):
+        assert engine_modules.preprocess_attachment(original, "image/jpeg") == (
+            original,
+            "image/jpeg",
+        )
+    assert calls == [original]
+
+
+def test_downscaled_images_are_served_from_the_cache(image_cache):
+    downscale_image, calls = image_cache
+    downscale_image.result = (b"small", "image/jpeg")
+    original = b"\x89PNG\r\n\x1a\n" + b"\x00" * 1000
+    for _ in range(2):
+        assert engine_modules.preprocess_attachment(original, "image/png") == (
+            b"small",
+            "image/jpeg",
+        )
+    assert calls == [original]
+
+
+def test_extracted_documents_keep_their_original_as_artifact(monkeypatch):
+    monkeypatch.setattr(config, "DOCUMENT_EXTRACTION_ENABLED", True)
+    monkeypatch.setattr(config, "DOCUMENT_EXTRACTION_MIN_BYTES", 0)
+    monkeypatch.setattr(config, "ATTACHMENT_OFFLOAD_THRESHOLD_BYTES", 0)
+    monkeypatch.setattr(engine_modules, "attachment_cache", None)
+    artifact_service = engine_modules.get_artifact_service()
+    content = b"region,total\nnorth,10\nsouth,20\n"
+
+    message = asyncio.run(
+        engine_modules.prepare_message_dict_async(
+            "Summarize",
+            [{"name": "totals.csv", "mime_type": "text/csv", "content": content, "size": len(content)}],
+            artifact_service=artifact_service,
+            session_id="s1",
+            user_id="u1",
+        )
+    )
+
+    assert message["parts"][1]["text"].startswith(
+        "[Attached file 'totals.csv', CSV summary; original saved as artifact 'totals.csv']"
+    )
+    artifact = asyncio.run(
+        artifact_service.load_artifact(
+            app_name=config.APP_NAME, user_id="u1", session_id="s1", filename="totals.csv"
+        )
+    )
+    assert artifact.inline_data.data == content
+    assert artifact.inline_data.mime_type == "text/csv"
+
+
+def test_artifact_prefetch_keeps_only_the_latest_version(monkeypatch):
+    loads = {}
+
+    async def load_artifact_cached(version, **kwargs):
+        loads[version] = asyncio.Event()
+        await loads[version].wait()
+        return b"v%d" % version, "text/plain"
+
+    monkeypatch.setattr(engine_modules, "load_artifact_cached", load_artifact_cached)
+
+    async def run():
+        sink = engine_modules.ArtifactPrefetchSink(None, "s1", "u1")
+        sink.on_artifact_delta(engine_modules.stream_events.ArtifactDelta("agent", "a.csv", 0))
+        first = sink.tasks["a.csv"]
+        await asyncio.sleep(0)
+        sink.on_artifact_delta(engine_modules.stream_events.ArtifactDelta("agent", "a.csv", 1))
+        sink.on_artifact_delta(engine_modules.stream_events.ArtifactDelta("agent", "b.csv", 0))
+        await asyncio.sleep(0)
+        loads[1].set()
+        latest = await sink.tasks["a.csv"]
+        pending = sink.tasks["b.csv"]
+        sink.cancel()
+        await asyncio.sleep(0)
+        return first, latest, pending
+
+    first, latest, pending = asyncio.run(run())
+    assert first.cancelled()
+    assert latest == (b"v1", "text/plain")
+    assert pending.cancelled()
+
+
+def test_context_event_keeps_the_files_that_were_saved():
+    class FlakyArtifactService(engine_modules.fake_engine_modules.InMemoryArtifactService):
+        async def save_artifact(self, *, filename, **kwargs):
+            if filename == "broken.csv":
+                raise RuntimeError("bucket unavailable")
+            return await super().save_artifact(filename=filename, **kwargs)
+
+    session_service = engine_modules.get_session_service()
+
+    async def run():
+        session_id = await engine_modules.create_session(session_service, user_id="u2")
+        await engine_modules.update_session(
+            session_service=session_service,
+            session_id=session_id,
+            user_id="u2",
+            message="Earlier in the thread",
+            file_list=[
+                {"name": name, "mime_type": "text/csv", "content": b"a,b\n1,2\n", "size": 8}
+                for name in ("broken.csv", "totals.csv")
+            ],
+            artifact_service=FlakyArtifactService(),
+        )
+        return await engine_modules.get_session(
+            session_service=session_service, user_id="u2", session_id=session_id
+        )
+
+    session = asyncio.run(run())
+    texts = [part.text for part in session.events[-1].content.parts]
+    assert texts[0] == "Earlier in the thread"
+    assert len(texts) == 2
+    assert "totals.csv" in texts[1]
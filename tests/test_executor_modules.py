@@ -0,0 +1,40 @@
+import asyncio
+import threading
+
+import pytest
+
+import config
+import executor_modules
+
+
+def where(*args, **kwargs):
+    return threading.current_thread().name, args, kwargs
+
+
+def run(**options):
+    return asyncio.run(executor_modules.run_blocking(where, 1, key="v", **options))
+
+
+def test_small_payloads_run_inline():
+    name, args, kwargs = run(payload_bytes=config.EXECUTOR_INLINE_MAX_BYTES - 1)
+    assert name == threading.current_thread().name
+    assert (args, kwargs) == ((1,), {"key": "v"})
+
+
+def test_payloads_from_the_threshold_up_run_in_the_pool():
+    name, args, kwargs = run(payload_bytes=config.EXECUTOR_INLINE_MAX_BYTES)
+    assert name.startswith("attachments")
+    assert (args, kwargs) == ((1,), {"key": "v"})
+
+
+def test_network_calls_run_in_the_pool_whatever_their_size():
+    name, _, _ = run(payload_bytes=0, network=True)
+    assert name.startswith("attachments")
+
+
+def test_pool_errors_reach_the_caller():
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError, match="boom"):
+        asyncio.run(executor_modules.run_blocking(fail, network=True))
@@ -0,0 +1,217 @@
+import asyncio
+import socket
+import sys
+import threading
+
+import pytest
+import requests
+
+import fake_engine_modules
+import json_modules
+from fake_engine_modules import FakeAgentApp, FakeEngineSettings, FakeSessionService
+
+APP_NAME = "fake_engine_tests"
+
+
+def make_app(**settings) -> FakeAgentApp:
+    settings = {
+        "answer_tokens": 12,
+        "first_token_delay_ms": 0,
+        "tokens_per_second": 0,
+        "tool_calls": 0,
+        "tool_latency_ms": 0,
+        "session_404_rate": 0,
+        "rate_limit_rate": 0,
+        "stream_drop_rate": 0,
+        "seed": 1,
+        **settings,
+    }
+    return FakeAgentApp(FakeSessionService(), FakeEngineSettings(**settings), app_name=APP_NAME)
+
+
+def create_session(agent_app: FakeAgentApp) -> str:
+    session = asyncio.run(
+        agent_app.session_service.create_session(app_name=APP_NAME, user_id="u1")
+    )
+    return session.id
+
+
+async def collect(agent_app: FakeAgentApp, session_id: str, message="What is up?") -> list[dict]:
+    return [
+        event
+        async for event in agent_app.async_stream_query(
+            user_id="u1", session_id=session_id, message=message
+        )
+    ]
+
+
+# --- In process ---
+def test_answer_streams_in_chunks_with_usage_on_the_last_event():
+    agent_app = make_app(tool_calls=1)
+    session_id = create_session(agent_app)
+    events = asyncio.run(collect(agent_app, session_id, "What is up?"))
+
+    parts = [event["content"]["parts"][0] for event in events]
+    assert "function_call" in parts[0] and "function_response" in parts[1]
+    text = "".join(part["text"] for part in parts[2:])
+    assert text.startswith("Echo: What is up? ")
+    assert len(text.split()) == 12
+    assert [i for i, event in enumerate(events) if "usage_metadata" in event] == [len(events) - 1]
+    assert events[-1]["usage_metadata"] == {
+        "prompt_token_count": len("What is up?") // 4,
+        "candidates_token_count": 12,
+        "total_token_count": len("What is up?") // 4 + 12,
+    }
+    assert {event["author"] for event in events} == {fake_engine_modules.AGENT_NAME}
+
+    session = asyncio.run(
+        agent_app.session_service.get_session(
+            app_name=APP_NAME, user_id="u1", session_id=session_id
+        )
+    )
+    assert [event.author for event in session.events] == ["user", fake_engine_modules.AGENT_NAME]
+    assert session.events[1].content.parts[0].text == text
+
+
+def test_attachments_count_towards_prompt_tokens():
+    message = {
+        "parts": [{"text": "12345678"}, {"inline_data": {"mime_type": "image/png", "data": ""}}]
+    }
+    assert fake_engine_modules._message_text(message) == ("12345678", 2 + 258)
+
+
+def test_expired_session_raises_a_vertex_style_404_and_is_gone():
+    agent_app = make_app(session_404_rate=1)
+    session_id = create_session(agent_app)
+    with pytest.raises(fake_engine_modules.errors.ClientError) as error:
+        asyncio.run(collect(agent_app, session_id))
+    assert error.value.code == 404
+    assert str(error.value).startswith("404 NOT_FOUND") and "sessionId" in str(error.value)
+    with pytest.raises(fake_engine_modules.errors.ClientError):
+        asyncio.run(collect(make_app(), session_id))
+
+
+def test_rate_limit_raises_429():
+    agent_app = make_app(rate_limit_rate=1)
+    with pytest.raises(fake_engine_modules.errors.ClientError) as error:
+        asyncio.run(collect(agent_app, create_session(agent_app)))
+    assert error.value.code == 429
+
+
+def test_dropped_stream_breaks_off_halfway():
+    agent_app = make_app(answer_tokens=40, stream_drop_rate=1)
+    session_id = create_session(agent_app)
+    received = []
+
+    async def run():
+        async for event in agent_app.async_stream_query(
+            user_id="u1", session_id=session_id, message="hi"
+        ):
+            received.append(event)
+
+    with pytest.raises(fake_engine_modules.StreamDropped):
+        asyncio.run(run())
+    assert len(received) == 4  # 8 chunks of 5 words, cut at the 5th
+    assert not any("usage_metadata" in event for event in received)
+
+
+def test_failure_draws_follow_the_seed():
+    first, second = FakeEngineSettings(seed=7), FakeEngineSettings(seed=7)
+    assert [first.draw(0.5) for _ in range(20)] == [second.draw(0.5) for _ in range(20)]
+    assert not any(first.draw(0) for _ in range(20))
+
+
+# --- Over HTTP ---
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(agent_app: FakeAgentApp) -> str:
+        server = fake_engine_modules.start_fake_server(port=0, agent_app=agent_app)
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}/v1/reasoningEngines/fake"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def query(url: str, method: str, **args) -> requests.Response:
+    return requests.post(f"{url}:query", json={"class_method": method, "input": args}, timeout=5)
+
+
+def stream_query(url: str, session_id: str, **kwargs) -> requests.Response:
+    return requests.post(
+        f"{url}:streamQuery?alt=sse",
+        json={"input": {"user_id": "u1", "session_id": session_id, "message": "hi"}},
+        stream=True,
+        timeout=5,
+        **kwargs,
+    )
+
+
+def test_http_sessions_and_ndjson_stream(serve):
+    url = serve(make_app(tool_calls=1))
+    session = query(url, "create_session", user_id="u1").json()["output"]
+    sessions = query(url, "list_sessions", user_id="u1").json()["output"]["sessions"]
+    assert [s["id"] for s in sessions] == [session["id"]]
+
+    with stream_query(url, session["id"]) as response:
+        assert response.status_code == 200
+        events = [json_modules.loads(line) for line in response.iter_lines() if line]
+    assert "function_call" in events[0]["content"]["parts"][0]
+    assert events[-1]["usage_metadata"]["candidates_token_count"] == 12
+
+    stored = query(url, "get_session", user_id="u1", session_id=session["id"]).json()["output"]
+    assert len(stored["events"]) == 2
+
+
+def test_http_errors_before_the_stream_are_status_codes(serve):
+    agent_app = make_app(session_404_rate=1)
+    url = serve(agent_app)
+    session_id = create_session(agent_app)
+    with stream_query(url, session_id) as response:
+        assert response.status_code == 404
+        assert response.json()["error"]["status"] == "NOT_FOUND"
+    assert query(url, "get_session", user_id="u1", session_id=session_id).status_code == 404
+    assert query(url, "no_such_method").status_code == 400
+
+
+def test_http_dropped_stream_has_no_terminating_chunk(serve):
+    agent_app = make_app(answer_tokens=40, stream_drop_rate=1)
+    url = serve(agent_app)
+    with stream_query(url, create_session(agent_app)) as response:
+        with pytest.raises(requests.exceptions.ChunkedEncodingError):
+            list(response.iter_lines())
+
+
+def test_http_client_disconnect_mid_stream_is_not_an_error(serve, monkeypatch):
+    server_errors = []
+    handled = threading.Event()
+    shutdown_request = fake_engine_modules.ThreadingHTTPServer.shutdown_request
+
+    def record_error(self, request, client_address):
+        server_errors.append(sys.exc_info()[1])
+
+    def record_done(self, request):
+        shutdown_request(self, request)
+        handled.set()  # after handle_error, if the handler raised
+
+    monkeypatch.setattr(fake_engine_modules.ThreadingHTTPServer, "handle_error", record_error)
+    monkeypatch.setattr(fake_engine_modules.ThreadingHTTPServer, "shutdown_request", record_done)
+    agent_app = make_app(answer_tokens=2000, tokens_per_second=20000)
+    url = serve(agent_app)
+    body = json_modules.dumps(
+        {"input": {"user_id": "u1", "session_id": create_session(agent_app), "message": "hi"}}
+    )
+    host, port = url.split("/")[2].split(":")
+    with socket.create_connection((host, int(port)), timeout=5) as client:
+        client.sendall(
+            f"POST /v1/reasoningEngines/fake:streamQuery HTTP/1.1\r\nHost: {host}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode("ascii")
+            + body
+        )
+        assert client.recv(1024).startswith(b"HTTP/1.1 200")
+    assert handled.wait(5)
+    assert server_errors == []
@@ -0,0 +1,283 @@
+"""
+Attachment offloading to GCS. The emulator tests run against a local GCS
+emulator and are skipped without one, e.g.:
+
+    docker run -d -p 4443:4443 fsouza/fake-gcs-server -scheme http
+    STORAGE_EMULATOR_HOST=http://localhost:4443 python -m pytest tests/test_gcs_offload.py
+
+or, without Docker, `pip install gcp-storage-emulator` and
+`gcp-storage-emulator start --port=9023 --in-memory`. The in-memory bucket tests
+always run.
+"""
+import datetime
+import io
+import os
+import uuid
+
+import pytest
+
+import config
+import engine_modules
+
+PNG = b"\x89PNG\r\n\x1a\n" + os.urandom(64 * 1024)
+
+needs_emulator = pytest.mark.skipif(
+    not config.STORAGE_EMULATOR_HOST, reason="STORAGE_EMULATOR_HOST is not set"
+)
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    client = engine_modules.get_storage_client()
+    bucket = client.create_bucket(f"attachments-{uuid.uuid4().hex[:12]}")
+    monkeypatch.setattr(config, "GOOGLE_CLOUD_BUCKET", bucket.name)
+    monkeypatch.setattr(config, "ATTACHMENT_OFFLOAD_THRESHOLD_BYTES", 1024)
+    monkeypatch.setattr(config, "ATTACHMENT_RETENTION_DAYS", 0)
+    monkeypatch.setattr(engine_modules, "attachment_cache", None)
+    yield bucket
+    for blob in bucket.list_blobs():
+        blob.delete()
+    bucket.delete()
+
+
+@needs_emulator
+def test_upload_stores_content_under_its_digest(bucket):
+    uri = engine_modules.upload_attachment(PNG, "chart.png", "image/png")
+    name = f"attachments/{engine_modules.cache_modules.content_digest(PNG)}"
+    assert uri == f"gs://{bucket.name}/{name}"
+    blob = bucket.get_blob(name)
+    assert blob.download_as_bytes() == PNG
+    assert blob.content_type == "image/png"
+
+
+@needs_emulator
+def test_upload_of_known_content_returns_the_same_uri(bucket):
+    first = engine_modules.upload_attachment(PNG, "chart.png", "image/png")
+    second = engine_modules.upload_attachment(PNG, "copy.png", "image/png")
+    assert first == second
+    assert len(list(bucket.list_blobs())) == 1
+
+
+@needs_emulator
+def test_known_content_is_not_sent_again(bucket, monkeypatch):
+    engine_modules.upload_attachment(PNG, "chart.png", "image/png")
+    uploads = []
+    monkeypatch.setattr(
+        engine_modules.storage.Blob,
+        "upload_from_file",
+        lambda self, *args, **kwargs: uploads.append(self.name),
+    )
+    engine_modules.upload_attachment(PNG, "copy.png", "image/png")
+    assert uploads == []
+
+
+@needs_emulator
+def test_unreadable_cached_uri_falls_back_to_the_bucket(bucket, monkeypatch, tmp_path):
+    cache = engine_modules.cache_modules.DiskLRUCache(str(tmp_path), 1024)
+    monkeypatch.setattr(engine_modules, "attachment_cache", cache)
+    digest = engine_modules.cache_modules.content_digest(PNG)
+    cache.put(digest, "uri", b"gs://elsewhere/attachments/x not-a-time")
+    uri = engine_modules.upload_attachment(PNG, "chart.png", "image/png")
+    assert uri == f"gs://{bucket.name}/attachments/{digest}"
+
+
+@needs_emulator
+def test_upload_near_expiry_is_replaced(bucket, monkeypatch):
+    engine_modules.upload_attachment(PNG, "chart.png", "image/png")
+    monkeypatch.setattr(engine_modules, "is_upload_fresh", lambda uploaded_at: False)
+    engine_modules.upload_attachment(PNG, "chart.png", "image/png")
+    blobs = list(bucket.list_blobs())
+    assert len(blobs) == 1
+    assert blobs[0].download_as_bytes() == PNG
+
+
+@needs_emulator
+def test_prepare_message_dict_sends_large_files_as_uris(bucket):
+    message = engine_modules.prepare_message_dict(
+        "Describe this chart.",
+        [{"name": "chart.png", "mime_type": "image/png", "content": PNG, "size": len(PNG)}],
+    )
+    assert message["parts"][0] == {"text": "Describe this chart."}
+    file_data = message["parts"][1]["file_data"]
+    assert file_data["mime_type"] == "image/png"
+    assert file_data["file_uri"].startswith(f"gs://{bucket.name}/attachments/")
+
+
+# --- Lifecycle rule (no emulator needed) ---
+class StubBucket:
+    def __init__(self, rules):
+        self.lifecycle_rules = rules
+        self.added = []
+        self.patched = False
+
+    def add_lifecycle_delete_rule(self, **condition):
+        self.added.append(condition)
+
+    def patch(self):
+        self.patched = True
+
+
+@pytest.fixture
+def stub_bucket(monkeypatch):
+    def install(rules):
+        stub = StubBucket(rules)
+
+        class StubClient:
+            def get_bucket(self, name):
+                return stub
+
+        monkeypatch.setattr(engine_modules, "get_storage_client", StubClient)
+        monkeypatch.setattr(config, "ATTACHMENT_RETENTION_DAYS", 7)
+        engine_modules.ensure_attachment_lifecycle.cache_clear()
+        return stub
+
+    yield install
+    engine_modules.ensure_attachment_lifecycle.cache_clear()
+
+
+def test_lifecycle_rule_is_added_once(stub_bucket):
+    stub = stub_bucket([])
+    engine_modules.ensure_attachment_lifecycle()
+    engine_modules.ensure_attachment_lifecycle()
+    assert stub.added == [{"age": 7, "matches_prefix": ["attachments/"]}]
+    assert stub.patched
+
+
+def test_existing_lifecycle_rule_is_kept(stub_bucket):
+    rule = {
+        "action": {"type": "Delete"},
+        "condition": {"age": 7, "matchesPrefix": ["attachments/"]},
+    }
+    stub = stub_bucket([rule])
+    engine_modules.ensure_attachment_lifecycle()
+    assert stub.added == []
+    assert not stub.patched
+
+
+def test_uploads_near_expiry_are_not_reused(monkeypatch):
+    monkeypatch.setattr(config, "ATTACHMENT_RETENTION_DAYS", 7)
+    now = engine_modules.time.time()
+    assert engine_modules.is_upload_fresh(now - 5 * 86400)
+    assert not engine_modules.is_upload_fresh(now - 6.5 * 86400)
+    monkeypatch.setattr(config, "ATTACHMENT_RETENTION_DAYS", 0)
+    assert engine_modules.is_upload_fresh(now - 365 * 86400)
+
+
+# --- In-memory bucket (no emulator needed) ---
+class MemoryBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.generation = None
+        self.time_created = None
+        self.content_type = None
+        self.data = None
+
+    def upload_from_file(self, file_obj, size, content_type, if_generation_match):
+        self.bucket.uploads.append((self.name, if_generation_match))
+        current = self.bucket.blobs.get(self.name)
+        if if_generation_match != (current.generation if current else 0):
+            raise engine_modules.PreconditionFailed("generation mismatch")
+        self.data = file_obj.read(size)
+        self.content_type = content_type
+        self.generation = (current.generation if current else 0) + 1
+        self.time_created = datetime.datetime.now(datetime.timezone.utc)
+        self.bucket.blobs[self.name] = self
+
+
+class MemoryBucket(StubBucket):
+    def __init__(self):
+        super().__init__([])
+        self.blobs = {}
+        self.uploads = []
+        self.lookups = 0
+
+    def get_blob(self, name):
+        self.lookups += 1
+        return self.blobs.get(name)
+
+    def blob(self, name):
+        return MemoryBlob(self, name)
+
+
+@pytest.fixture
+def memory_bucket(monkeypatch):
+    bucket = MemoryBucket()
+
+    class MemoryClient:
+        def get_bucket(self, name):
+            assert name == "attachments-bucket"
+            return bucket
+
+        def bucket(self, name):
+            assert name == "attachments-bucket"
+            return bucket
+
+    monkeypatch.setattr(engine_modules, "get_storage_client", MemoryClient)
+    monkeypatch.setattr(config, "GOOGLE_CLOUD_BUCKET", "attachments-bucket")
+    monkeypatch.setattr(config, "ATTACHMENT_RETENTION_DAYS", 30)
+    monkeypatch.setattr(engine_modules, "attachment_cache", None)
+    engine_modules.ensure_attachment_lifecycle.cache_clear()
+    yield bucket
+    engine_modules.ensure_attachment_lifecycle.cache_clear()
+
+
+def test_upload_names_the_object_by_digest_and_sets_up_expiry(memory_bucket):
+    uri = engine_modules.upload_attachment(PNG, "chart.png", "image/png")
+    name = f"attachments/{engine_modules.cache_modules.content_digest(PNG)}"
+    assert uri == f"gs://attachments-bucket/{name}"
+    assert memory_bucket.uploads == [(name, 0)]
+    assert memory_bucket.blobs[name].data == PNG
+    assert memory_bucket.blobs[name].content_type == "image/png"
+    assert memory_bucket.added == [{"age": 30, "matches_prefix": ["attachments/"]}]
+    assert memory_bucket.patched
+
+
+def test_second_upload_is_a_uri_cache_hit(memory_bucket, monkeypatch, tmp_path):
+    cache = engine_modules.cache_modules.DiskLRUCache(str(tmp_path), 1024)
+    monkeypatch.setattr(engine_modules, "attachment_cache", cache)
+    first = engine_modules.upload_attachment(PNG, "chart.png", "image/png")
+    lookups = memory_bucket.lookups
+    second = engine_modules.upload_attachment(PNG, "copy.png", "image/png")
+    assert second == first
+    assert memory_bucket.lookups == lookups  # the bucket wasn't asked again
+    assert len(memory_bucket.uploads) == 1
+    cached_uri, uploaded_at = cache.get(
+        engine_modules.cache_modules.content_digest(PNG), "uri"
+    ).decode().split(" ")
+    assert cached_uri == first
+    assert engine_modules.is_upload_fresh(float(uploaded_at))
+
+
+def test_known_object_is_found_without_the_cache(memory_bucket):
+    engine_modules.upload_attachment(PNG, "chart.png", "image/png")
+    engine_modules.upload_attachment(PNG, "copy.png", "image/png")
+    assert len(memory_bucket.uploads) == 1
+    assert memory_bucket.lookups == 2
+
+
+def test_object_near_expiry_is_replaced_in_place(memory_bucket, monkeypatch):
+    engine_modules.upload_attachment(PNG, "chart.png", "image/png")
+    name = next(iter(memory_bucket.blobs))
+    memory_bucket.blobs[name].time_created -= datetime.timedelta(days=29.5)
+    engine_modules.upload_attachment(PNG, "chart.png", "image/png")
+    assert memory_bucket.uploads == [(name, 0), (name, 1)]
+    assert memory_bucket.blobs[name].generation == 2
+
+
+def test_concurrent_upload_of_the_same_content_is_not_an_error(memory_bucket, monkeypatch):
+    name = f"attachments/{engine_modules.cache_modules.content_digest(PNG)}"
+    other = MemoryBlob(memory_bucket, name)
+    # Another process creates the object between the lookup and the upload
+    get_blob = memory_bucket.get_blob
+
+    def racing_get_blob(blob_name):
+        result = get_blob(blob_name)
+        other.upload_from_file(io.BytesIO(PNG), len(PNG), "image/png", 0)
+        return result
+
+    monkeypatch.setattr(memory_bucket, "get_blob", racing_get_blob)
+    uri = engine_modules.upload_attachment(PNG, "chart.png", "image/png")
+    assert uri == f"gs://attachments-bucket/{name}"
+    assert memory_bucket.uploads == [(name, 0), (name, 0)]
+    assert memory_bucket.blobs[name] is other
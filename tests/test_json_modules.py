@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+import json_modules
+
+DOCUMENTS = [
+    {"text": "plain"},
+    {"text": "Größe € 日本語 🙂", "nested": {"list": [1, 2.5, None, True, False]}},
+    {"escapes": 'quote " backslash \\ newline \n tab \t nul \x00'},
+    [],
+    {},
+    "just a string",
+    12345678901234,
+    -0.5,
+    None,
+]
+
+
+@pytest.fixture(params=["orjson", "json"])
+def backend(request, monkeypatch):
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(json_modules, "orjson", None)
+    return request.param
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_round_trip(backend, document):
+    encoded = json_modules.dumps(document)
+    assert isinstance(encoded, bytes)
+    assert json_modules.loads(encoded) == document
+
+
+def test_output_is_compact(backend):
+    encoded = json_modules.dumps({"a": [1, 2], "b": {"c": None, "d": "x y"}})
+    assert encoded == b'{"a":[1,2],"b":{"c":null,"d":"x y"}}'
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_output_is_utf8_json_the_stdlib_reads(backend, document):
+    assert json.loads(json_modules.dumps(document).decode("utf-8")) == document
+
+
+@pytest.mark.parametrize("wrap", [bytes, bytearray, memoryview, lambda data: data.decode("utf-8")])
+def test_loads_accepts_every_input_type(backend, wrap):
+    data = '{"text":"Größe","n":[1,2]}'.encode("utf-8")
+    assert json_modules.loads(wrap(data)) == {"text": "Größe", "n": [1, 2]}
+
+
+@pytest.mark.parametrize("data", [b"", b"{", b'{"a":}', b"[1,]", b"\xff"])
+def test_invalid_json_raises_the_same_error(backend, data):
+    with pytest.raises(json_modules.JSONDecodeError):
+        json_modules.loads(data)
+
@@ -0,0 +1,93 @@
+import logging
+import queue
+import threading
+
+import logging_modules
+
+
+def make_record(level: int, lineno: int = 10) -> logging.LogRecord:
+    return logging.LogRecord("bot", level, "bot.py", lineno, "failed: %s", ("x",), None)
+
+
+def test_repeated_warnings_are_rate_limited():
+    rate_limit = logging_modules.RateLimitFilter(60)
+    assert rate_limit.filter(make_record(logging.WARNING))
+    assert not rate_limit.filter(make_record(logging.WARNING))
+    assert not rate_limit.filter(make_record(logging.WARNING))
+    assert rate_limit.filter(make_record(logging.WARNING, lineno=11))
+
+
+def test_errors_and_info_are_never_rate_limited():
+    rate_limit = logging_modules.RateLimitFilter(60)
+    for level in (logging.INFO, logging.ERROR, logging.CRITICAL):
+        assert all(rate_limit.filter(make_record(level)) for _ in range(3))
+
+
+def test_suppressed_count_rides_on_the_next_warning_through(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(logging_modules.time, "monotonic", lambda: now[0])
+    rate_limit = logging_modules.RateLimitFilter(60)
+    rate_limit.filter(make_record(logging.WARNING))
+    rate_limit.filter(make_record(logging.WARNING))
+    rate_limit.filter(make_record(logging.WARNING))
+    now[0] = 61
+    record = make_record(logging.WARNING)
+    assert rate_limit.filter(record)
+    assert record.suppressed == 2
+
+
+class BlockingHandler(logging.Handler):
+    """Holds the listener thread on its first record until released."""
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.unblock = threading.Event()
+        self.records = []
+
+    def emit(self, record):
+        self.started.set()
+        self.unblock.wait(5)
+        self.records.append(record)
+
+
+def test_stop_waits_for_room_in_a_full_queue():
+    records: queue.Queue = queue.Queue(maxsize=3)
+    handler = BlockingHandler()
+    listener = logging_modules._QueueListener(records, handler)
+    listener.start()
+    records.put(make_record(logging.INFO))
+    assert handler.started.wait(5)
+    for _ in range(3):
+        records.put_nowait(make_record(logging.INFO))
+
+    errors = []
+
+    def stop():
+        try:
+            listener.stop()
+        except Exception as e:
+            errors.append(e)
+
+    stopper = threading.Thread(target=stop)
+    stopper.start()
+    handler.unblock.set()
+    stopper.join(5)
+    assert not stopper.is_alive()
+    assert errors == []
+    assert len(handler.records) == 4
+
+
+def test_stop_gives_up_on_a_stuck_writer(monkeypatch):
+    monkeypatch.setattr(logging_modules, "STOP_TIMEOUT_SECONDS", 0.1)
+    records: queue.Queue = queue.Queue(maxsize=1)
+    handler = BlockingHandler()
+    listener = logging_modules._QueueListener(records, handler)
+    listener.start()
+    records.put(make_record(logging.INFO))
+    assert handler.started.wait(5)
+    records.put_nowait(make_record(logging.INFO))
+    monkeypatch.setattr(logging_modules, "_listener", listener)
+
+    logging_modules._stop()  # returns instead of raising queue.Full or hanging
+    handler.unblock.set()
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import metrics_modules
+import stream_events
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    """Metrics created by a test register in a scratch registry."""
+    monkeypatch.setattr(metrics_modules, "REGISTRY", [])
+    return metrics_modules.REGISTRY
+
+
+def test_counter_renders_help_type_and_one_sample_per_label_set():
+    counter = metrics_modules.Counter("demo_total", "Demo events.", ("frontend", "route"))
+    counter.inc(frontend="slack", route="dm")
+    counter.inc(2, frontend="slack", route="dm")
+    counter.inc(frontend="telegram", route="mention")
+    assert counter.render() == [
+        "# HELP demo_total Demo events.",
+        "# TYPE demo_total counter",
+        'demo_total{frontend="slack",route="dm"} 3',
+        'demo_total{frontend="telegram",route="mention"} 1',
+    ]
+
+
+def test_metric_without_labels_has_no_braces():
+    gauge = metrics_modules.Gauge("demo_open", "Open things.")
+    with gauge.track():
+        assert gauge.render()[-1] == "demo_open 1"
+    assert gauge.render()[-1] == "demo_open 0"
+
+
+def test_label_values_are_escaped():
+    counter = metrics_modules.Counter("demo_total", "Demo.", ("channel",))
+    counter.inc(channel='say "hi"\\\nbye')
+    assert counter.render()[-1] == 'demo_total{channel="say \\"hi\\"\\\\\\nbye"} 1'
+
+
+def test_histogram_buckets_are_cumulative_with_sum_and_count():
+    histogram = metrics_modules.Histogram(
+        "demo_seconds", "Demo latency.", ("frontend",), buckets=(1, 0.5, 2)
+    )
+    for value in (0.1, 0.5, 0.7, 3):
+        histogram.observe(value, frontend="slack")
+    assert histogram.render() == [
+        "# HELP demo_seconds Demo latency.",
+        "# TYPE demo_seconds histogram",
+        'demo_seconds_bucket{frontend="slack",le="0.5"} 2',
+        'demo_seconds_bucket{frontend="slack",le="1.0"} 3',
+        'demo_seconds_bucket{frontend="slack",le="2.0"} 3',
+        'demo_seconds_bucket{frontend="slack",le="+Inf"} 4',
+        'demo_seconds_sum{frontend="slack"} 4.3',
+        'demo_seconds_count{frontend="slack"} 4',
+    ]
+
+
+def test_render_joins_every_metric_with_a_trailing_newline():
+    metrics_modules.Counter("a_total", "A.").inc()
+    metrics_modules.Counter("b_total", "B.")
+    assert metrics_modules.render() == (
+        "# HELP a_total A.\n# TYPE a_total counter\na_total 1\n"
+        "# HELP b_total B.\n# TYPE b_total counter\n"
+    )
+
+
+def test_counted_counts_calls_and_failures(monkeypatch):
+    calls = metrics_modules.Counter("calls_total", "Calls.", ("api", "method"))
+    errors = metrics_modules.Counter("errors_total", "Errors.", ("api", "method"))
+    monkeypatch.setattr(metrics_modules, "api_calls_total", calls)
+    monkeypatch.setattr(metrics_modules, "api_errors_total", errors)
+
+    @metrics_modules.counted("slack")
+    def post(fail=False):
+        if fail:
+            raise RuntimeError("boom")
+
+    @metrics_modules.counted("telegram", "send_message")
+    async def send():
+        return "sent"
+
+    post()
+    with pytest.raises(RuntimeError):
+        post(fail=True)
+    assert asyncio.run(send()) == "sent"
+    assert calls.render()[2:] == [
+        'calls_total{api="slack",method="post"} 2',
+        'calls_total{api="telegram",method="send_message"} 1',
+    ]
+    assert errors.render()[2:] == ['errors_total{api="slack",method="post"} 1']
+
+
+def test_stream_timer_observes_the_first_token_once(monkeypatch):
+    for name, metric in [
+        ("first_token_seconds", metrics_modules.Histogram("first", "First.", ("frontend",))),
+        ("stream_seconds", metrics_modules.Histogram("stream", "Stream.", ("frontend",))),
+        ("streams_in_flight", metrics_modules.Gauge("open", "Open.", ("frontend",))),
+        ("api_calls_total", metrics_modules.Counter("calls", "Calls.", ("api", "method"))),
+        ("api_errors_total", metrics_modules.Counter("errors", "Errors.", ("api", "method"))),
+    ]:
+        monkeypatch.setattr(metrics_modules, name, metric)
+
+    with pytest.raises(ValueError):
+        with metrics_modules.StreamTimer("slack") as timer:
+            assert metrics_modules.streams_in_flight.render()[-1] == 'open{frontend="slack"} 1'
+            demux = stream_events.StreamDemux(timer)
+            for text in ("a", "b"):
+                demux.feed({"content": {"parts": [{"text": text}]}})
+            raise ValueError("stream broke")
+
+    assert metrics_modules.first_token_seconds.render()[-1] == 'first_count{frontend="slack"} 1'
+    assert metrics_modules.stream_seconds.render()[-1] == 'stream_count{frontend="slack"} 1'
+    assert metrics_modules.streams_in_flight.render()[-1] == 'open{frontend="slack"} 0'
+    assert metrics_modules.api_errors_total.render()[-1] == (
+        'errors{api="agent_engine",method="stream_query"} 1'
+    )
+
+
+def test_endpoint_serves_the_exposition_format():
+    metrics_modules.Counter("served_total", "Served.").inc()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), metrics_modules._MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{server.server_port}"
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert response.headers["Content-Type"] == "text/plain; version=0.0.4; charset=utf-8"
+            assert response.read().decode("utf-8") == metrics_modules.render()
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"{url}/other")
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
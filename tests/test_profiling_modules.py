@@ -0,0 +1,41 @@
+import threading
+
+import pytest
+
+import config
+import profiling_modules
+
+
+def test_start_profile_reports_from_the_background(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "PROFILE_SAMPLE_INTERVAL_MS", 5)
+    done = threading.Event()
+    results = []
+
+    def on_done(path):
+        results.append((path, threading.current_thread().name))
+        done.set()
+
+    assert profiling_modules.start_profile(0.2, on_done=on_done)
+    assert not profiling_modules.start_profile(0.2, on_done=on_done)
+    assert done.wait(5)
+    path, thread_name = results[0]
+    assert thread_name == "profiler"
+    assert path.startswith(str(tmp_path))
+    assert profiling_modules.summarize_profile(path).startswith(
+        f"{sum(int(line.rsplit(' ', 1)[1]) for line in open(path))} samples"
+    )
+
+
+def test_parse_profile_args_defaults_and_clamps(monkeypatch):
+    monkeypatch.setattr(config, "PROFILE_SECONDS", 30.0)
+    monkeypatch.setattr(config, "PROFILE_MAX_SECONDS", 300.0)
+    assert profiling_modules.parse_profile_args([]) == 30.0
+    assert profiling_modules.parse_profile_args(["2.5"]) == 2.5
+    assert profiling_modules.parse_profile_args(["900"]) == 300.0
+
+
+@pytest.mark.parametrize("args", [["0"], ["-5"], ["nan"], ["soon"], ["5", "10"]])
+def test_parse_profile_args_rejects_non_positive_and_malformed_seconds(args):
+    with pytest.raises(ValueError, match=r"Usage: /profile \[seconds\]"):
+        profiling_modules.parse_profile_args(args)
@@ -0,0 +1,129 @@
+import threading
+
+import pytest
+import streamlit as st
+
+import json_modules
+from streamlit_app import query_streamlit
+
+
+def text_line(text):
+    event = {"author": "main_agent", "content": {"role": "model", "parts": [{"text": text}]}}
+    return json_modules.dumps(event)
+
+
+class FakeResponse:
+    """A streamed response that can hold back the lines after `hold_after`."""
+
+    def __init__(self, lines, hold_after=None):
+        self.lines = lines
+        self.hold_after = hold_after
+        self.held = threading.Event()
+        self.resume = threading.Event()
+        self.closed = threading.Event()
+        self.yielded = 0
+
+    def iter_lines(self):
+        for i, line in enumerate(self.lines):
+            if i == self.hold_after:
+                self.held.set()
+                self.resume.wait(timeout=5)
+            self.yielded += 1
+            yield line
+
+    def close(self):
+        self.closed.set()
+
+
+@pytest.fixture(autouse=True)
+def session_state():
+    st.session_state.messages = []
+    st.session_state.live_payloads = {}
+    yield
+    st.session_state.pop("active_stream", None)
+
+
+def drain(events):
+    items = []
+    while (item := events.get(timeout=5)) is not query_streamlit._END_OF_STREAM:
+        items.append(item)
+    return items
+
+
+def test_reader_stops_between_chunks_and_closes_the_response():
+    resp = FakeResponse([text_line("a"), text_line("b"), text_line("c")], hold_after=1)
+    events, stop = query_streamlit.queue.Queue(), threading.Event()
+    reader = threading.Thread(target=query_streamlit.read_events, args=(resp, events, stop))
+    reader.start()
+
+    assert resp.held.wait(timeout=5)
+    stop.set()
+    resp.resume.set()
+    reader.join(timeout=5)
+
+    assert not reader.is_alive()
+    assert resp.closed.is_set()
+    assert len(drain(events)) == 1
+    assert resp.yielded == 2  # the chunk read after the stop is dropped, none after it
+
+
+def test_reader_closes_the_response_when_the_stream_ends():
+    resp = FakeResponse([text_line("a"), b"", b"not json", text_line("b")])
+    events = query_streamlit.queue.Queue()
+
+    query_streamlit.read_events(resp, events, threading.Event())
+
+    assert resp.closed.is_set()
+    assert len(drain(events)) == 2
+
+
+def test_cancel_sets_the_stop_event_of_the_active_stream():
+    stop = threading.Event()
+    st.session_state.active_stream = stop
+
+    query_streamlit.cancel_active_stream()
+
+    assert stop.is_set()
+    assert "active_stream" not in st.session_state
+    query_streamlit.cancel_active_stream()  # nothing active: a no-op
+
+
+def test_text_arriving_within_a_frame_is_painted_once():
+    texts = [f"t{i} " for i in range(200)]
+    resp = FakeResponse([text_line(t) for t in texts])
+    stop = threading.Event()
+    st.session_state.active_stream = stop
+
+    frames = list(query_streamlit.stream_response(resp, stop, False, False, False))
+
+    assert "".join(frames) == "".join(f"main_agent: {t}" for t in texts)
+    assert len(frames) < len(texts)
+    assert len(st.session_state.messages) == len(texts)
+
+
+def test_text_after_a_pause_gets_its_own_frame():
+    resp = FakeResponse([text_line("before"), text_line("after")], hold_after=1)
+    stop = threading.Event()
+    st.session_state.active_stream = stop
+    stream = query_streamlit.stream_response(resp, stop, False, False, False)
+
+    first = next(stream)
+    resp.resume.set()
+
+    assert first == "main_agent: before"
+    assert list(stream) == ["main_agent: after"]
+
+
+def test_cancelled_stream_ends_and_its_reader_closes_the_response():
+    resp = FakeResponse([text_line("a"), text_line("b")], hold_after=1)
+    stop = threading.Event()
+    st.session_state.active_stream = stop
+    stream = query_streamlit.stream_response(resp, stop, False, False, False)
+
+    assert next(stream) == "main_agent: a"
+    query_streamlit.cancel_active_stream()
+    assert list(stream) == []
+
+    resp.resume.set()
+    assert resp.closed.wait(timeout=5)
+    assert resp.yielded == 2
@@ -0,0 +1,239 @@
+import asyncio
+
+import pytest
+
+import stream_events
+from stream_events import StreamDemux, StreamSink
+
+# Events as the agent engine streams them for one question, trimmed to the keys
+# the demultiplexer reads plus a few it must ignore.
+RECORDED_EVENTS = [
+    {
+        "author": "main_agent",
+        "invocation_id": "e-7f3a",
+        "id": "ev-1",
+        "timestamp": 1760000000.1,
+        "content": {
+            "role": "model",
+            "parts": [{"text": "The user wants last quarter's revenue.", "thought": True}],
+        },
+        "actions": {"state_delta": {}, "artifact_delta": {}},
+    },
+    {
+        "author": "main_agent",
+        "invocation_id": "e-7f3a",
+        "id": "ev-2",
+        "content": {
+            "role": "model",
+            "parts": [
+                {
+                    "function_call": {
+                        "id": "adk-1",
+                        "name": "run_query",
+                        "args": {"sql": "SELECT SUM(amount) FROM sales"},
+                    }
+                }
+            ],
+        },
+        "actions": {"state_delta": {}, "artifact_delta": {}},
+        "usage_metadata": {
+            "prompt_token_count": 1200,
+            "candidates_token_count": 30,
+            "thoughts_token_count": 45,
+            "total_token_count": 1275,
+        },
+    },
+    {
+        "author": "main_agent",
+        "invocation_id": "e-7f3a",
+        "id": "ev-3",
+        "content": {
+            "role": "user",
+            "parts": [
+                {
+                    "function_response": {
+                        "id": "adk-1",
+                        "name": "run_query",
+                        "response": {"rows": [{"sum": 1250000}]},
+                    }
+                }
+            ],
+        },
+        "actions": {"state_delta": {"last_query": "sales"}, "artifact_delta": {"revenue.csv": 0}},
+    },
+    {
+        "author": "main_agent",
+        "invocation_id": "e-7f3a",
+        "id": "ev-4",
+        "content": {"role": "model", "parts": [{"text": "Revenue was "}]},
+        "partial": True,
+    },
+    {
+        "author": "main_agent",
+        "invocation_id": "e-7f3a",
+        "id": "ev-5",
+        "content": {"role": "model", "parts": [{"text": "$1.25M."}]},
+        "actions": {"artifact_delta": {"chart.png": 2}},
+        "usage_metadata": {
+            "prompt_token_count": 1300,
+            "candidates_token_count": 12,
+            "total_token_count": 1312,
+        },
+    },
+    {
+        "author": "answer_validator_agent",
+        "invocation_id": "e-7f3a",
+        "id": "ev-6",
+        "content": {"role": "model", "parts": [{"text": '{"valid": true}'}]},
+        "actions": {"artifact_delta": {"ignored.txt": 0}},
+        "usage_metadata": {
+            "prompt_token_count": 400,
+            "candidates_token_count": 5,
+            "total_token_count": 405,
+        },
+    },
+]
+
+
+class RecordingSink(StreamSink):
+    def __init__(self, **wants):
+        for channel, wanted in wants.items():
+            setattr(self, f"wants_{channel}", wanted)
+        self.events = []
+
+    def on_text_delta(self, event):
+        self.events.append(("text", event.author, event.text))
+
+    def on_thought(self, event):
+        self.events.append(("thought", event.author, event.text))
+
+    def on_tool_call(self, event):
+        self.events.append(("tool_call", event.name, event.args, event.call_id))
+
+    def on_tool_response(self, event):
+        self.events.append(("tool_response", event.name, event.response, event.call_id))
+
+    def on_artifact_delta(self, event):
+        self.events.append(("artifact", event.filename, event.version))
+
+    def on_usage(self, event):
+        self.events.append(
+            (
+                "usage",
+                event.author,
+                event.invocation_id,
+                event.prompt_tokens,
+                event.output_tokens,
+                event.thought_tokens,
+                event.total_tokens,
+            )
+        )
+
+    def on_validator_output(self, event):
+        self.events.append(("validator", event.text))
+
+
+def feed_all(*sinks) -> StreamDemux:
+    demux = StreamDemux(*sinks)
+    for event in RECORDED_EVENTS:
+        demux.feed(event)
+    return demux
+
+
+def test_text_only_sink_gets_the_answer():
+    sink = RecordingSink()
+    demux = feed_all(sink)
+    assert demux.text == "Revenue was $1.25M."
+    assert sink.events == [
+        ("text", "main_agent", "Revenue was "),
+        ("text", "main_agent", "$1.25M."),
+    ]
+
+
+def test_every_kind_is_routed_in_stream_order():
+    sink = RecordingSink(thoughts=True, tools=True, artifacts=True, usage=True, validator=True)
+    demux = feed_all(sink)
+    assert demux.text == "Revenue was $1.25M."
+    assert sink.events == [
+        ("thought", "main_agent", "The user wants last quarter's revenue."),
+        ("tool_call", "run_query", {"sql": "SELECT SUM(amount) FROM sales"}, "adk-1"),
+        ("usage", "main_agent", "e-7f3a", 1200, 30, 45, 1275),
+        ("tool_response", "run_query", {"rows": [{"sum": 1250000}]}, "adk-1"),
+        ("artifact", "revenue.csv", 0),
+        ("text", "main_agent", "Revenue was "),
+        ("text", "main_agent", "$1.25M."),
+        ("artifact", "chart.png", 2),
+        ("usage", "main_agent", "e-7f3a", 1300, 12, 0, 1312),
+        ("validator", '{"valid": true}'),
+        ("usage", "answer_validator_agent", "e-7f3a", 400, 5, 0, 405),
+    ]
+
+
+def test_each_sink_gets_only_the_kinds_it_wants():
+    text = RecordingSink()
+    tools = RecordingSink(text=False, tools=True)
+    usage = RecordingSink(text=False, usage=True)
+    feed_all(text, tools, usage)
+    assert [event[0] for event in text.events] == ["text", "text"]
+    assert [event[0] for event in tools.events] == ["tool_call", "tool_response"]
+    assert [event[3] for event in usage.events] == [1200, 1300, 400]
+
+
+def test_unwanted_kinds_are_not_built():
+    demux = StreamDemux(RecordingSink())
+    kinds = {type(event) for response in RECORDED_EVENTS for event in demux.parse(response)}
+    assert kinds == {stream_events.TextDelta}
+
+
+def test_validator_text_is_never_part_of_the_answer():
+    demux = feed_all(RecordingSink(validator=True))
+    assert "valid" not in demux.text
+
+
+@pytest.mark.parametrize(
+    "response",
+    [{}, None, {"author": "main_agent"}, {"content": None}, {"content": {"parts": None}}],
+)
+def test_events_without_content_are_skipped(response):
+    sink = RecordingSink(thoughts=True, tools=True, artifacts=True, usage=True)
+    demux = StreamDemux(sink)
+    assert demux.feed(response) == []
+    assert sink.events == []
+    assert demux.text == ""
+
+
+def test_afeed_awaits_async_handlers():
+    class AsyncSink(StreamSink):
+        wants_artifacts = True
+
+        def __init__(self):
+            self.seen = []
+
+        async def on_artifact_delta(self, event):
+            await asyncio.sleep(0)
+            self.seen.append(event.filename)
+
+    sink = AsyncSink()
+
+    async def run():
+        demux = StreamDemux(sink)
+        for event in RECORDED_EVENTS:
+            await demux.afeed(event)
+        return demux.text
+
+    assert asyncio.run(run()) == "Revenue was $1.25M."
+    assert sink.seen == ["revenue.csv", "chart.png"]
+
+
+@pytest.mark.parametrize(
+    "text, limit, chunks",
+    [
+        ("", 5, []),
+        ("abc", 5, ["abc"]),
+        ("abcde", 5, ["abcde"]),
+        ("abcdefghijk", 5, ["abcde", "fghij", "k"]),
+        ("Выручка", 3, ["Выр", "учк", "а"]),
+    ],
+)
+def test_split_text(text, limit, chunks):
+    assert stream_events.split_text(text, limit) == chunks
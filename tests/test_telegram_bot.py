@@ -0,0 +1,165 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import config
+from telegram_app import bot
+
+
+def album_item(chat_id: int, group_id: str, caption: str | None = None):
+    message = SimpleNamespace(
+        media_group_id=group_id,
+        caption=caption,
+        from_user=SimpleNamespace(is_bot=False),
+    )
+    return SimpleNamespace(effective_message=message, effective_chat=SimpleNamespace(id=chat_id))
+
+
+@pytest.fixture
+def routed(monkeypatch):
+    """Routes collected by route_message instead of reaching the agent."""
+    calls = []
+
+    async def route_message(update, context, updates=None):
+        calls.append((update, updates))
+
+    monkeypatch.setattr(bot, "route_message", route_message)
+    monkeypatch.setattr(bot, "media_groups", {})
+    monkeypatch.setattr(bot, "media_group_last_seen", {})
+    monkeypatch.setattr(config, "TELEGRAM_MEDIA_GROUP_WINDOW", 0.1)
+    return calls
+
+
+async def deliver(schedule):
+    """Hands (delay, update) pairs to message_handler, then waits for the albums to flush."""
+    tasks = []
+    context = SimpleNamespace(
+        application=SimpleNamespace(
+            create_task=lambda coro: tasks.append(asyncio.create_task(coro))
+        )
+    )
+    for delay, update in schedule:
+        await asyncio.sleep(delay)
+        await bot.message_handler(update, context)
+    await asyncio.gather(*tasks)
+
+
+def test_album_is_routed_once_on_its_caption_carrier(routed):
+    first = album_item(1, "g1")
+    captioned = album_item(1, "g1", caption="@agent_bot what's in these?")
+    last = album_item(1, "g1")
+    asyncio.run(deliver([(0, first), (0.01, captioned), (0.01, last)]))
+    assert routed == [(captioned, [first, captioned, last])]
+
+
+def test_album_without_caption_routes_on_its_first_item(routed):
+    first, second = album_item(1, "g1"), album_item(1, "g1")
+    asyncio.run(deliver([(0, first), (0, second)]))
+    assert routed == [(first, [first, second])]
+
+
+def test_window_restarts_with_each_item(routed):
+    # Every gap is shorter than the window, but the album spans more than one window
+    items = [album_item(1, "g1") for _ in range(4)]
+    asyncio.run(deliver([(0, items[0])] + [(0.06, item) for item in items[1:]]))
+    assert routed == [(items[0], items)]
+
+
+def test_albums_in_different_chats_route_separately(routed):
+    a, b = album_item(1, "g1"), album_item(2, "g1")
+    asyncio.run(deliver([(0, a), (0, b)]))
+    assert sorted(len(updates) for _, updates in routed) == [1, 1]
+    assert bot.media_groups == {} and bot.media_group_last_seen == {}
+
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(1000)
+
+
+class StubFile:
+    """Stands in for telegram.File: streams `content` into the buffer, or fails."""
+
+    def __init__(self, content: bytes, error: Exception | None = None):
+        self.content = content
+        self.file_size = len(content)
+        self.error = error
+        self.buffers = []
+
+    async def download_to_memory(self, out, read_timeout=None):
+        self.buffers.append(out)
+        if self.error:
+            raise self.error
+        for i in range(0, len(self.content), 256):
+            out.write(self.content[i : i + 256])
+
+
+def download_context(files: dict):
+    async def get_file(file_id):
+        return files[file_id]
+
+    return SimpleNamespace(bot=SimpleNamespace(get_file=get_file))
+
+
+def document_update(file_id: str, content: bytes, mime_type: str = "image/png"):
+    document = SimpleNamespace(
+        file_name=f"{file_id}.png",
+        mime_type=mime_type,
+        file_id=file_id,
+        file_size=len(content),
+    )
+    return SimpleNamespace(effective_message=SimpleNamespace(document=document, photo=None))
+
+
+def file_info(file_id: str, content: bytes, mime_type: str = "image/png"):
+    message = document_update(file_id, content, mime_type).effective_message
+    return bot.get_files_from_message(message)[0]
+
+
+def test_download_file_returns_the_buffer_without_a_copy():
+    stub = StubFile(PNG)
+    content = asyncio.run(
+        bot.download_file(download_context({"a": stub}), file_info("a", PNG))
+    )
+
+    assert content == PNG
+    assert content is stub.buffers[0]._buffer
+
+
+def test_download_file_returns_none_when_the_sniff_rejects_the_content():
+    fake_png = b"MZ" + bytes(1000)
+    stub = StubFile(fake_png)
+    content = asyncio.run(
+        bot.download_file(download_context({"a": stub}), file_info("a", fake_png))
+    )
+    assert content is None
+
+
+def test_failed_download_is_skipped_and_the_rest_of_the_album_kept():
+    files = {
+        "ok1": StubFile(PNG),
+        "broken": StubFile(PNG, error=ConnectionError("reset by peer")),
+        "ok2": StubFile(PNG),
+    }
+    updates = [document_update(file_id, PNG) for file_id in files]
+
+    downloaded = asyncio.run(
+        bot.download_files_from_updates(updates, download_context(files))
+    )
+
+    assert [f["name"] for f in downloaded] == ["ok1.png", "ok2.png"]
+    assert all(f["content"] == PNG and "file_id" not in f for f in downloaded)
+
+
+def test_unsupported_files_are_skipped_before_downloading():
+    files = {"doc": StubFile(PNG), "exe": StubFile(PNG)}
+    updates = [
+        document_update("doc", PNG),
+        document_update("exe", PNG, mime_type="application/x-msdownload"),
+    ]
+
+    downloaded = asyncio.run(
+        bot.download_files_from_updates(updates, download_context(files))
+    )
+
+    assert [f["name"] for f in downloaded] == ["doc.png"]
+    assert files["exe"].buffers == []
@@ -0,0 +1,176 @@
+import asyncio
+import json
+
+import pytest
+
+import config
+import executor_modules
+import stream_events
+import tracing_modules
+
+
+class RecordingExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, finished_span):
+        self.spans.append(finished_span)
+
+
+@pytest.fixture
+def exported(monkeypatch):
+    monkeypatch.setattr(config, "TRACE_EXPORTER", "jsonl")
+    monkeypatch.setattr(config, "TRACE_SAMPLE_RATE", 1.0)
+    exporter = RecordingExporter()
+    monkeypatch.setattr(tracing_modules, "_exporter", exporter)
+    return exporter.spans
+
+
+def by_name(spans) -> dict:
+    return {finished_span.name: finished_span for finished_span in spans}
+
+
+def test_spans_nest_under_the_root(exported):
+    with tracing_modules.start_trace("request", route="dm") as root:
+        with tracing_modules.span("prepare") as prepare:
+            with tracing_modules.span("upload", bytes=10):
+                pass
+            assert tracing_modules.current_span() is prepare
+    assert tracing_modules.current_span() is tracing_modules.NOOP_SPAN
+
+    spans = by_name(exported)
+    assert list(spans) == ["upload", "prepare", "request"]
+    assert spans["request"].parent_id is None
+    assert spans["prepare"].parent_id == root.span_id
+    assert spans["upload"].parent_id == prepare.span_id
+    assert {s.trace_id for s in exported} == {root.trace_id}
+    assert len(root.trace_id) == 32 and len(root.span_id) == 16
+    assert spans["upload"].attributes == {"bytes": 10}
+
+
+def test_a_nested_trace_becomes_a_child_span(exported):
+    with tracing_modules.start_trace("request") as root:
+        with tracing_modules.start_trace("retry") as retry:
+            pass
+    assert retry.parent_id == root.span_id
+    assert retry.trace_id == root.trace_id
+
+
+def test_errors_are_recorded_and_raised(exported):
+    with pytest.raises(ValueError):
+        with tracing_modules.start_trace("request"):
+            with tracing_modules.span("parse"):
+                raise ValueError("bad event")
+    assert [s.error for s in exported] == ["ValueError: bad event"] * 2
+
+
+@pytest.mark.parametrize(
+    "exporter, rate, draw, sampled",
+    [
+        ("jsonl", 1.0, 0.99, True),
+        ("jsonl", 0.25, 0.2, True),
+        ("jsonl", 0.25, 0.3, False),
+        ("jsonl", 0.0, 0.0, False),
+        ("", 1.0, 0.0, False),
+    ],
+)
+def test_sampling_decision(exported, monkeypatch, exporter, rate, draw, sampled):
+    monkeypatch.setattr(config, "TRACE_EXPORTER", exporter)
+    monkeypatch.setattr(config, "TRACE_SAMPLE_RATE", rate)
+    monkeypatch.setattr(tracing_modules.random, "random", lambda: draw)
+    with tracing_modules.start_trace("request") as root:
+        with tracing_modules.span("stage") as stage:
+            stage.set(ok=True)
+            stage.mark("first_text")
+    assert isinstance(root, tracing_modules.Span) is sampled
+    assert isinstance(stage, tracing_modules.Span) is sampled
+    assert len(exported) == (2 if sampled else 0)
+
+
+def test_spans_outside_a_trace_are_noops(exported):
+    with tracing_modules.span("orphan") as orphan:
+        pass
+    assert orphan is tracing_modules.NOOP_SPAN
+    assert exported == []
+
+
+def test_context_follows_tasks_and_the_thread_pool(exported, monkeypatch):
+    monkeypatch.setattr(config, "EXECUTOR_INLINE_MAX_BYTES", 0)
+
+    def blocking_stage():
+        with tracing_modules.span("in_pool"):
+            pass
+
+    @tracing_modules.traced("handler", root=True)
+    async def handler():
+        async def in_task():
+            with tracing_modules.span("in_task"):
+                await asyncio.sleep(0)
+
+        await asyncio.gather(asyncio.create_task(in_task()), asyncio.create_task(in_task()))
+        await executor_modules.run_blocking(blocking_stage, payload_bytes=1)
+        return tracing_modules.current_span()
+
+    root = asyncio.run(handler())
+    names = [s.name for s in exported if s.parent_id == root.span_id]
+    assert sorted(names) == ["in_pool", "in_task", "in_task"]
+
+
+def test_stream_span_sink_marks_the_first_text_once(exported, monkeypatch):
+    with tracing_modules.start_trace("request"):
+        with tracing_modules.span("agent_stream") as stream_span:
+            demux = stream_events.StreamDemux(tracing_modules.StreamSpanSink(stream_span))
+            for text in ("a", "b"):
+                demux.feed({"content": {"parts": [{"text": text}]}})
+    assert [name for name, _ in stream_span.events] == ["first_text"]
+    assert "first_text_ms" in stream_span.attributes
+
+
+def test_otlp_form(exported):
+    with tracing_modules.start_trace("request", count=3, ratio=0.5, ok=True, route="dm"):
+        pass
+    otlp = exported[0].to_otlp()
+    assert "parentSpanId" not in otlp
+    assert otlp["status"] == {"code": 1}
+    assert otlp["attributes"] == [
+        {"key": "count", "value": {"intValue": "3"}},
+        {"key": "ratio", "value": {"doubleValue": 0.5}},
+        {"key": "ok", "value": {"boolValue": True}},
+        {"key": "route", "value": {"stringValue": "dm"}},
+    ]
+
+
+def test_exporter_thread_writes_jsonl(monkeypatch, tmp_path):
+    trace_file = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(config, "TRACE_FILE", str(trace_file))
+    monkeypatch.setattr(config, "TRACE_EXPORTER", "jsonl")
+    monkeypatch.setattr(config, "TRACE_SAMPLE_RATE", 1.0)
+    exporter = tracing_modules._Exporter()
+    monkeypatch.setattr(tracing_modules, "_exporter", exporter)
+
+    with tracing_modules.start_trace("request", route="dm") as root:
+        with tracing_modules.span("stage"):
+            pass
+    exporter.shutdown()
+
+    lines = [json.loads(line) for line in trace_file.read_text().splitlines()]
+    assert [line["name"] for line in lines] == ["stage", "request"]
+    assert lines[0]["parent_id"] == root.span_id == lines[1]["span_id"]
+    assert lines[1]["attributes"] == {"route": "dm"}
+    assert lines[1]["duration_ms"] >= 0
+    assert lines[1]["error"] is None
+
+
+def test_exporter_drops_spans_when_its_queue_is_full(monkeypatch, caplog):
+    monkeypatch.setattr(config, "TRACE_QUEUE_SIZE", 2)
+    exporter = tracing_modules._Exporter()
+    exporter._thread = object()  # a stalled writer: nothing drains the queue
+    for i in range(5):
+        exporter.export(tracing_modules.Span(f"s{i}", "t" * 32, None, {}))
+    assert exporter.dropped == 3
+    assert exporter._queue.qsize() == 2
+
+    monkeypatch.setattr(tracing_modules, "write_jsonl", lambda spans: None)
+    exporter._flush([])
+    assert exporter.dropped == 0
+    assert "Dropped 3 spans (export queue full)" in caplog.text
@@ -0,0 +1,106 @@
+import pytest
+
+from streamlit_app import transcript
+
+
+def tool_response(size):
+    return {
+        "role": "thought",
+        "type": "tool_response",
+        "label": "search",
+        "content": "x" * size,
+    }
+
+
+def test_append_turn_rekeys_live_payloads_by_history_position():
+    history, payloads = transcript.split_payloads(
+        [{"role": "user", "content": "q1"}, tool_response(5000)]
+    )
+    live_payloads = {}
+    live = [
+        {"role": "user", "content": "q2"},
+        transcript.strip_payload(tool_response(6000), live_payloads, "live_payload_1"),
+    ]
+
+    transcript.append_turn(history, payloads, live, live_payloads)
+
+    assert [m.get("payload_id") for m in history] == [None, "payload_1", None, "payload_3"]
+    assert payloads["payload_1"] == "x" * 5000
+    assert payloads["payload_3"] == "x" * 6000
+
+
+def test_split_payloads_keeps_payloads_up_to_the_inline_limit():
+    # json.dumps adds two quote characters around the string
+    at_limit = tool_response(transcript.INLINE_PAYLOAD_CHARS - 2)
+    over_limit = tool_response(transcript.INLINE_PAYLOAD_CHARS - 1)
+
+    messages, payloads = transcript.split_payloads([at_limit, over_limit])
+
+    assert messages[0] is at_limit
+    assert messages[1]["content"] is None
+    assert messages[1]["payload_id"] == "payload_1"
+    assert messages[1]["size"] == transcript.INLINE_PAYLOAD_CHARS + 1
+    assert payloads == {"payload_1": over_limit["content"]}
+    assert over_limit["content"] is not None  # the input message is left untouched
+
+
+def test_split_payloads_only_strips_tool_messages():
+    big = "x" * (transcript.INLINE_PAYLOAD_CHARS * 2)
+    messages = [
+        {"role": "assistant", "type": "response", "content": big},
+        {"role": "thought", "type": "thought", "content": big},
+        {**tool_response(0), "type": "tool_call", "content": {"sql": big}},
+    ]
+
+    light, payloads = transcript.split_payloads(messages)
+
+    assert light[:2] == messages[:2]
+    assert light[2]["payload_id"] == "payload_2"
+    assert list(payloads) == ["payload_2"]
+
+
+def test_split_turns_starts_a_turn_at_each_user_message():
+    messages = [
+        {"role": "assistant", "content": "welcome"},
+        {"role": "user", "content": "q1"},
+        {"role": "thought", "content": "t"},
+        {"role": "assistant", "content": "a1"},
+        {"role": "user", "content": "q2"},
+    ]
+
+    turns = transcript.split_turns(messages)
+
+    assert [[m["content"] for m in turn] for turn in turns] == [
+        ["welcome"],
+        ["q1", "t", "a1"],
+        ["q2"],
+    ]
+    assert transcript.split_turns([]) == []
+
+
+@pytest.mark.parametrize(
+    "turn_count, older_count",
+    [(transcript.RECENT_TURNS, 0), (transcript.RECENT_TURNS + 1, 1)],
+)
+def test_render_transcript_collapses_turns_beyond_the_recent_ones(
+    monkeypatch, turn_count, older_count
+):
+    rendered, toggles = [], []
+    monkeypatch.setattr(
+        transcript, "render_message", lambda msg, *args, key: rendered.append(key)
+    )
+    monkeypatch.setattr(
+        transcript.st, "toggle", lambda label, key: toggles.append(label) or False
+    )
+    messages = []
+    for i in range(turn_count):
+        messages += [
+            {"role": "user", "content": f"q{i}"},
+            {"role": "assistant", "content": f"a{i}"},
+        ]
+
+    transcript.render_transcript(messages, "picture")
+
+    assert toggles == ([f"Show {older_count} earlier turns"] if older_count else [])
+    # Keys count down from the end, and older turns are skipped while collapsed
+    assert rendered == [f"msg_{n}" for n in range(2 * transcript.RECENT_TURNS, 0, -1)]
@@ -0,0 +1,181 @@
+import threading
+
+import pytest
+
+import config
+import stream_events
+import usage_modules
+
+
+@pytest.fixture(autouse=True)
+def usage_db(monkeypatch, tmp_path):
+    """A fresh usage database per test."""
+    monkeypatch.setattr(config, "USAGE_DB_PATH", str(tmp_path / "usage.sqlite3"))
+    monkeypatch.setattr(config, "USAGE_PROMPT_PRICE_PER_MTOK", 1.0)
+    monkeypatch.setattr(config, "USAGE_OUTPUT_PRICE_PER_MTOK", 4.0)
+    monkeypatch.setattr(usage_modules, "_connection", None)
+    yield
+    usage_modules._writer.flush()
+    if usage_modules._connection is not None:
+        usage_modules._connection.close()
+
+
+def record(
+    channel="C1", user_id="U1", session_id="s1", file_list=None, usage=(), tools=0, fail=False
+):
+    """Runs one query's worth of stream events through a UsageRecorder."""
+    recorder = usage_modules.UsageRecorder(
+        "slack", channel, f"#{channel.lower()}", user_id, session_id, file_list
+    )
+    try:
+        with recorder:
+            demux = stream_events.StreamDemux(recorder)
+            demux.feed({"content": {"parts": [{"text": "answer"}]}})
+            for _ in range(tools):
+                demux.feed({"content": {"parts": [{"function_call": {"name": "run_query"}}]}})
+            for prompt, output, thought in usage:
+                demux.feed(
+                    {
+                        "invocation_id": "e-1",
+                        "usage_metadata": {
+                            "prompt_token_count": prompt,
+                            "candidates_token_count": output,
+                            "thoughts_token_count": thought,
+                            "total_token_count": prompt + output + thought,
+                        },
+                    }
+                )
+            if fail:
+                raise RuntimeError("stream broke")
+    except RuntimeError:
+        pass
+
+
+def test_rows_are_written_off_the_callers_thread(monkeypatch):
+    threads = []
+    insert = usage_modules._Writer._insert
+
+    def recording_insert(self, rows):
+        threads.append(threading.current_thread().name)
+        insert(self, rows)
+
+    monkeypatch.setattr(usage_modules._Writer, "_insert", recording_insert)
+    record(usage=[(10, 1, 0)])
+    usage_modules._writer.flush()
+    assert threads == ["usage-writer"]
+    assert usage_modules.summarize()[0]["prompt_tokens"] == 10
+
+
+def test_summarize_groups_by_channel_most_tokens_first():
+    record("C1", usage=[(100, 10, 5), (200, 20, 0)], tools=2)
+    record("C1", usage=[(50, 5, 0)], fail=True)
+    record("C2", usage=[(1000, 100, 0)])
+
+    rows = usage_modules.summarize("channel")
+    assert [row["key"] for row in rows] == ["#c2", "#c1"]
+    c1 = rows[1]
+    assert c1["invocations"] == 2
+    assert (c1["prompt_tokens"], c1["output_tokens"], c1["thought_tokens"]) == (350, 35, 5)
+    assert c1["total_tokens"] == 390
+    assert c1["tool_calls"] == 2
+    assert c1["failed"] == 1
+    assert c1["avg_first_token_s"] is not None
+    assert c1["cost_usd"] == pytest.approx((350 * 1.0 + 40 * 4.0) / 1_000_000)
+
+
+def test_summarize_by_attachment_mix():
+    png = {"name": "a.png", "mime_type": "image/png", "content": b"x" * 10}
+    pdf = {"name": "b.pdf", "mime_type": "application/pdf", "content": b"x" * 20}
+    record(file_list=[pdf, png], usage=[(10, 1, 0)])
+    record(file_list=[png, pdf], usage=[(10, 1, 0)])
+    record(usage=[(5, 1, 0)])
+    rows = {row["key"]: row for row in usage_modules.summarize("attachments")}
+    assert rows["application/pdf+image/png"]["invocations"] == 2
+    assert rows["application/pdf+image/png"]["attachment_bytes"] == 60
+    assert rows["none"]["invocations"] == 1
+
+
+def test_summarize_filters_by_channel_and_period(monkeypatch):
+    record("C1", user_id="U1", usage=[(10, 1, 0)])
+    record("C2", user_id="U2", usage=[(10, 1, 0)])
+    assert [row["key"] for row in usage_modules.summarize("user", channel="C2")] == ["U2"]
+
+    now = usage_modules.time.time()
+    monkeypatch.setattr(usage_modules.time, "time", lambda: now + 2 * 86400)
+    assert usage_modules.summarize("user", days=1) == []
+    assert len(usage_modules.summarize("user", days=3)) == 2
+
+
+def test_summarize_respects_the_limit():
+    for i in range(5):
+        record(f"C{i}", usage=[(10 * (i + 1), 1, 0)])
+    rows = usage_modules.summarize("channel", limit=2)
+    assert [row["key"] for row in rows] == ["#c4", "#c3"]
+
+
+def test_summarize_without_a_database(monkeypatch):
+    monkeypatch.setattr(config, "USAGE_DB_PATH", "")
+    record(usage=[(10, 1, 0)])
+    assert usage_modules.summarize() == []
+
+
+def test_format_report():
+    record("C1", usage=[(1_000_000, 0, 0)])
+    report = usage_modules.format_report(usage_modules.summarize(), "channel", 30)
+    lines = report.split("\n")
+    assert lines[0] == "Token usage by channel, last 30 days"
+    assert lines[1].split() == [
+        "channel", "calls", "prompt", "output", "thought", "tools", "att.", "MB", "avg", "s", "USD"
+    ]
+    assert lines[2].split()[:3] == ["#c1", "1", "1000000"]
+    assert lines[2].endswith("1.00")
+    assert usage_modules.format_report([], "user", 7) == "No usage recorded in the last 7 days."
+
+
+@pytest.mark.parametrize(
+    "args, expected",
+    [
+        ([], ("channel", 30.0)),
+        (["user"], ("user", 30.0)),
+        (["7", "Session"], ("session", 7.0)),
+    ],
+)
+def test_parse_usage_args(args, expected):
+    assert usage_modules.parse_usage_args(args) == expected
+
+
+def test_parse_usage_args_rejects_unknown_words():
+    with pytest.raises(ValueError, match="Usage: /usage"):
+        usage_modules.parse_usage_args(["weekly"])
+
+
+def test_flush_does_not_wait_on_a_stopped_writer(monkeypatch):
+    monkeypatch.setattr(usage_modules._Writer, "_insert", lambda self, rows: None)
+    writer = usage_modules._Writer()
+    writer.write(("row",))
+    writer.flush()
+    writer.shutdown()
+    writer.write(("row",))  # queued after the thread has exited
+
+    assert writer.flush(timeout=30) is False
+
+
+def test_flush_gives_up_after_the_timeout(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(usage_modules._Writer, "_insert", lambda self, rows: release.wait(5))
+    writer = usage_modules._Writer()
+    writer.write(("row",))
+
+    assert writer.flush(timeout=0.05) is False
+    release.set()
+    assert writer.flush() is True
+    writer.shutdown()
+
+
+def test_summarize_runs_when_rows_cannot_be_flushed(monkeypatch, caplog):
+    record(usage=[(100, 10, 0)])
+    usage_modules._writer.flush()
+    monkeypatch.setattr(usage_modules._writer, "flush", lambda: False)
+
+    assert len(usage_modules.summarize()) == 1
+    assert "rows are still queued" in caplog.text
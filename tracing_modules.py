@@ -0,0 +1,300 @@
+"""
+Lightweight span tracing for the bot pipeline.
+
+A request starts a trace with start_trace(); nested span() blocks record the
+stages inside it. The current span is kept in a context variable, so spans nest
+across awaits without being passed around. Finished spans are exported from a
+background thread, either as JSON lines (TRACE_FILE) or to an OTLP/HTTP
+collector (TRACE_OTLP_ENDPOINT).
+
+Requests that aren't sampled, and code running outside a trace, get a no-op
+span, so instrumentation costs next to nothing when tracing is off.
+"""
+import atexit
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+import requests
+
+import config
+import stream_events
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_SIZE = 100
+EXPORT_INTERVAL_SECONDS = 2.0
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: str | None, attributes: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.events: list[tuple[str, int]] = []
+        self.error: str | None = None
+        self.start_time_ns = time.time_ns()
+        self._start_perf_ns = time.perf_counter_ns()
+        self.duration_ns = 0
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def mark(self, name: str) -> None:
+        """Records a point in time within the span (e.g. "first_text"), once per name."""
+        if any(event_name == name for event_name, _ in self.events):
+            return
+        elapsed_ns = time.perf_counter_ns() - self._start_perf_ns
+        self.events.append((name, self.start_time_ns + elapsed_ns))
+        self.attributes[f"{name}_ms"] = round(elapsed_ns / 1e6, 3)
+
+    def end(self) -> None:
+        self.duration_ns = time.perf_counter_ns() - self._start_perf_ns
+        _exporter.export(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_time_ns,
+            "duration_ms": round(self.duration_ns / 1e6, 3),
+            "attributes": self.attributes,
+            "events": [{"name": name, "time_unix_nano": ts} for name, ts in self.events],
+            "error": self.error,
+        }
+
+    def to_otlp(self) -> dict:
+        otlp_span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_time_ns),
+            "endTimeUnixNano": str(self.start_time_ns + self.duration_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "events": [
+                {"name": name, "timeUnixNano": str(ts)} for name, ts in self.events
+            ],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            otlp_span["parentSpanId"] = self.parent_id
+        return otlp_span
+
+
+class _NoopSpan:
+    """Stands in for a span when the request isn't traced."""
+
+    def set(self, **attributes) -> None:
+        pass
+
+    def mark(self, name: str) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+_current_span: contextvars.ContextVar[Span | _NoopSpan | None] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+def current_span() -> Span | _NoopSpan:
+    return _current_span.get() or NOOP_SPAN
+
+
+@contextlib.contextmanager
+def start_trace(name: str, **attributes):
+    """
+    Starts the root span of a request, subject to TRACE_SAMPLE_RATE.
+    Inside an existing trace (e.g. a retry), it's recorded as a child span instead.
+    """
+    if _current_span.get() is not None:
+        with span(name, **attributes) as child:
+            yield child
+        return
+    if config.TRACE_EXPORTER and random.random() < config.TRACE_SAMPLE_RATE:
+        root = Span(name, os.urandom(16).hex(), None, attributes)
+    else:
+        root = NOOP_SPAN
+    with _activate(root):
+        yield root
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """Records a stage of the current request. A no-op outside a sampled trace."""
+    parent = _current_span.get()
+    if not isinstance(parent, Span):
+        yield NOOP_SPAN
+        return
+    with _activate(Span(name, parent.trace_id, parent.span_id, attributes)) as child:
+        yield child
+
+
+def traced(name: str, root: bool = False):
+    """Decorator form of span() for async functions; with `root`, of start_trace()."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with (start_trace if root else span)(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextlib.contextmanager
+def _activate(active_span: Span | _NoopSpan):
+    token = _current_span.set(active_span)
+    try:
+        yield active_span
+    except BaseException as e:
+        if isinstance(active_span, Span):
+            active_span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        if isinstance(active_span, Span):
+            active_span.end()
+
+
+class StreamSpanSink(stream_events.StreamSink):
+    """Marks the arrival of the first answer text on the stream span."""
+
+    def __init__(self, stream_span: Span | _NoopSpan):
+        self.stream_span = stream_span
+
+    def on_text_delta(self, event: stream_events.TextDelta):
+        self.stream_span.mark("first_text")
+
+
+# --- Export ---
+def _otlp_attributes(attributes: dict) -> list[dict]:
+    result = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            typed_value = {"boolValue": value}
+        elif isinstance(value, int):
+            typed_value = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed_value = {"doubleValue": value}
+        else:
+            typed_value = {"stringValue": str(value)}
+        result.append({"key": key, "value": typed_value})
+    return result
+
+
+def write_jsonl(spans: list[Span]) -> None:
+    os.makedirs(os.path.dirname(config.TRACE_FILE) or ".", exist_ok=True)
+    with open(config.TRACE_FILE, "a", encoding="utf-8") as f:
+        for finished_span in spans:
+            f.write(json.dumps(finished_span.to_dict(), default=str) + "\n")
+
+
+def post_otlp(spans: list[Span]) -> None:
+    payload = {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": _otlp_attributes(
+                        {"service.name": config.TRACE_SERVICE_NAME}
+                    )
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": __name__},
+                        "spans": [finished_span.to_otlp() for finished_span in spans],
+                    }
+                ],
+            }
+        ]
+    }
+    resp = requests.post(config.TRACE_OTLP_ENDPOINT, json=payload, timeout=5)
+    resp.raise_for_status()
+
+
+class _Exporter:
+    """
+    Batches finished spans and writes them from a daemon thread. The queue is
+    bounded (TRACE_QUEUE_SIZE): when the writer falls behind, spans are dropped
+    and counted instead of buffered.
+    """
+
+    def __init__(self):
+        self._queue: queue.Queue = queue.Queue(maxsize=config.TRACE_QUEUE_SIZE)
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def export(self, finished_span: Span) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="span-exporter", daemon=True
+                    )
+                    self._thread.start()
+                    atexit.register(self.shutdown)
+        try:
+            self._queue.put_nowait(finished_span)
+        except queue.Full:
+            self.dropped += 1
+
+    def shutdown(self) -> None:
+        try:
+            # The writer thread frees slots as it exports
+            self._queue.put(None, timeout=5)
+        except queue.Full:
+            return
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        batch = []
+        deadline = time.monotonic() + EXPORT_INTERVAL_SECONDS
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = False
+            if item:
+                batch.append(item)
+            if batch and (
+                item is None
+                or len(batch) >= EXPORT_BATCH_SIZE
+                or time.monotonic() >= deadline
+            ):
+                self._flush(batch)
+                batch = []
+            if item is None:
+                return
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + EXPORT_INTERVAL_SECONDS
+
+    def _flush(self, batch: list[Span]) -> None:
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            logger.warning(f"Dropped {dropped} spans (export queue full)")
+        try:
+            if config.TRACE_EXPORTER == "otlp":
+                post_otlp(batch)
+            else:
+                write_jsonl(batch)
+        except Exception as e:
+            logger.warning(f"Dropped {len(batch)} spans: {e}")
+
+
+_exporter = _Exporter()
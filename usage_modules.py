@@ -0,0 +1,360 @@
+"""
+Token usage accounting.
+
+UsageRecorder wraps one agent query: as a stream sink it adds up the usage
+metadata of every streamed event (prompt, output and thought tokens) and counts
+tool calls, and on exit it queues one row per invocation for a writer thread,
+which stores it in a local SQLite database (USAGE_DB_PATH), so the end of a
+stream never waits on the disk. summarize() aggregates the rows per channel, user,
+session or attachment mix for the /usage commands and the Streamlit admin view.
+"""
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import config
+import stream_events
+
+logger = logging.getLogger(__name__)
+
+# /usage groupings and the column each one aggregates on
+GROUP_BY_COLUMNS = {
+    "channel": "channel_name",
+    "user": "user_id",
+    "session": "session_id",
+    "attachments": "attachment_types",
+    "frontend": "frontend",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS invocations (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    frontend TEXT NOT NULL,
+    channel TEXT,
+    channel_name TEXT,
+    user_id TEXT,
+    session_id TEXT,
+    invocation_id TEXT,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    thought_tokens INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    tool_calls INTEGER NOT NULL DEFAULT 0,
+    attachment_count INTEGER NOT NULL DEFAULT 0,
+    attachment_bytes INTEGER NOT NULL DEFAULT 0,
+    attachment_types TEXT NOT NULL DEFAULT 'none',
+    latency_ms REAL,
+    first_token_ms REAL,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_invocations_ts ON invocations (ts);
+CREATE INDEX IF NOT EXISTS ix_invocations_channel ON invocations (channel, ts);
+"""
+
+_INSERT = """
+INSERT INTO invocations (
+    ts, frontend, channel, channel_name, user_id, session_id,
+    invocation_id, prompt_tokens, output_tokens, thought_tokens,
+    total_tokens, tool_calls, attachment_count, attachment_bytes,
+    attachment_types, latency_ms, first_token_ms, failed
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_connection: sqlite3.Connection | None = None
+_lock = threading.Lock()
+
+
+def get_connection() -> sqlite3.Connection | None:
+    """Shared connection to the usage database, created on first use. None if disabled."""
+    global _connection
+    if not config.USAGE_DB_PATH:
+        return None
+    with _lock:
+        if _connection is None:
+            os.makedirs(os.path.dirname(config.USAGE_DB_PATH) or ".", exist_ok=True)
+            # The bots and the Streamlit app may share the file: WAL lets them write concurrently
+            connection = sqlite3.connect(
+                config.USAGE_DB_PATH, timeout=5, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            _connection = connection
+    return _connection
+
+
+def estimate_cost(prompt_tokens: int, output_tokens: int, thought_tokens: int) -> float:
+    return (
+        prompt_tokens * config.USAGE_PROMPT_PRICE_PER_MTOK
+        + (output_tokens + thought_tokens) * config.USAGE_OUTPUT_PRICE_PER_MTOK
+    ) / 1_000_000
+
+
+class UsageRecorder(stream_events.StreamSink):
+    """
+    Context manager around one agent query. Receives the stream as a sink and
+    records the totals when the block exits, failed queries included.
+    """
+
+    wants_tools = True
+    wants_usage = True
+
+    def __init__(
+        self,
+        frontend: str,
+        channel: str,
+        channel_name: str,
+        user_id: str,
+        session_id: str | None,
+        file_list: list | None = None,
+    ):
+        self.frontend = frontend
+        self.channel = channel
+        self.channel_name = channel_name
+        self.user_id = user_id
+        self.session_id = session_id
+        file_list = file_list or []
+        self.attachment_count = len(file_list)
+        self.attachment_bytes = sum(len(file["content"]) for file in file_list)
+        # e.g. "application/pdf+image/png"; sorted so the same mix groups together
+        self.attachment_types = (
+            "+".join(sorted({file.get("mime_type") or "unknown" for file in file_list}))
+            or "none"
+        )
+        self.invocation_id: str | None = None
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.thought_tokens = 0
+        self.total_tokens = 0
+        self.tool_calls = 0
+        self._start = 0.0
+        self._first_token_ms: float | None = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def on_text_delta(self, event: stream_events.TextDelta):
+        if self._first_token_ms is None:
+            self._first_token_ms = (time.perf_counter() - self._start) * 1000
+
+    def on_tool_call(self, event: stream_events.ToolCall):
+        self.tool_calls += 1
+
+    def on_usage(self, event: stream_events.Usage):
+        self.invocation_id = event.invocation_id or self.invocation_id
+        self.prompt_tokens += event.prompt_tokens
+        self.output_tokens += event.output_tokens
+        self.thought_tokens += event.thought_tokens
+        self.total_tokens += event.total_tokens
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        failed = exc_type is not None and issubclass(exc_type, Exception)
+        try:
+            self.record((time.perf_counter() - self._start) * 1000, failed)
+        except Exception as e:
+            logger.warning(f"Could not record token usage: {e}")
+        return False
+
+    def record(self, latency_ms: float, failed: bool) -> None:
+        if not config.USAGE_DB_PATH:
+            return
+        _writer.write(
+            (
+                time.time(),
+                self.frontend,
+                self.channel,
+                self.channel_name,
+                self.user_id,
+                self.session_id,
+                self.invocation_id,
+                self.prompt_tokens,
+                self.output_tokens,
+                self.thought_tokens,
+                self.total_tokens,
+                self.tool_calls,
+                self.attachment_count,
+                self.attachment_bytes,
+                self.attachment_types,
+                latency_ms,
+                self._first_token_ms,
+                int(failed),
+            )
+        )
+
+
+# Longest a report waits for queued rows before running without them.
+FLUSH_TIMEOUT_SECONDS = 5
+
+
+class _Writer:
+    """Inserts recorded rows from a daemon thread, whatever is queued in one transaction."""
+
+    def __init__(self):
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def write(self, row: tuple) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="usage-writer", daemon=True
+                    )
+                    self._thread.start()
+                    atexit.register(self.shutdown)
+        self._queue.put(row)
+
+    def flush(self, timeout: float = FLUSH_TIMEOUT_SECONDS) -> bool:
+        """
+        Waits until every queued row is written, for at most `timeout` seconds.
+        False if rows are still pending, e.g. because the writer thread has stopped.
+        """
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._thread is None or not self._thread.is_alive():
+                    return False
+                # Short waits, so a writer that stops meanwhile ends the wait too
+                self._queue.all_tasks_done.wait(min(remaining, 0.1))
+        return True
+
+    def shutdown(self) -> None:
+        self._queue.put(None)
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while True:
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            rows = [item for item in items if item is not None]
+            try:
+                if rows:
+                    self._insert(rows)
+            except Exception as e:
+                logger.warning(f"Could not record token usage of {len(rows)} queries: {e}")
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+            if len(rows) < len(items):
+                return
+
+    def _insert(self, rows: list[tuple]) -> None:
+        connection = get_connection()
+        if connection is None:
+            return
+        with _lock, connection:
+            connection.executemany(_INSERT, rows)
+
+
+_writer = _Writer()
+
+
+# --- Reporting ---
+def summarize(
+    group_by: str = "channel",
+    days: float = 30,
+    channel: str | None = None,
+    limit: int = 20,
+) -> list[dict]:
+    """
+    Aggregates recorded invocations over the last `days`, grouped by one of
+    GROUP_BY_COLUMNS, most tokens first. `channel` restricts it to one channel.
+    """
+    column = GROUP_BY_COLUMNS[group_by]
+    connection = get_connection()
+    if connection is None:
+        return []
+    # So the report includes the queries that just ended
+    if not _writer.flush():
+        logger.warning("Usage report may miss recent queries: rows are still queued")
+    since = time.time() - days * 86400
+    where = "ts >= ?"
+    params: list = [since]
+    if channel is not None:
+        where += " AND channel = ?"
+        params.append(channel)
+    with _lock:
+        cursor = connection.execute(
+            f"""
+            SELECT
+                {column} AS key,
+                COUNT(*) AS invocations,
+                SUM(prompt_tokens) AS prompt_tokens,
+                SUM(output_tokens) AS output_tokens,
+                SUM(thought_tokens) AS thought_tokens,
+                SUM(total_tokens) AS total_tokens,
+                SUM(tool_calls) AS tool_calls,
+                SUM(attachment_bytes) AS attachment_bytes,
+                AVG(latency_ms) / 1000 AS avg_latency_s,
+                AVG(first_token_ms) / 1000 AS avg_first_token_s,
+                SUM(failed) AS failed
+            FROM invocations
+            WHERE {where}
+            GROUP BY {column}
+            ORDER BY total_tokens DESC
+            LIMIT ?
+            """,
+            params + [limit],
+        )
+        names = [description[0] for description in cursor.description]
+        rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+    for row in rows:
+        row["cost_usd"] = estimate_cost(
+            row["prompt_tokens"], row["output_tokens"], row["thought_tokens"]
+        )
+    return rows
+
+
+def format_report(rows: list[dict], group_by: str, days: float) -> str:
+    """Plain-text table of summarize() rows for chat replies."""
+    if not rows:
+        return f"No usage recorded in the last {days:g} days."
+    show_cost = bool(
+        config.USAGE_PROMPT_PRICE_PER_MTOK or config.USAGE_OUTPUT_PRICE_PER_MTOK
+    )
+    lines = [
+        f"Token usage by {group_by}, last {days:g} days",
+        f"{group_by:<28} {'calls':>6} {'prompt':>10} {'output':>9} {'thought':>9} "
+        f"{'tools':>6} {'att. MB':>8} {'avg s':>6}" + (f" {'USD':>8}" if show_cost else ""),
+    ]
+    for row in rows:
+        lines.append(
+            f"{str(row['key'])[:28]:<28} {row['invocations']:>6} {row['prompt_tokens']:>10} "
+            f"{row['output_tokens']:>9} {row['thought_tokens']:>9} {row['tool_calls']:>6} "
+            f"{row['attachment_bytes'] / (1024 * 1024):>8.1f} {row['avg_latency_s'] or 0:>6.1f}"
+            + (f" {row['cost_usd']:>8.2f}" if show_cost else "")
+        )
+    return "\n".join(lines)
+
+
+def parse_usage_args(args: list[str]) -> tuple[str, float]:
+    """
+    Parses "/usage [channel|user|session|attachments|frontend] [days]".
+    Raises ValueError with a usage hint on bad input.
+    """
+    group_by, days = "channel", 30.0
+    for arg in args:
+        if arg.lower() in GROUP_BY_COLUMNS:
+            group_by = arg.lower()
+        else:
+            try:
+                days = float(arg)
+            except ValueError:
+                raise ValueError(
+                    f"Usage: /usage [{'|'.join(GROUP_BY_COLUMNS)}] [days]"
+                ) from None
+    return group_by, days
+